@@ -0,0 +1,4 @@
+"""
+Benchmarks that run on synthetic data and small, locally built models. Each module can be run as a script, for
+instance python -m benchmarks.embeddings.
+"""
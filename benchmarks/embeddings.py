@@ -0,0 +1,235 @@
+"""
+Measures how fast embeddings embed a synthetic corpus: tokens per second, latency percentiles per mini-batch and peak
+memory. All models are small and built locally, so that results only depend on the code and the machine. Results are
+written as JSON and can be compared to those of another commit.
+
+    python -m benchmarks.embeddings --sentences 2000 --output after.json --compare before.json
+"""
+import argparse
+import json
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Dict
+
+import numpy as np
+import torch
+
+import flair
+from flair.data import Sentence
+from flair.embeddings import Embeddings, WordEmbeddings, CharacterEmbeddings, FlairEmbeddings, \
+    PooledFlairEmbeddings, StackedEmbeddings, DocumentPoolEmbeddings, DocumentRNNEmbeddings, DocumentLMEmbeddings
+
+from benchmarks.synthetic import make_vocabulary, make_corpus, make_word_vectors, make_char_dictionary, \
+    make_language_model, LENGTH_DISTRIBUTIONS
+
+EMBEDDINGS = ['word', 'char', 'flair', 'pooled-flair', 'stacked', 'document-pool', 'document-rnn', 'document-lm']
+
+
+def make_resources(directory: Path, vocabulary: List[str], hidden_size: int) -> Dict[str, str]:
+    """Writes word vectors, a character dictionary and a forward and backward language model to the directory."""
+    resources = {
+        'word_vectors': str(make_word_vectors(directory / 'words.gensim', vocabulary)),
+        'char_dictionary': str(directory / 'chars.pkl'),
+    }
+    make_char_dictionary(directory / 'chars.pkl')
+
+    for direction, is_forward_lm in [('forward', True), ('backward', False)]:
+        torch.manual_seed(1)
+        path = directory / f'lm-{direction}.pt'
+        make_language_model(hidden_size, is_forward_lm=is_forward_lm).save(path, with_decoder=False)
+        resources[f'{direction}_lm'] = str(path)
+
+    return resources
+
+
+def build_embeddings(name: str, resources: Dict[str, str]) -> Embeddings:
+    if name == 'word':
+        return WordEmbeddings(resources['word_vectors'])
+    if name == 'char':
+        return CharacterEmbeddings(resources['char_dictionary'])
+    if name == 'flair':
+        return FlairEmbeddings(resources['forward_lm'])
+    if name == 'pooled-flair':
+        return PooledFlairEmbeddings(FlairEmbeddings(resources['forward_lm']))
+    if name == 'stacked':
+        return StackedEmbeddings([WordEmbeddings(resources['word_vectors']),
+                                  FlairEmbeddings(resources['forward_lm']),
+                                  FlairEmbeddings(resources['backward_lm'])])
+    if name == 'document-pool':
+        return DocumentPoolEmbeddings([WordEmbeddings(resources['word_vectors']),
+                                       FlairEmbeddings(resources['forward_lm'])], cache_size=0)
+    if name == 'document-rnn':
+        return DocumentRNNEmbeddings([WordEmbeddings(resources['word_vectors'])])
+    if name == 'document-lm':
+        return DocumentLMEmbeddings([FlairEmbeddings(resources['forward_lm']),
+                                     FlairEmbeddings(resources['backward_lm'])])
+    raise ValueError(f'Unknown embeddings "{name}". Use one of {EMBEDDINGS}.')
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident memory of this process in MB, or None where it cannot be determined."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def benchmark(embeddings: Embeddings, corpus: List[Sentence], batch_size: int) -> dict:
+    """Embeds the corpus in mini-batches after one warm-up batch. Embeddings are cleared after each batch, so that
+    static embeddings are computed as well."""
+    batches = [corpus[i:i + batch_size] for i in range(0, len(corpus), batch_size)]
+
+    latencies = []
+    with torch.no_grad():
+        embeddings.embed(batches[0])
+        for sentence in batches[0]:
+            sentence.clear_embeddings()
+
+        for batch in batches:
+            start = time.perf_counter()
+            embeddings.embed(batch)
+            latencies.append(time.perf_counter() - start)
+
+            for sentence in batch:
+                sentence.clear_embeddings()
+
+    tokens = sum(len(sentence) for sentence in corpus)
+    seconds = sum(latencies)
+    latencies_ms = np.array(latencies) * 1000
+
+    return {
+        'embedding_length': embeddings.embedding_length,
+        'sentences': len(corpus),
+        'tokens': tokens,
+        'seconds': seconds,
+        'tokens_per_second': tokens / seconds,
+        'sentences_per_second': len(corpus) / seconds,
+        'latency_ms': {
+            'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p90': float(np.percentile(latencies_ms, 90)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'max': float(latencies_ms.max()),
+        },
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_one(name: str, resources: Dict[str, str], config: dict) -> dict:
+    """Builds the corpus and the embeddings and benchmarks them. Exceptions are reported as results."""
+    torch.manual_seed(1)
+    if config['threads'] is not None:
+        torch.set_num_threads(config['threads'])
+
+    vocabulary = make_vocabulary(config['vocabulary'], config['seed'])
+    corpus = make_corpus(config['sentences'], config['mean_length'], config['length_distribution'], vocabulary,
+                         config['seed'])
+    try:
+        return benchmark(build_embeddings(name, resources), corpus, config['batch_size'])
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+
+
+def run(names: List[str], config: dict, isolate: bool = True) -> dict:
+    """
+    Benchmarks the given embeddings.
+    :param names: embeddings to benchmark, see EMBEDDINGS
+    :param config: size and shape of the corpus and models, see the command line arguments
+    :param isolate: if True, each embedding runs in a fresh process, so that its peak memory is measured alone
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        vocabulary = make_vocabulary(config['vocabulary'], config['seed'])
+        resources = make_resources(Path(directory), vocabulary, config['hidden_size'])
+
+        for name in names:
+            if isolate:
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    results[name] = pool.apply(run_one, (name, resources, config))
+            else:
+                results[name] = run_one(name, resources, config)
+
+    return {
+        'commit': _get_commit(),
+        'flair': flair.__version__,
+        'torch': torch.__version__,
+        'device': str(flair.device),
+        'threads': config['threads'] if config['threads'] is not None else torch.get_num_threads(),
+        'config': config,
+        'results': results,
+    }
+
+
+def _get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=str(Path(__file__).parent), stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f'commit {report["commit"]}, {report["threads"]} threads on {report["device"]}')
+    print(f'{"embeddings":15s} {"tokens/s":>10s} {"p50 ms":>8s} {"p90 ms":>8s} {"p99 ms":>8s} {"peak MB":>8s}')
+
+    for name, result in report['results'].items():
+        if 'error' in result:
+            print(f'{name:15s} failed: {result["error"]}')
+            continue
+
+        latency = result['latency_ms']
+        peak = f'{result["peak_rss_mb"]:8.0f}' if result['peak_rss_mb'] is not None else f'{"-":>8s}'
+        line = f'{name:15s} {result["tokens_per_second"]:10.0f} {latency["p50"]:8.1f} {latency["p90"]:8.1f} ' \
+               f'{latency["p99"]:8.1f} {peak}'
+
+        baseline_result = baseline['results'].get(name, {}) if baseline is not None else {}
+        if 'tokens_per_second' in baseline_result:
+            line += f'  {result["tokens_per_second"] / baseline_result["tokens_per_second"]:.2f}x of baseline'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', nargs='+', choices=EMBEDDINGS, default=EMBEDDINGS)
+    parser.add_argument('--sentences', type=int, default=1000)
+    parser.add_argument('--mean-length', type=int, default=20)
+    parser.add_argument('--length-distribution', choices=LENGTH_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--vocabulary', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--hidden-size', type=int, default=256, help='hidden size of the character language models')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-isolate', action='store_true', help='run all embeddings in this process')
+    parser.add_argument('--output', type=Path, help='JSON file to which the results are written')
+    parser.add_argument('--compare', type=Path, help='JSON file of an earlier run to compare to')
+    args = parser.parse_args()
+
+    config = {
+        'sentences': args.sentences,
+        'mean_length': args.mean_length,
+        'length_distribution': args.length_distribution,
+        'vocabulary': args.vocabulary,
+        'batch_size': args.batch_size,
+        'hidden_size': args.hidden_size,
+        'threads': args.threads,
+        'seed': args.seed,
+    }
+
+    report = run(args.embeddings, config, isolate=not args.no_isolate)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
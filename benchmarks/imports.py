@@ -0,0 +1,79 @@
+"""
+Measures how long importing flair takes in a fresh interpreter, which libraries it loads and which modules take the
+most time, as reported by python -X importtime.
+
+    python -m benchmarks.imports --statement "import flair.models" --repeats 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+# libraries that take long to import and are only needed by some embeddings, visualizations or parameter search
+HEAVY_MODULES = ['gensim', 'bpemb', 'pytorch_pretrained_bert', 'sklearn', 'matplotlib', 'mpld3', 'hyperopt']
+
+
+def time_import(statement: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], check=True)
+    return time.perf_counter() - start
+
+
+def loaded_heavy_modules(statement: str) -> List[str]:
+    code = f'{statement}; import sys; print(",".join(m for m in {HEAVY_MODULES} if m in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True).stdout.decode().strip()
+    return output.split(',') if output else []
+
+
+def slowest_modules(statement: str, top: int) -> List[Tuple[str, float]]:
+    """Returns the packages whose modules took the most time to import, in seconds."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], stderr=subprocess.PIPE,
+                            check=True).stderr.decode()
+
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue
+        # the time of each module itself, without its imports, is added to its top-level package
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1e6
+
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def run(statement: str, repeats: int, top: int) -> dict:
+    times = sorted(time_import(statement) for _ in range(repeats))
+    return {
+        'statement': statement,
+        'python': sys.version.split()[0],
+        'seconds': {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1]},
+        'heavy_modules': loaded_heavy_modules(statement),
+        'slowest_modules': slowest_modules(statement, top),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--statement', default='import flair, flair.embeddings, flair.models')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', type=Path, help='JSON file to which the results are written')
+    args = parser.parse_args()
+
+    report = run(args.statement, args.repeats, args.top)
+
+    print(f'{report["statement"]}: median {report["seconds"]["median"]:.2f} s, min {report["seconds"]["min"]:.2f} s')
+    print(f'heavy modules loaded: {", ".join(report["heavy_modules"]) or "none"}')
+    print('slowest packages:')
+    for name, seconds in report['slowest_modules']:
+        print(f'  {name:30s} {seconds:6.2f} s')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
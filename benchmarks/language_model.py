@@ -0,0 +1,66 @@
+"""
+Compares computing character LM representations with and without the decoder, as well as the size and loading
+time of language model files saved with and without decoder weights.
+
+    python -m benchmarks.language_model --hidden-size 2048 --batch-size 32 --characters 400
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from flair.models import LanguageModel
+
+from benchmarks.synthetic import make_language_model
+
+
+def time_it(function, repeats: int) -> float:
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def run(hidden_size: int, batch_size: int, characters: int, repeats: int):
+    model = make_language_model(hidden_size)
+    strings = ['the quick brown fox jumps over the lazy dog '[i % 7:] * (characters // 40) for i in range(batch_size)]
+    longest = max(len(string) for string in strings)
+    strings = [string.ljust(longest) for string in strings]
+
+    batch = torch.LongTensor([[model.dictionary.get_idx_for_item(char) for char in string]
+                              for string in strings]).transpose(0, 1)
+
+    with torch.no_grad():
+        with_decoder = time_it(lambda: model.forward(batch, model.init_hidden(batch_size)), repeats)
+        encoder_only = time_it(lambda: model.get_representation(strings, chars_per_chunk=longest), repeats)
+
+    print(f'representations of {batch_size} x {longest} characters, hidden size {hidden_size}')
+    print(f'  with decoder:   {with_decoder * 1000:.1f} ms')
+    print(f'  encoder only:   {encoder_only * 1000:.1f} ms ({with_decoder / encoder_only:.2f}x)')
+
+    with tempfile.TemporaryDirectory() as directory:
+        full_file, stripped_file = Path(directory) / 'full.pt', Path(directory) / 'stripped.pt'
+        model.save(full_file)
+        model.save(stripped_file, with_decoder=False)
+
+        load_full = time_it(lambda: LanguageModel.load_language_model(full_file), repeats)
+        load_stripped = time_it(lambda: LanguageModel.load_language_model(stripped_file), repeats)
+
+        print('model files')
+        print(f'  with decoder:   {full_file.stat().st_size / 2 ** 20:.1f} MB, loaded in {load_full * 1000:.1f} ms')
+        print(f'  encoder only:   {stripped_file.stat().st_size / 2 ** 20:.1f} MB, loaded in '
+              f'{load_stripped * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hidden-size', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--characters', type=int, default=400)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    run(args.hidden_size, args.batch_size, args.characters, args.repeats)
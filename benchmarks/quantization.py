@@ -0,0 +1,54 @@
+"""
+Compares the memory and lookup throughput of word embedding tables stored as float32, float16 and per-row scaled
+int8, and how far the looked up rows are from the float32 ones.
+
+    python -m benchmarks.quantization --words 400000 --dimension 300 --batch-size 4096
+"""
+import argparse
+import time
+
+import torch
+
+from flair.nn import quantize_rows, dequantize_rows
+
+
+def time_it(function, repeats: int) -> float:
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def run(words: int, dimension: int, batch_size: int, repeats: int):
+    torch.manual_seed(1)
+    weights = torch.randn(words, dimension)
+    # lookups follow a Zipfian distribution like word frequencies in text
+    probabilities = 1. / torch.arange(1, words + 1, dtype=torch.float)
+    indices = torch.multinomial(probabilities, batch_size, replacement=True)
+
+    expected = weights.index_select(0, indices)
+
+    print(f'table of {words} x {dimension}, lookups of {batch_size} words')
+    for dtype in ['float32', 'float16', 'int8']:
+        rows, scales = quantize_rows(weights, dtype)
+        size = rows.numel() * rows.element_size()
+        if scales is not None:
+            size += scales.numel() * scales.element_size()
+
+        seconds = time_it(lambda: dequantize_rows(rows, scales, indices), repeats)
+        error = (dequantize_rows(rows, scales, indices) - expected).abs().max().item()
+
+        print(f'  {dtype:8s} {size / 2 ** 20:8.1f} MB  {batch_size / seconds / 1e6:6.2f} M lookups/s  '
+              f'max error {error:.5f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=400000)
+    parser.add_argument('--dimension', type=int, default=300)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    run(args.words, args.dimension, args.batch_size, args.repeats)
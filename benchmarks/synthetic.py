@@ -0,0 +1,110 @@
+"""
+Synthetic corpora and small, locally constructed models, so that benchmarks run without downloads and give the same
+input on every machine.
+"""
+import string
+from pathlib import Path
+from typing import List
+
+import gensim
+import numpy as np
+
+from flair.data import Dictionary, Sentence, Token
+from flair.models import LanguageModel
+
+LENGTH_DISTRIBUTIONS = ['fixed', 'uniform', 'lognormal']
+
+
+def make_vocabulary(size: int, seed: int = 1) -> List[str]:
+    """Creates random words of 1 to 12 letters, a tenth of them capitalized, with Zipfian length distribution."""
+    random = np.random.RandomState(seed)
+    letters = list(string.ascii_lowercase)
+
+    words = set()
+    while len(words) < size:
+        word = ''.join(random.choice(letters, size=min(random.zipf(1.5), 12)))
+        if random.rand() < 0.1:
+            word = word.capitalize()
+        words.add(word)
+
+    return sorted(words)
+
+
+def make_corpus(sentences: int,
+                mean_length: int = 20,
+                length_distribution: str = 'lognormal',
+                vocabulary: List[str] = None,
+                seed: int = 1) -> List[Sentence]:
+    """
+    Creates sentences of words drawn with Zipfian frequencies from a vocabulary.
+    :param sentences: number of sentences
+    :param mean_length: mean number of tokens per sentence
+    :param length_distribution: 'fixed' for sentences of equal length, 'uniform' for lengths between 1 and twice the
+    mean, 'lognormal' for the long-tailed lengths of natural text
+    :param vocabulary: words to draw from, by default 10000 random words
+    :param seed: seed of the random generator
+    """
+    if length_distribution not in LENGTH_DISTRIBUTIONS:
+        raise ValueError(f'Unknown length distribution "{length_distribution}". Use one of {LENGTH_DISTRIBUTIONS}.')
+
+    random = np.random.RandomState(seed)
+    if vocabulary is None:
+        vocabulary = make_vocabulary(10000, seed)
+
+    if length_distribution == 'fixed':
+        lengths = np.full(sentences, mean_length)
+    elif length_distribution == 'uniform':
+        lengths = random.randint(1, 2 * mean_length, size=sentences)
+    else:
+        # a sigma of 0.6 gives a tail similar to the sentence lengths of news text
+        lengths = random.lognormal(np.log(mean_length) - 0.18, 0.6, size=sentences)
+    lengths = np.maximum(np.round(lengths).astype(int), 1)
+
+    probabilities = 1. / np.arange(1, len(vocabulary) + 1)
+    probabilities /= probabilities.sum()
+
+    corpus: List[Sentence] = []
+    for length in lengths:
+        sentence = Sentence()
+        for index in random.choice(len(vocabulary), size=length, p=probabilities):
+            sentence.add_token(Token(vocabulary[index]))
+        corpus.append(sentence)
+
+    return corpus
+
+
+def make_word_vectors(path: Path, words: List[str], dimension: int = 100, seed: int = 1) -> Path:
+    """Writes random gensim word vectors for the given words, which WordEmbeddings loads from the returned path."""
+    vectors = np.random.RandomState(seed).uniform(-1., 1., (len(words), dimension)).astype('float32')
+
+    word_vectors = gensim.models.KeyedVectors(dimension)
+    if hasattr(word_vectors, 'add_vectors'):
+        word_vectors.add_vectors(words, vectors)
+    else:
+        word_vectors.add(words, vectors)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    word_vectors.save(str(path), separately=['vectors'])
+    return path
+
+
+def make_char_dictionary(path: Path = None, characters: int = 275) -> Dictionary:
+    """Creates a character dictionary of the size of the published models, saved to the path if given."""
+    dictionary: Dictionary = Dictionary()
+    for i in range(characters):
+        dictionary.add_item(chr(32 + i))
+    dictionary.add_item('\n')
+
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        dictionary.save(str(path))
+    return dictionary
+
+
+def make_language_model(hidden_size: int,
+                        embedding_size: int = 100,
+                        characters: int = 275,
+                        is_forward_lm: bool = True) -> LanguageModel:
+    """Creates an untrained language model with a dictionary of the size of the published models."""
+    return LanguageModel(make_char_dictionary(characters=characters), is_forward_lm, hidden_size=hidden_size,
+                         nlayers=1, embedding_size=embedding_size).eval()
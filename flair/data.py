@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import List, Dict, Union, Iterable
+from typing import List, Dict, Union, Iterable, Tuple
 
 import torch
 import logging
@@ -185,13 +185,28 @@ class Token:
         return self.sentence.get_token(self.head_id)
 
     def set_embedding(self, name: str, vector: torch.autograd.Variable):
-        self._embeddings[name] = vector.cpu()
+        device = self.sentence.embedding_device if self.sentence is not None else None
+        self._embeddings[name] = vector.to(device) if device is not None else vector.cpu()
 
-    def clear_embeddings(self):
-        self._embeddings: Dict = {}
+    def clear_embeddings(self, names: List[str] = None):
+        """
+        Removes embeddings from the token.
+        :param names: names of the embeddings to remove. If None, all embeddings are removed
+        """
+        if names is None:
+            names = list(self._embeddings.keys())
+            self._embeddings: Dict = {}
+        else:
+            for name in names:
+                self._embeddings.pop(name, None)
+
+        # the sentence no longer has these embeddings on all of its tokens
+        if self.sentence is not None:
+            self.sentence._forget_embedded(names)
 
     def get_embedding(self) -> torch.tensor:
-        embeddings = [self._embeddings[embed] for embed in sorted(self._embeddings.keys())]
+        # embeddings may be stored in half precision, so they are upcast before concatenation
+        embeddings = [self._embeddings[embed].float() for embed in sorted(self._embeddings.keys())]
 
         if embeddings:
             return torch.cat(embeddings, dim=0)
@@ -286,6 +301,13 @@ class Sentence:
 
         self._embeddings: Dict = {}
 
+        # embeddings added to this sentence or to all of its tokens by Embeddings.embed, mapped to the version of the
+        # embeddings and whether they are static
+        self._embedded: Dict[str, Tuple[int, bool]] = {}
+
+        # device on which embeddings of the sentence and its tokens are kept. If None, they are moved to the CPU
+        self.embedding_device: torch.device = None
+
         # if text is passed, instantiate sentence with tokens (words)
         if text is not None:
 
@@ -353,6 +375,10 @@ class Sentence:
     def add_token(self, token: Token):
         self.tokens.append(token)
 
+        # the new token has none of the token embeddings of the sentence
+        if self._embedded:
+            self._embedded = {name: record for name, record in self._embedded.items() if name in self._embeddings}
+
         # set token idx if not set
         token.sentence = self
         if token.idx is None:
@@ -444,26 +470,60 @@ class Sentence:
         return self.get_embedding()
 
     def set_embedding(self, name: str, vector):
-        self._embeddings[name] = vector.cpu()
+        device = self.embedding_device
+        self._embeddings[name] = vector.to(device) if device is not None else vector.cpu()
 
     def get_embedding(self) -> torch.tensor:
         embeddings = []
         for embed in sorted(self._embeddings.keys()):
             embedding = self._embeddings[embed]
-            embeddings.append(embedding)
+            embeddings.append(embedding.float())
 
         if embeddings:
             return torch.cat(embeddings, dim=0)
 
         return torch.Tensor()
 
+    def is_embedded(self, name: str, version: int = None) -> bool:
+        """
+        Checks in constant time whether Embeddings.embed added the embeddings of the given name to this sentence or to
+        all of its tokens.
+        :param name: name of the embeddings
+        :param version: if given, the embeddings must also have been added in this version
+        """
+        record = self._embedded.get(name)
+        return record is not None and (version is None or record[0] == version)
+
+    def _mark_embedded(self, name: str, version: int, static: bool):
+        self._embedded[name] = (version, static)
+
+    def _forget_embedded(self, names: Iterable[str]):
+        for name in names:
+            self._embedded.pop(name, None)
+
     def clear_embeddings(self, also_clear_word_embeddings: bool = True):
+        self._forget_embedded(self._embeddings.keys())
         self._embeddings: Dict = {}
 
         if also_clear_word_embeddings:
             for token in self:
                 token.clear_embeddings()
 
+    def clear_non_static_embeddings(self):
+        """
+        Removes all embeddings of the sentence and its tokens except those added by static embeddings, which would be
+        the same if they were computed again.
+        """
+        static_names = {name for name, (_, static) in self._embedded.items() if static}
+
+        self._forget_embedded([name for name in self._embeddings.keys() if name not in static_names])
+        self._embeddings = {name: vector for name, vector in self._embeddings.items() if name in static_names}
+
+        for token in self:
+            non_static_names = [name for name in token._embeddings.keys() if name not in static_names]
+            if non_static_names:
+                token.clear_embeddings(non_static_names)
+
     def cpu_embeddings(self):
         for name, vector in self._embeddings.items():
             self._embeddings[name] = vector.cpu()
@@ -0,0 +1,256 @@
+"""
+Persistent, append-only cache for computed embeddings. Rows are stored as raw float16/float32 arrays in memory-mapped
+shard files, an index maps a hashed key to the location of its rows.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import List, Dict, Tuple, Union, Optional
+
+import numpy as np
+
+log = logging.getLogger('flair')
+
+
+class EmbeddingCache:
+    """
+    Disk cache for embeddings that maps a key (usually the text of a sentence plus the fingerprint of the model that
+    produced the embeddings) to a matrix of embedding rows. Rows are appended to shard files that are read back through
+    memory maps. If the cache grows beyond its maximum size, the oldest shards are evicted as a whole.
+    """
+
+    _INDEX_RECORD = struct.Struct('<20sIQI')
+    _INDEX_FILE = 'index.bin'
+    _META_FILE = 'meta.json'
+
+    def __init__(self,
+                 directory: Union[str, Path],
+                 embedding_length: int,
+                 dtype: str = 'float32',
+                 max_size: int = 0,
+                 shard_size: int = 64 * 1024 * 1024):
+        """
+        Opens the cache in the given directory or creates a new one.
+        :param directory: directory in which shards and index are stored
+        :param embedding_length: length of each embedding row
+        :param dtype: storage type of rows, either 'float32' or 'float16'
+        :param max_size: maximum size of all shards in bytes. If exceeded, oldest shards are evicted. The shard that is
+        currently written to is never evicted, so the cache can exceed max_size by at most one shard. 0 means unbounded
+        :param shard_size: size in bytes after which a new shard is started. Reduced to max_size if that is smaller, so
+        that the bound can be enforced
+        """
+        if dtype not in ['float32', 'float16']:
+            raise ValueError(f'Storage type "{dtype}" is not supported by the embedding cache.')
+
+        self.directory: Path = Path(directory)
+        self.embedding_length: int = embedding_length
+        self.dtype: str = dtype
+        self.max_size: int = max_size
+        self.shard_size: int = min(shard_size, max_size) if max_size > 0 else shard_size
+
+        self.row_bytes: int = np.dtype(dtype).itemsize * embedding_length
+
+        # metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+        # number of records in the index log that point to evicted shards
+        self._stale_records: int = 0
+
+        self._index: Dict[bytes, Tuple[int, int, int]] = {}
+        self._shard_rows: Dict[int, int] = {}
+        self._maps: Dict[int, np.memmap] = {}
+        self._writer = None
+        self._index_writer = None
+
+        self._open()
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        meta_file = self.directory / self._META_FILE
+        meta = {'embedding_length': self.embedding_length, 'dtype': self.dtype}
+        if meta_file.exists():
+            with open(meta_file, 'r') as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f'Embedding cache in "{self.directory}" was created with {existing}, '
+                                 f'which does not match the requested {meta}.')
+        else:
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f)
+
+        # find all existing shards
+        for shard_file in self.directory.glob('shard-*.bin'):
+            shard_id = int(shard_file.stem.split('-')[1])
+            self._shard_rows[shard_id] = os.path.getsize(shard_file) // self.row_bytes
+
+        # replay index log, skipping entries of evicted shards
+        index_file = self.directory / self._INDEX_FILE
+        if index_file.exists():
+            record_size = self._INDEX_RECORD.size
+            with open(index_file, 'rb') as f:
+                data = f.read()
+            for start in range(0, len(data) - record_size + 1, record_size):
+                key, shard_id, offset, rows = self._INDEX_RECORD.unpack_from(data, start)
+                if shard_id in self._shard_rows and offset + rows <= self._shard_rows[shard_id]:
+                    self._index[key] = (shard_id, offset, rows)
+
+        self._index_writer = open(index_file, 'ab')
+
+    @staticmethod
+    def make_key(text: str, fingerprint: str = '') -> bytes:
+        """Hashes the text of a sentence together with a model fingerprint into a cache key."""
+        return hashlib.sha1(f'{fingerprint}\t{text}'.encode('utf-8')).digest()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._index
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.
+
+    @property
+    def size(self) -> int:
+        """Size of all shards in bytes."""
+        return sum(self._shard_rows.values()) * self.row_bytes
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions,
+        }
+
+    def _shard_path(self, shard_id: int) -> Path:
+        return self.directory / f'shard-{shard_id:05d}.bin'
+
+    def _get_map(self, shard_id: int, rows_needed: int) -> np.memmap:
+        shard_map = self._maps.get(shard_id)
+        # the active shard grows while we write, so re-map if the existing map is too short
+        if shard_map is None or shard_map.shape[0] < rows_needed:
+            if self._writer is not None and self._writer[0] == shard_id:
+                self._writer[1].flush()
+            shard_map = np.memmap(str(self._shard_path(shard_id)), dtype=self.dtype, mode='r',
+                                  shape=(self._shard_rows[shard_id], self.embedding_length))
+            self._maps[shard_id] = shard_map
+        return shard_map
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        return self.get_batch([key])[0]
+
+    def get_batch(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Looks up a list of keys.
+        :param keys: list of cache keys
+        :return: for each key a float32 matrix of shape (rows, embedding_length) or None if the key is not cached
+        """
+        results: List[Optional[np.ndarray]] = []
+        for key in keys:
+            location = self._index.get(key)
+            if location is None:
+                self.misses += 1
+                results.append(None)
+                continue
+
+            shard_id, offset, rows = location
+            shard_map = self._get_map(shard_id, offset + rows)
+            results.append(np.array(shard_map[offset:offset + rows], dtype=np.float32))
+            self.hits += 1
+
+        return results
+
+    def put(self, key: bytes, rows: np.ndarray):
+        self.put_batch([key], [rows])
+
+    def put_batch(self, keys: List[bytes], matrices: List[np.ndarray]):
+        """
+        Appends embedding matrices to the cache. Keys that are already cached are skipped.
+        :param keys: list of cache keys
+        :param matrices: for each key a matrix of shape (rows, embedding_length)
+        """
+        index_records = []
+        for key, matrix in zip(keys, matrices):
+            if key in self._index or len(matrix) == 0:
+                continue
+
+            matrix = np.ascontiguousarray(matrix, dtype=self.dtype).reshape(-1, self.embedding_length)
+
+            shard_id, writer = self._get_writer()
+            offset = self._shard_rows[shard_id]
+            writer.write(matrix.tobytes())
+            self._shard_rows[shard_id] = offset + matrix.shape[0]
+
+            self._index[key] = (shard_id, offset, matrix.shape[0])
+            index_records.append(self._INDEX_RECORD.pack(key, shard_id, offset, matrix.shape[0]))
+
+        if self._writer is not None:
+            self._writer[1].flush()
+        self._index_writer.write(b''.join(index_records))
+        self._index_writer.flush()
+
+        if self.max_size > 0:
+            self._evict()
+
+    def _get_writer(self):
+        if self._writer is not None:
+            shard_id, writer = self._writer
+            if self._shard_rows[shard_id] * self.row_bytes < self.shard_size:
+                return self._writer
+            writer.close()
+
+        shard_id = max(self._shard_rows.keys()) + 1 if self._shard_rows else 0
+        self._shard_rows[shard_id] = 0
+        self._writer = (shard_id, open(self._shard_path(shard_id), 'ab'))
+        return self._writer
+
+    def _evict(self):
+        # evict oldest shards first, but never the one currently written to
+        while self.size > self.max_size and len(self._shard_rows) > 1:
+            oldest = min(self._shard_rows.keys())
+            if self._writer is not None and self._writer[0] == oldest:
+                break
+
+            del self._shard_rows[oldest]
+            self._maps.pop(oldest, None)
+            os.remove(str(self._shard_path(oldest)))
+
+            evicted_keys = [key for key, location in self._index.items() if location[0] == oldest]
+            for key in evicted_keys:
+                del self._index[key]
+            self.evictions += len(evicted_keys)
+            self._stale_records += len(evicted_keys)
+
+        # compact the index log once evicted entries dominate it
+        if self._stale_records > 2 * len(self._index):
+            self._rewrite_index()
+
+    def _rewrite_index(self):
+        self._index_writer.close()
+        with open(self.directory / self._INDEX_FILE, 'wb') as f:
+            f.write(b''.join(self._INDEX_RECORD.pack(key, *location) for key, location in self._index.items()))
+        self._index_writer = open(self.directory / self._INDEX_FILE, 'ab')
+        self._stale_records = 0
+
+    def close(self):
+        if self._writer is not None:
+            self._writer[1].close()
+            self._writer = None
+        if self._index_writer is not None:
+            self._index_writer.close()
+            self._index_writer = None
+        self._maps = {}
+
+    def __str__(self):
+        return f'EmbeddingCache({self.directory}, {len(self)} entries, hit rate {self.hit_rate:.2f})'
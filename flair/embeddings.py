@@ -1,35 +1,45 @@
 import os
 import re
+import hashlib
 import logging
+import time
+import warnings
 from abc import abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Optional, Iterable, Tuple
 
-import gensim
 import numpy as np
 import torch
-from bpemb import BPEmb
 from deprecated import deprecated
 
-from pytorch_pretrained_bert import BertTokenizer, BertModel, TransfoXLTokenizer, TransfoXLModel
-
-from pytorch_pretrained_bert.modeling import \
-    PRETRAINED_MODEL_ARCHIVE_MAP as BERT_PRETRAINED_MODEL_ARCHIVE_MAP
-
-from pytorch_pretrained_bert.modeling_transfo_xl import \
-            PRETRAINED_MODEL_ARCHIVE_MAP as TRANSFORMER_XL_PRETRAINED_MODEL_ARCHIVE_MAP
+# gensim, bpemb and pytorch_pretrained_bert take seconds to import, so they are only imported by the embeddings that
+# use them
 
 import flair
-from .nn import LockedDropout, WordDropout
+from .nn import LockedDropout, WordDropout, quantize_rows, dequantize_rows
 from .data import Dictionary, Token, Sentence
-from .file_utils import cached_path
+from .embedding_cache import EmbeddingCache
+from .file_utils import cached_path, file_fingerprint
 
 log = logging.getLogger('flair')
 
 
+def _fingerprint_tensors(tensors) -> str:
+    sha = hashlib.sha1()
+    for tensor in tensors:
+        sha.update(tensor.detach().cpu().numpy().tobytes())
+    return sha.hexdigest()
+
+
 class Embeddings(torch.nn.Module):
     """Abstract base class for all embeddings. Every new type of embedding must implement these methods."""
 
+    # increased whenever the vectors computed for a text change, so that stored embeddings of older versions are
+    # computed again
+    version: int = 0
+
     @property
     @abstractmethod
     def embedding_length(self) -> int:
@@ -49,18 +59,27 @@ class Embeddings(torch.nn.Module):
         if type(sentences) is Sentence:
             sentences = [sentences]
 
-        everything_embedded: bool = True
-
-        if self.embedding_type == 'word-level':
-            for sentence in sentences:
-                for token in sentence.tokens:
-                    if self.name not in token._embeddings.keys(): everything_embedded = False
-        else:
-            for sentence in sentences:
-                if self.name not in sentence._embeddings.keys(): everything_embedded = False
+        # static embeddings are only added to sentences that do not have them in the current version yet
+        sentences_to_embed = sentences
+        if self.static_embeddings:
+            word_level = self.embedding_type == 'word-level'
+            sentences_to_embed = [sentence for sentence in sentences
+                                  if not sentence.is_embedded(self.name, self.version)
+                                  and not (word_level and len(sentence) == 0)]
+
+        if sentences_to_embed:
+
+            # if a cache is attached, only compute embeddings for sentences that are not cached yet
+            if getattr(self, 'embedding_cache', None) is not None:
+                sentences_to_compute = self._embed_from_cache(sentences_to_embed)
+                if sentences_to_compute:
+                    self._add_embeddings_internal(sentences_to_compute)
+                    self._add_to_cache(sentences_to_compute)
+            else:
+                self._add_embeddings_internal(sentences_to_embed)
 
-        if not everything_embedded or not self.static_embeddings:
-            self._add_embeddings_internal(sentences)
+            for sentence in sentences_to_embed:
+                sentence._mark_embedded(self.name, self.version, self.static_embeddings)
 
         return sentences
 
@@ -69,6 +88,69 @@ class Embeddings(torch.nn.Module):
         """Private method for adding embeddings to all words in a list of sentences."""
         pass
 
+    def enable_cache(self, directory: Union[str, Path], dtype: str = 'float32', max_size: int = 0) -> EmbeddingCache:
+        """
+        Attaches a persistent cache so that embeddings of each sentence are only computed once and then retrieved from
+        disk. Only static token-level embeddings can be cached.
+        :param directory: directory of the cache. Can be shared between embeddings, since keys include a fingerprint
+        of the model
+        :param dtype: storage type of cached rows, either 'float32' or 'float16'
+        :param max_size: maximum size of the cache in bytes, exceeded by at most one shard, 0 means unbounded
+        :return: the attached cache
+        """
+        if not self.static_embeddings or self.embedding_type != 'word-level':
+            raise ValueError(f'Only static token-level embeddings can be cached, "{self}" is not.')
+
+        self.cache_fingerprint: str = self._get_fingerprint()
+        self.embedding_cache: EmbeddingCache = EmbeddingCache(directory, self.embedding_length, dtype=dtype,
+                                                              max_size=max_size)
+        return self.embedding_cache
+
+    def disable_cache(self):
+        if getattr(self, 'embedding_cache', None) is not None:
+            self.embedding_cache.close()
+        self.embedding_cache = None
+
+    def _get_fingerprint(self) -> str:
+        """Identifies the model behind these embeddings. Embeddings loaded from a model file should override this."""
+        return f'{type(self).__name__}:{self.name}'
+
+    def _embed_from_cache(self, sentences: List[Sentence]) -> List[Sentence]:
+        keys = [EmbeddingCache.make_key(sentence.to_tokenized_string(), self.cache_fingerprint)
+                for sentence in sentences]
+
+        sentences_to_embed: List[Sentence] = []
+        cached_sentences: List[Sentence] = []
+        cached_rows: List[np.ndarray] = []
+        for sentence, rows in zip(sentences, self.embedding_cache.get_batch(keys)):
+            if rows is None or len(rows) != len(sentence):
+                sentences_to_embed.append(sentence)
+                continue
+            cached_sentences.append(sentence)
+            cached_rows.append(rows)
+
+        if cached_sentences:
+            # the rows of all cached sentences are moved to the embedding device at once
+            rows = torch.from_numpy(np.concatenate(cached_rows)).to(_embedding_device(cached_sentences))
+            tokens = [token for sentence in cached_sentences for token in sentence]
+            for token, row in zip(tokens, rows):
+                token.set_embedding(self.name, row)
+
+        return sentences_to_embed
+
+    def _add_to_cache(self, sentences: List[Sentence]):
+        keys = [EmbeddingCache.make_key(sentence.to_tokenized_string(), self.cache_fingerprint)
+                for sentence in sentences]
+        matrices = [torch.stack([token._embeddings[self.name] for token in sentence]).detach().cpu().numpy()
+                    if len(sentence) > 0 else np.zeros((0, self.embedding_length)) for sentence in sentences]
+        self.embedding_cache.put_batch(keys, matrices)
+
+    def __getstate__(self):
+        # the cache holds open files, so it is not serialized with the embeddings
+        state = self.__dict__.copy()
+        state['embedding_cache'] = None
+        return state
+
 
 class TokenEmbeddings(Embeddings):
     """Abstract base class for all token-level embeddings. Ever new type of word embedding must implement these methods."""
@@ -101,8 +183,13 @@ class DocumentEmbeddings(Embeddings):
 class StackedEmbeddings(TokenEmbeddings):
     """A stack of embeddings, used if you need to combine several different embedding types."""
 
-    def __init__(self, embeddings: List[TokenEmbeddings], detach: bool = True):
-        """The constructor takes a list of embeddings to be combined."""
+    def __init__(self, embeddings: List[TokenEmbeddings], detach: bool = True, concurrent: bool = False):
+        """
+        The constructor takes a list of embeddings to be combined.
+        :param concurrent: if True, the embeddings are computed concurrently on a thread pool, sharing the intra-op
+        threads of torch. This helps on CPU, where a single embedding often leaves cores idle. Call close() to stop the
+        thread pool once the embeddings are no longer used
+        """
         super().__init__()
 
         self.embeddings = embeddings
@@ -115,6 +202,12 @@ class StackedEmbeddings(TokenEmbeddings):
         self.name: str = 'Stack'
         self.static_embeddings: bool = True
 
+        self.concurrent: bool = concurrent
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # accumulated wall time spent in each embedding
+        self.embedding_times: Dict[str, float] = {}
+
         self.__embedding_type: str = embeddings[0].embedding_type
 
         self.__embedding_length: int = 0
@@ -126,8 +219,52 @@ class StackedEmbeddings(TokenEmbeddings):
         if type(sentences) is Sentence:
             sentences = [sentences]
 
-        for embedding in self.embeddings:
-            embedding.embed(sentences)
+        if getattr(self, 'concurrent', False) and len(self.embeddings) > 1:
+            elapsed = self._embed_concurrently(sentences)
+        else:
+            elapsed = [self._embed_timed(embedding, sentences) for embedding in self.embeddings]
+
+        embedding_times = self.__dict__.setdefault('embedding_times', {})
+        for embedding, seconds in zip(self.embeddings, elapsed):
+            embedding_times[embedding.name] = embedding_times.get(embedding.name, 0.) + seconds
+
+    @staticmethod
+    def _embed_timed(embedding: TokenEmbeddings, sentences: List[Sentence]) -> float:
+        start = time.perf_counter()
+        embedding.embed(sentences)
+        return time.perf_counter() - start
+
+    def _embed_concurrently(self, sentences: List[Sentence]) -> List[float]:
+        # grad mode is local to each thread, so the workers take it over from the caller. The number of intra-op
+        # threads is global to the process and left as it is, so that results equal those computed one by one
+        grad_enabled = torch.is_grad_enabled()
+
+        def embed(embedding: TokenEmbeddings) -> float:
+            with torch.set_grad_enabled(grad_enabled):
+                return self._embed_timed(embedding, sentences)
+
+        if getattr(self, '_executor', None) is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.embeddings))
+
+        return list(self._executor.map(embed, self.embeddings))
+
+    def close(self):
+        """Stops the thread pool of concurrent embedding. It is started again when needed."""
+        executor = self.__dict__.get('_executor')
+        if executor is not None:
+            executor.shutdown(wait=False)
+            self._executor = None
+
+    def __del__(self):
+        self.close()
+
+    def reset_embedding_times(self):
+        self.embedding_times = {}
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_executor'] = None
+        return state
 
     @property
     def embedding_type(self) -> str:
@@ -148,15 +285,40 @@ class StackedEmbeddings(TokenEmbeddings):
         return f'StackedEmbeddings [{",".join([str(e) for e in self.embeddings])}]'
 
 
+_DIGIT_PATTERN = re.compile(r'\d')
+
+
 class WordEmbeddings(TokenEmbeddings):
     """Standard static word embeddings, such as GloVe or FastText."""
 
-    def __init__(self, embeddings: str, field: str = None):
+    # number of normalized lookups of unknown spellings that are remembered
+    fallback_cache_size: int = 100000
+
+    def __init__(self, embeddings: str, field: str = None, mmap: bool = False):
         """
         Initializes classic word embeddings. Constructor downloads required files if not there.
         :param embeddings: one of: 'glove', 'extvec', 'crawl' or two-letter language code.
-        If you want to use a custom embedding file, just pass the path to the embeddings as embeddings variable.
+        If you want to use a custom embedding file, just pass the path to the embeddings as embeddings variable. This
+        can be a gensim KeyedVectors file or a directory created by convert_word_vectors.
+        :param mmap: if True, the vectors are memory-mapped read-only, so that all processes on a machine share one
+        copy. The matrix is then not pickled with the embeddings but re-attached from the file on loading.
         """
+        self.embeddings_name: str = embeddings
+        self.mmap: bool = mmap
+
+        embeddings = self._get_embeddings_path(embeddings)
+
+        self.name: str = str(embeddings)
+        self.static_embeddings = True
+
+        self.field = field
+
+        self._load_vectors(self.name)
+        super().__init__()
+
+    @staticmethod
+    def _get_embeddings_path(embeddings: str) -> str:
+        """Returns the path of the gensim file for the given embeddings name, downloading it if necessary."""
 
         old_base_path = 'https://s3.eu-central-1.amazonaws.com/alan-nlp/resources/embeddings/'
         base_path = 'https://s3.eu-central-1.amazonaws.com/alan-nlp/resources/embeddings-v0.3/'
@@ -214,86 +376,385 @@ class WordEmbeddings(TokenEmbeddings):
         elif not Path(embeddings).exists():
             raise ValueError(f'The given embeddings "{embeddings}" is not available or is not a valid path.')
 
-        self.name: str = str(embeddings)
-        self.static_embeddings = True
+        return str(embeddings)
 
-        self.precomputed_word_embeddings = gensim.models.KeyedVectors.load(str(embeddings))
+    def _load_vectors(self, path: str):
+        mmap_mode = 'r' if self.mmap else None
 
-        self.field = field
+        # directories hold vectors converted with convert_word_vectors, files are gensim KeyedVectors
+        if Path(path).is_dir():
+            with open(Path(path) / WORD_VECTORS_VOCABULARY_FILE, 'r', encoding='utf-8', newline='\n') as f:
+                words = f.read().split('\n')[:-1]
+            vectors = np.load(str(Path(path) / WORD_VECTORS_MATRIX_FILE), mmap_mode=mmap_mode)
+            self._set_vectors(words, vectors[:len(words)])
+        else:
+            import gensim
+            self._set_keyed_vectors(gensim.models.KeyedVectors.load(path, mmap=mmap_mode))
+
+        self.vectors_fingerprint: str = self._get_vectors_fingerprint(path)
+
+    @staticmethod
+    def _get_vectors_fingerprint(path: str) -> str:
+        if Path(path).is_dir():
+            return file_fingerprint(Path(path) / WORD_VECTORS_VOCABULARY_FILE) + \
+                   file_fingerprint(Path(path) / WORD_VECTORS_MATRIX_FILE)
+
+        fingerprint = file_fingerprint(path)
+        # gensim stores large matrices in a separate file
+        vectors_file = Path(f'{path}.vectors.npy')
+        if vectors_file.exists():
+            fingerprint += file_fingerprint(vectors_file)
+        return fingerprint
+
+    def _set_keyed_vectors(self, keyed_vectors):
+        """Builds the word-to-row lookup and the weight matrix from gensim KeyedVectors."""
+        words = keyed_vectors.index_to_key if hasattr(keyed_vectors, 'index_to_key') else keyed_vectors.index2word
+        self._set_vectors(words, keyed_vectors.vectors)
+
+    def _set_vectors(self, words: List[str], vectors: np.ndarray):
+        # if a word occurs twice, its first vector is used
+        self.vocab: Dict[str, int] = {}
+        for index, word in enumerate(words):
+            self.vocab.setdefault(word, index)
+
+        if isinstance(vectors, np.memmap) and vectors.dtype in [np.float32, np.float16]:
+            # the tensor shares the read-only memory map, which torch warns about even though it is never written
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                self.weights: torch.Tensor = torch.from_numpy(vectors)
+        elif vectors.dtype == np.float16:
+            self.weights: torch.Tensor = torch.from_numpy(np.asarray(vectors))
+        else:
+            self.weights: torch.Tensor = torch.from_numpy(np.asarray(vectors, dtype=np.float32))
 
-        self.__embedding_length: int = self.precomputed_word_embeddings.vector_size
-        super().__init__()
+        self.__embedding_length: int = self.weights.shape[1]
+        self._fallback_cache: Dict[str, int] = OrderedDict()
+
+    @property
+    def oov_index(self) -> int:
+        return len(self.vocab)
+
+    def _get_index(self, word: str) -> int:
+        """Returns the row of a word. Misses of the exact word go through the normalization chain, whose results
+        are kept in a LRU cache."""
+        index = self.vocab.get(word)
+        if index is not None:
+            return index
+
+        index = self._fallback_cache.get(word)
+        if index is not None:
+            self._fallback_cache.move_to_end(word)
+            return index
+
+        index = self.oov_index
+        lower = word.lower()
+        for variant in [lower, _DIGIT_PATTERN.sub('#', lower), _DIGIT_PATTERN.sub('0', lower)]:
+            if variant in self.vocab:
+                index = self.vocab[variant]
+                break
+
+        self._fallback_cache[word] = index
+        if len(self._fallback_cache) > self.fallback_cache_size:
+            self._fallback_cache.popitem(last=False)
+
+        return index
 
     @property
     def embedding_length(self) -> int:
         return self.__embedding_length
 
+    def _get_fingerprint(self) -> str:
+        if getattr(self, 'vectors_fingerprint', None) is not None:
+            return self.vectors_fingerprint
+        return super()._get_fingerprint()
+
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
 
-        for i, sentence in enumerate(sentences):
+        tokens: List[Token] = [token for sentence in sentences for token in sentence.tokens]
+        if not tokens:
+            return sentences
 
-            for token, token_idx in zip(sentence.tokens, range(len(sentence.tokens))):
-                token: Token = token
+        if 'field' not in self.__dict__ or self.field is None:
+            words = [token.text for token in tokens]
+        else:
+            words = [token.get_tag(self.field).value for token in tokens]
 
-                if 'field' not in self.__dict__ or self.field is None:
-                    word = token.text
-                else:
-                    word = token.get_tag(self.field).value
-
-                if word in self.precomputed_word_embeddings:
-                    word_embedding = self.precomputed_word_embeddings[word]
-                elif word.lower() in self.precomputed_word_embeddings:
-                    word_embedding = self.precomputed_word_embeddings[word.lower()]
-                elif re.sub(r'\d', '#', word.lower()) in self.precomputed_word_embeddings:
-                    word_embedding = self.precomputed_word_embeddings[re.sub(r'\d', '#', word.lower())]
-                elif re.sub(r'\d', '0', word.lower()) in self.precomputed_word_embeddings:
-                    word_embedding = self.precomputed_word_embeddings[re.sub(r'\d', '0', word.lower())]
-                else:
-                    word_embedding = np.zeros(self.embedding_length, dtype='float')
+        indices = torch.tensor([self._get_index(word) for word in words], dtype=torch.long)
 
-                word_embedding = torch.FloatTensor(word_embedding)
+        # unknown words get the zero vector
+        unknown = indices == self.oov_index
+        word_embeddings = dequantize_rows(self.weights, getattr(self, 'weight_scales', None),
+                                          indices.masked_fill(unknown, 0))
+        word_embeddings[unknown] = 0.
+        word_embeddings = word_embeddings.to(_embedding_device(sentences))
 
-                token.set_embedding(self.name, word_embedding)
+        for token, word_embedding in zip(tokens, word_embeddings):
+            token.set_embedding(self.name, word_embedding)
 
         return sentences
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_fallback_cache'] = OrderedDict()
+
+        # memory-mapped vectors are re-attached from their file when unpickling
+        if getattr(self, 'mmap', False):
+            state['vocab'] = None
+            state['weights'] = None
+
+        return state
+
+    def __setstate__(self, state):
+        # models saved with earlier versions hold the gensim KeyedVectors
+        keyed_vectors = state.pop('precomputed_word_embeddings', None)
+        super().__setstate__(state)
+        if keyed_vectors is not None:
+            self._set_keyed_vectors(keyed_vectors)
+
+        if getattr(self, 'mmap', False) and self.weights is None:
+            self._attach_vectors()
+
+    def _attach_vectors(self):
+        # the file may live in a different place on this machine, then it is resolved by its embeddings name
+        path = self.name if Path(self.name).exists() else self._get_embeddings_path(self.embeddings_name)
+
+        fingerprint = self.vectors_fingerprint
+        self._load_vectors(path)
+        if self.vectors_fingerprint != fingerprint:
+            raise ValueError(f'The embeddings file "{path}" differs from the one the model was saved with.')
+
+    def prune(self, vocabulary: Iterable[str], top_n: int = 0):
+        """
+        Restricts the embeddings to the given words plus the first top_n (usually most frequent) words of the table.
+        All normalized spellings of the given words found in the table are kept as well, so these words get the same
+        vectors as from the full table. The pruned matrix is held in memory and pickled with the embeddings.
+        :param vocabulary: words to keep, for instance all tokens of the training corpus
+        :param top_n: number of words from the start of the table to keep in addition
+        """
+        rows = set(range(min(top_n, len(self.vocab))))
+        for word in set(vocabulary):
+            lower = word.lower()
+            for variant in [word, lower, _DIGIT_PATTERN.sub('#', lower), _DIGIT_PATTERN.sub('0', lower)]:
+                index = self.vocab.get(variant)
+                if index is not None:
+                    rows.add(index)
+        rows = sorted(rows)
+
+        words: List[str] = [None] * len(self.vocab)
+        for word, index in self.vocab.items():
+            words[index] = word
+
+        self.vocab = {words[row]: index for index, row in enumerate(rows)}
+        rows_tensor = torch.tensor(rows, dtype=torch.long)
+        self.weights = self.weights.index_select(0, rows_tensor)
+        if getattr(self, 'weight_scales', None) is not None:
+            self.weight_scales = self.weight_scales.index_select(0, rows_tensor)
+        self._fallback_cache = OrderedDict()
+
+        # the pruned table no longer matches the file, so it is neither memory-mapped nor cached as the full table
+        self.mmap = False
+        kept_words = hashlib.sha1('\n'.join(words[row] for row in rows).encode('utf-8')).hexdigest()
+        self.vectors_fingerprint = f'{self._get_fingerprint()}:pruned-{kept_words}'
+        self.version += 1
+
+        log.info(f'Pruned {self} to {len(self.vocab)} of {len(words)} words')
+
+    def quantize(self, dtype: str = 'int8'):
+        """
+        Stores the vectors in a smaller type and converts looked up rows back to float32. float16 halves the memory of
+        the table, int8 with one scale per row quarters it. The converted table is held in memory and pickled with the
+        embeddings.
+        :param dtype: storage type of the table, one of 'float32', 'float16' or 'int8'
+        """
+        weights = dequantize_rows(self.weights, getattr(self, 'weight_scales', None))
+        self.weights, self.weight_scales = quantize_rows(weights, dtype)
+
+        # the converted table no longer matches the file, so it is neither memory-mapped nor cached as the full table
+        self.mmap = False
+        self.vectors_fingerprint = f'{self._get_fingerprint().split(":quantized-")[0]}:quantized-{dtype}'
+        self.version += 1
+
     def __str__(self):
         return self.name
 
 
-class BPEmbSerializable(BPEmb):
+WORD_VECTORS_VOCABULARY_FILE = 'vocab.txt'
+WORD_VECTORS_MATRIX_FILE = 'vectors.npy'
+
+
+def convert_word_vectors(vectors_file: Union[str, Path],
+                         output_directory: Union[str, Path],
+                         dtype: str = 'float32',
+                         chunk_size: int = 10000) -> Path:
+    """
+    Converts word vectors in the word2vec text format (such as fastText .vec or GloVe .txt files) into a vocabulary
+    file and a numpy matrix that WordEmbeddings loads directly, optionally memory-mapped. The input is streamed line by
+    line, so memory use does not grow with the size of the file.
+    :param vectors_file: text file with one word and its vector per line, with or without a header line
+    :param output_directory: directory to which the vocabulary and the matrix are written
+    :param dtype: storage type of the matrix, either 'float32' or 'float16'
+    :param chunk_size: number of lines converted at once
+    :return: the output directory, which can be passed to WordEmbeddings
+    """
+    if dtype not in ['float32', 'float16']:
+        raise ValueError(f'Storage type "{dtype}" is not supported, use "float32" or "float16".')
+
+    vectors_file = Path(vectors_file)
+    output_directory = Path(output_directory)
+
+    # lines end at '\n' only, since words may contain '\r' or other characters that Python treats as line breaks.
+    # The number of vectors and their length are given by the header, otherwise a first pass counts them
+    with open(vectors_file, 'r', encoding='utf-8', errors='replace', newline='\n') as f:
+        first_line = f.readline().rstrip().split(' ')
+    has_header = len(first_line) == 2 and all(part.isdigit() for part in first_line)
+    if has_header:
+        rows, dimension = int(first_line[0]), int(first_line[1])
+    else:
+        dimension = len(first_line) - 1
+        with open(vectors_file, 'r', encoding='utf-8', errors='replace', newline='\n') as f:
+            rows = sum(1 for line in f if line.strip())
+
+    output_directory.mkdir(parents=True, exist_ok=True)
+    matrix = np.lib.format.open_memmap(str(output_directory / WORD_VECTORS_MATRIX_FILE), mode='w+', dtype=dtype,
+                                       shape=(rows, dimension))
+
+    count = 0
+    skipped = 0
+    words: List[str] = []
+    vectors: List[List[str]] = []
+
+    with open(vectors_file, 'r', encoding='utf-8', errors='replace', newline='\n') as f, \
+            open(output_directory / WORD_VECTORS_VOCABULARY_FILE, 'w', encoding='utf-8', newline='\n') as vocabulary:
+
+        def write_chunk():
+            if not vectors:
+                return count
+            matrix[count:count + len(vectors)] = np.array(vectors, dtype=np.float32)
+            vocabulary.write(''.join(f'{word}\n' for word in words))
+            return count + len(vectors)
+
+        if has_header:
+            f.readline()
+
+        for line in f:
+            parts = line.rstrip().split(' ')
+            if len(parts) != dimension + 1:
+                if line.strip():
+                    skipped += 1
+                continue
+            if count + len(vectors) == rows:
+                log.warning(f'"{vectors_file}" contains more vectors than its header states, ignoring the rest.')
+                break
+
+            words.append(parts[0])
+            vectors.append(parts[1:])
+
+            if len(vectors) == chunk_size:
+                count = write_chunk()
+                words, vectors = [], []
+
+        count = write_chunk()
+
+    matrix.flush()
+    del matrix
+
+    if skipped > 0:
+        log.warning(f'Skipped {skipped} malformed lines in "{vectors_file}".')
+    log.info(f'Converted {count} vectors of length {dimension} from "{vectors_file}" to "{output_directory}"')
+
+    return output_directory
+
+
+def prune_word_embeddings(module: torch.nn.Module, vocabulary: Iterable[str], top_n: int = 0):
+    """
+    Prunes all WordEmbeddings of a model or of stacked embeddings to the given vocabulary, see WordEmbeddings.prune.
+    Use it before training to save memory, or before saving a model to shrink the model file.
+    :param module: a model or embeddings
+    :param vocabulary: words to keep, for instance all tokens of the training corpus
+    :param top_n: number of most frequent words of each table to keep in addition
+    """
+    vocabulary = set(vocabulary)
+    for embeddings in module.modules():
+        if isinstance(embeddings, WordEmbeddings):
+            embeddings.prune(vocabulary, top_n)
+
+
+def quantize_embeddings(module: torch.nn.Module, dtype: str = 'int8'):
+    """
+    Stores the static tables of a model or of stacked embeddings in a smaller type: the vectors of all WordEmbeddings
+    and BytePairEmbeddings and the character tables of the language models of FlairEmbeddings. Rows are converted back
+    to float32 when they are looked up.
+    :param module: a model or embeddings
+    :param dtype: storage type of the tables, one of 'float32', 'float16' or 'int8'
+    """
+    from flair.models import LanguageModel
+
+    for embeddings in module.modules():
+        if isinstance(embeddings, (WordEmbeddings, BytePairEmbeddings, LanguageModel)):
+            embeddings.quantize(dtype)
+
+    # embeddings computed by a language model change with its character table
+    for embeddings in module.modules():
+        if isinstance(embeddings, Embeddings) and \
+                any(isinstance(child, LanguageModel) for child in embeddings.children()):
+            embeddings.version += 1
+
+
+def _get_bpemb_serializable() -> type:
+    """Defines BPEmbSerializable on first use, so that bpemb and gensim are only imported if they are needed."""
+    if 'BPEmbSerializable' in globals():
+        return globals()['BPEmbSerializable']
+
+    from bpemb import BPEmb
+
+    class BPEmbSerializable(BPEmb):
+
+        def __getstate__(self):
+            state = self.__dict__.copy()
+            # save the sentence piece model as binary file (not as path which may change)
+            state['spm_model_binary'] = open(self.model_file, mode='rb').read()
+            state['spm'] = None
+            return state
+
+        def __setstate__(self, state):
+            from bpemb.util import sentencepiece_load
+            model_file = self.model_tpl.format(lang=state['lang'], vs=state['vs'])
+            self.__dict__ = state
+
+            # write out the binary sentence piece model into the expected directory
+            self.cache_dir: Path = Path(flair.file_utils.CACHE_ROOT) / 'embeddings'
+            if 'spm_model_binary' in self.__dict__:
+                # if the model was saved as binary and it is not found on disk, write to appropriate path
+                if not os.path.exists(self.cache_dir / state['lang']):
+                    os.makedirs(self.cache_dir / state['lang'])
+                self.model_file = self.cache_dir / model_file
+                with open(self.model_file, 'wb') as out:
+                    out.write(self.__dict__['spm_model_binary'])
+            else:
+                # otherwise, use normal process and potentially trigger another download
+                self.model_file = self._load_file(model_file)
 
-    def __getstate__(self):
-        state = self.__dict__.copy()
-        # save the sentence piece model as binary file (not as path which may change)
-        state['spm_model_binary'] = open(self.model_file, mode='rb').read()
-        state['spm'] = None
-        return state
+            # once the modes if there, load it with sentence piece
+            state['spm'] = sentencepiece_load(self.model_file)
 
-    def __setstate__(self, state):
-        from bpemb.util import sentencepiece_load
-        model_file = self.model_tpl.format(lang=state['lang'], vs=state['vs'])
-        self.__dict__ = state
-
-        # write out the binary sentence piece model into the expected directory
-        self.cache_dir: Path = Path(flair.file_utils.CACHE_ROOT) / 'embeddings'
-        if 'spm_model_binary' in self.__dict__:
-            # if the model was saved as binary and it is not found on disk, write to appropriate path
-            if not os.path.exists(self.cache_dir / state['lang']):
-                os.makedirs(self.cache_dir / state['lang'])
-            self.model_file = self.cache_dir / model_file
-            with open(self.model_file, 'wb') as out:
-                out.write(self.__dict__['spm_model_binary'])
-        else:
-            # otherwise, use normal process and potentially trigger another download
-            self.model_file = self._load_file(model_file)
+    # pickled models refer to the class by its name in this module
+    BPEmbSerializable.__qualname__ = 'BPEmbSerializable'
+    globals()['BPEmbSerializable'] = BPEmbSerializable
+    return BPEmbSerializable
 
-        # once the modes if there, load it with sentence piece
-        state['spm'] = sentencepiece_load(self.model_file)
+
+def __getattr__(name: str):
+    # defines BPEmbSerializable when it is first accessed, for instance when unpickling a model
+    if name == 'BPEmbSerializable':
+        return _get_bpemb_serializable()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 class BytePairEmbeddings(TokenEmbeddings):
 
+    # number of words whose first and last subword rows are remembered
+    word_cache_size: int = 100000
+
     def __init__(self, language: str, dim: int = 50, syllables: int = 100000,
                  cache_dir=Path(flair.file_utils.CACHE_ROOT) / 'embeddings'):
         """
@@ -302,38 +763,99 @@ class BytePairEmbeddings(TokenEmbeddings):
 
         self.name: str = f'bpe-{language}-{syllables}-{dim}'
         self.static_embeddings = True
-        self.embedder = BPEmbSerializable(lang=language, vs=syllables, dim=dim, cache_dir=cache_dir)
+        self.embedder = _get_bpemb_serializable()(lang=language, vs=syllables, dim=dim, cache_dir=cache_dir)
 
         self.__embedding_length: int = self.embedder.emb.vector_size * 2
         super().__init__()
 
+        self._word_cache: Dict[str, tuple] = OrderedDict()
+
     @property
     def embedding_length(self) -> int:
         return self.__embedding_length
 
+    def _encode_words(self, words: List[str]) -> List[tuple]:
+        """Returns the rows of the first and last subword of each word, encoding unseen words in one batch."""
+        word_cache = self.__dict__.setdefault('_word_cache', OrderedDict())
+
+        new_words = list({word for word in words if word not in word_cache})
+        if new_words:
+            texts = [self.embedder.preprocess(word) for word in new_words] if self.embedder.do_preproc else new_words
+            # newer versions of sentencepiece encode a whole list in one call
+            if hasattr(self.embedder.spm, 'encode'):
+                encoded = self.embedder.spm.encode(texts)
+            else:
+                encoded = [self.embedder.spm.EncodeAsIds(text) for text in texts]
+
+            for word, ids in zip(new_words, encoded):
+                # words that sentencepiece cannot encode get no embedding
+                word_cache[word] = (ids[0], ids[-1]) if ids else None
+
+        rows = []
+        for word in words:
+            word_cache.move_to_end(word)
+            rows.append(word_cache[word])
+
+        while len(word_cache) > self.word_cache_size:
+            word_cache.popitem(last=False)
+
+        return rows
+
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
 
-        for i, sentence in enumerate(sentences):
+        tokens: List[Token] = [token for sentence in sentences for token in sentence.tokens]
+        if not tokens:
+            return sentences
 
-            for token, token_idx in zip(sentence.tokens, range(len(sentence.tokens))):
-                token: Token = token
+        if 'field' not in self.__dict__ or self.field is None:
+            words = [token.text for token in tokens]
+        else:
+            words = [token.get_tag(self.field).value for token in tokens]
 
-                if 'field' not in self.__dict__ or self.field is None:
-                    word = token.text
-                else:
-                    word = token.get_tag(self.field).value
+        # empty words get no embedding, all other words are embedded by their first and last subword
+        non_empty = iter(self._encode_words([word.lower() for word in words if word.strip() != '']))
+        rows = [next(non_empty) if word.strip() != '' else None for word in words]
 
-                if word.strip() == '':
-                    # empty words get no embedding
-                    token.set_embedding(self.name, torch.zeros(self.embedding_length, dtype=torch.float))
-                else:
-                    # all other words get embedded
-                    embeddings = self.embedder.embed(word.lower())
-                    embedding = np.concatenate((embeddings[0], embeddings[len(embeddings) - 1]))
-                    token.set_embedding(self.name, torch.tensor(embedding, dtype=torch.float))
+        embedded = torch.tensor([row is not None for row in rows], dtype=torch.bool)
+        first_rows = torch.tensor([row[0] if row is not None else 0 for row in rows], dtype=torch.long)
+        last_rows = torch.tensor([row[1] if row is not None else 0 for row in rows], dtype=torch.long)
+
+        vectors = getattr(self, 'vectors', None)
+        if vectors is None:
+            vectors = torch.from_numpy(self.embedder.emb.vectors)
+        vector_scales = getattr(self, 'vector_scales', None)
+
+        embeddings = torch.cat([dequantize_rows(vectors, vector_scales, first_rows),
+                                dequantize_rows(vectors, vector_scales, last_rows)], dim=1)
+        embeddings[~embedded] = 0.
+        embeddings = embeddings.to(_embedding_device(sentences))
+
+        for token, embedding in zip(tokens, embeddings):
+            token.set_embedding(self.name, embedding)
 
         return sentences
 
+    def quantize(self, dtype: str = 'int8'):
+        """
+        Stores the subword vectors in a smaller type and converts looked up rows back to float32, see
+        WordEmbeddings.quantize. The gensim vectors of the embedder are dropped to free their memory, so that
+        afterwards the embedder only encodes words into subwords and can no longer look up or compare vectors itself.
+        :param dtype: storage type of the table, one of 'float32', 'float16' or 'int8'
+        """
+        vectors = getattr(self, 'vectors', None)
+        if vectors is None:
+            vectors = torch.from_numpy(np.asarray(self.embedder.emb.vectors, dtype=np.float32))
+        weights = dequantize_rows(vectors, getattr(self, 'vector_scales', None))
+
+        self.vectors, self.vector_scales = quantize_rows(weights, dtype)
+        self.embedder.emb = None
+        self.version += 1
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_word_cache'] = OrderedDict()
+        return state
+
     def __str__(self):
         return self.name
 
@@ -392,26 +914,25 @@ class ELMoEmbeddings(TokenEmbeddings):
 
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
 
+        tokens: List[Token] = [token for sentence in sentences for token in sentence.tokens]
+        if not tokens:
+            return sentences
+
         sentence_words: List[List[str]] = []
         for sentence in sentences:
             sentence_words.append([token.text for token in sentence])
 
         embeddings = self.ee.embed_batch(sentence_words)
 
-        for i, sentence in enumerate(sentences):
-
-            sentence_embeddings = embeddings[i]
-
-            for token, token_idx in zip(sentence.tokens, range(len(sentence.tokens))):
-                token: Token = token
-
-                word_embedding = torch.cat([
-                    torch.FloatTensor(sentence_embeddings[0, token_idx, :]),
-                    torch.FloatTensor(sentence_embeddings[1, token_idx, :]),
-                    torch.FloatTensor(sentence_embeddings[2, token_idx, :])
-                ], 0)
+        # the output has shape (layers, tokens, dim) per sentence, one reshape turns it into the concatenated layers
+        # per token. All tokens of the batch are moved to the embedding device at once
+        word_embeddings = torch.cat([
+            torch.from_numpy(sentence_embeddings).float().transpose(0, 1).reshape(
+                len(sentence), sentence_embeddings.shape[0] * sentence_embeddings.shape[2])
+            for sentence, sentence_embeddings in zip(sentences, embeddings)]).to(_embedding_device(sentences))
 
-                token.set_embedding(self.name, word_embedding)
+        for token, word_embedding in zip(tokens, word_embeddings):
+            token.set_embedding(self.name, word_embedding)
 
         return sentences
 
@@ -466,23 +987,30 @@ class ELMoTransformerEmbeddings(TokenEmbeddings):
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
         # Avoid conflicts with flair's Token class
         import allennlp.data.tokenizers.token as allen_nlp_token
+        from allennlp.data.token_indexers.elmo_indexer import ELMoCharacterMapper
 
         indexer = self.indexer
         vocab = self.vocab
 
-        for sentence in sentences:
-            character_indices = indexer.tokens_to_indices([allen_nlp_token.Token(token.text) for token in sentence],
-                                                          vocab, "elmo")["elmo"]
+        non_empty = [sentence for sentence in sentences if len(sentence) > 0]
+        character_indices = [indexer.tokens_to_indices([allen_nlp_token.Token(token.text) for token in sentence],
+                                                       vocab, "elmo")["elmo"] for sentence in non_empty]
+
+        for bucket in _bucket_by_length([len(sentence) for sentence in non_empty]):
 
-            indices_tensor = torch.LongTensor([character_indices])
+            # pad with all-zero character ids, which the model masks out
+            longest = len(non_empty[bucket[0]])
+            padding = [0] * ELMoCharacterMapper.max_word_length
+            indices_tensor = torch.LongTensor([character_indices[index] + [padding] * (longest - len(non_empty[index]))
+                                               for index in bucket])
             indices_tensor = indices_tensor.to(device=flair.device)
-            embeddings = self.lm_embedder(indices_tensor)[0].detach().cpu().numpy()
 
-            for token, token_idx in zip(sentence.tokens, range(len(sentence.tokens))):
-                token: Token = token
-                embedding = embeddings[token_idx]
-                word_embedding = torch.FloatTensor(embedding)
-                token.set_embedding(self.name, word_embedding)
+            with torch.no_grad():
+                embeddings = self.lm_embedder(indices_tensor).detach().to(_embedding_device(sentences))
+
+            for index, sentence_embeddings in zip(bucket, embeddings):
+                for token, word_embedding in zip(non_empty[index].tokens, sentence_embeddings):
+                    token.set_embedding(self.name, word_embedding)
 
         return sentences
 
@@ -495,13 +1023,27 @@ class ELMoTransformerEmbeddings(TokenEmbeddings):
 
 class TransformerXLEmbeddings(TokenEmbeddings):
     def __init__(self,
-                 model: str = 'transfo-xl-wt103'):
+                 model: str = 'transfo-xl-wt103',
+                 carry_memory: bool = False,
+                 memory_length: int = None,
+                 segment_length: int = None):
         """Transformer-XL embeddings, as proposed in Dai et al., 2019.
-        :param model: name of Transformer-XL model
+        :param model: name of Transformer-XL model or directory containing a model
+        :param carry_memory: if True, sentences are treated as consecutive parts of one document. Their tokens are
+        embedded as one stream and the recurrence memory of the model is carried over from one batch to the next, so
+        each sentence sees the preceding ones as context. Call reset_memory() at the start of a new document
+        :param memory_length: number of preceding hidden states kept in the recurrence memory if carry_memory is set,
+        defaults to the memory length of the model
+        :param segment_length: number of tokens embedded in one step if carry_memory is set, defaults to the target
+        length of the model
         """
         super().__init__()
 
-        if model not in TRANSFORMER_XL_PRETRAINED_MODEL_ARCHIVE_MAP.keys():
+        from pytorch_pretrained_bert import TransfoXLTokenizer, TransfoXLModel
+        from pytorch_pretrained_bert.modeling_transfo_xl import \
+            PRETRAINED_MODEL_ARCHIVE_MAP as TRANSFORMER_XL_PRETRAINED_MODEL_ARCHIVE_MAP
+
+        if model not in TRANSFORMER_XL_PRETRAINED_MODEL_ARCHIVE_MAP.keys() and not os.path.isdir(model):
             raise ValueError('Provided Transformer-XL model is not available.')
 
         self.tokenizer = TransfoXLTokenizer.from_pretrained(model)
@@ -509,34 +1051,75 @@ class TransformerXLEmbeddings(TokenEmbeddings):
         self.name = model
         self.static_embeddings = True
 
+        self.carry_memory: bool = False
+        self._mems: Optional[List[torch.Tensor]] = None
+
         dummy_sentence: Sentence = Sentence()
         dummy_sentence.add_token(Token('hello'))
         embedded_dummy = self.embed(dummy_sentence)
         self.__embedding_length: int = len(embedded_dummy[0].get_token(1).get_embedding())
 
+        self.carry_memory = carry_memory
+        self.segment_length: int = segment_length if segment_length else self.model.tgt_len
+        if carry_memory and memory_length:
+            self.model.reset_length(self.model.tgt_len, self.model.ext_len, memory_length)
+
     @property
     def embedding_length(self) -> int:
         return self.__embedding_length
 
+    def reset_memory(self):
+        """Forgets the context of previously embedded sentences, e.g. at the start of a new document."""
+        self._mems = None
+
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
         self.model.to(flair.device)
         self.model.eval()
 
+        sentences_with_tokens = [sentence for sentence in sentences if len(sentence) > 0]
+
         with torch.no_grad():
-            for sentence in sentences:
-                token_strings = [token.text for token in sentence.tokens]
-                indexed_tokens = self.tokenizer.convert_tokens_to_ids(token_strings)
+            if getattr(self, 'carry_memory', False):
+                self._embed_stream(sentences_with_tokens)
+            else:
+                self._embed_batch(sentences_with_tokens)
+
+        return sentences
 
-                tokens_tensor = torch.tensor([indexed_tokens])
-                tokens_tensor = tokens_tensor.to(flair.device)
+    def _embed_batch(self, sentences: List[Sentence]):
+        # Transformer-XL only attends to preceding tokens, so padding at the end does not change any embedding
+        for bucket in _bucket_by_length([len(sentence) for sentence in sentences]):
+            batch = [sentences[index] for index in bucket]
+            longest = len(batch[0])
 
-                hidden_states, _ = self.model(tokens_tensor)
+            input_ids = [self.tokenizer.convert_tokens_to_ids([token.text for token in sentence.tokens])
+                         + [0] * (longest - len(sentence)) for sentence in batch]
 
-                for token, token_idx in zip(sentence.tokens, range(len(sentence.tokens))):
-                    token: Token = token
-                    token.set_embedding(self.name, hidden_states[0][token_idx])
+            hidden_states, _ = self.model(torch.tensor(input_ids, dtype=torch.long, device=flair.device))
+            hidden_states = hidden_states.to(_embedding_device(sentences))
 
-        return sentences
+            for sentence, sentence_states in zip(batch, hidden_states):
+                for token, token_state in zip(sentence.tokens, sentence_states):
+                    token.set_embedding(self.name, token_state)
+
+    def _embed_stream(self, sentences: List[Sentence]):
+        tokens = [token for sentence in sentences for token in sentence.tokens]
+        input_ids = self.tokenizer.convert_tokens_to_ids([token.text for token in tokens])
+
+        # the memory is moved along segment by segment, starting with the memory left by the previous batch
+        for start in range(0, len(tokens), self.segment_length):
+            segment = torch.tensor([input_ids[start:start + self.segment_length]], dtype=torch.long,
+                                   device=flair.device)
+            hidden_states, self._mems = self.model(segment, mems=self._mems)
+            hidden_states = hidden_states.to(_embedding_device(sentences))
+
+            for token, token_state in zip(tokens[start:start + self.segment_length], hidden_states[0]):
+                token.set_embedding(self.name, token_state)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_mems'] = None
+        return state
 
     def extra_repr(self):
         return 'model={}'.format(self.name)
@@ -577,58 +1160,70 @@ class CharacterEmbeddings(TokenEmbeddings):
 
     def _add_embeddings_internal(self, sentences: List[Sentence]):
 
-        for sentence in sentences:
+        tokens: List[Token] = [token for sentence in sentences for token in sentence.tokens]
+        if not tokens:
+            return sentences
 
-            tokens_char_indices = []
+        # every word type of the mini-batch is run through the character LSTM only once
+        word_indices: Dict[str, int] = {}
+        token_word_indices = [word_indices.setdefault(token.text, len(word_indices)) for token in tokens]
+        words = list(word_indices.keys())
 
-            # translate words in sentence into ints using dictionary
-            for token in sentence.tokens:
-                token: Token = token
-                char_indices = [self.char_dictionary.get_idx_for_item(char) for char in token.text]
-                tokens_char_indices.append(char_indices)
-
-            # sort words by length, for batching and masking
-            tokens_sorted_by_length = sorted(tokens_char_indices, key=lambda p: len(p), reverse=True)
-            d = {}
-            for i, ci in enumerate(tokens_char_indices):
-                for j, cj in enumerate(tokens_sorted_by_length):
-                    if ci == cj:
-                        d[j] = i
-                        continue
-            chars2_length = [len(c) for c in tokens_sorted_by_length]
-            longest_token_in_sentence = max(chars2_length)
-            tokens_mask = torch.zeros((len(tokens_sorted_by_length), longest_token_in_sentence),
-                                      dtype=torch.long, device=flair.device)
-
-            for i, c in enumerate(tokens_sorted_by_length):
-                tokens_mask[i, :chars2_length[i]] = torch.tensor(c, dtype=torch.long, device=flair.device)
-
-            # chars for rnn processing
-            chars = tokens_mask
-
-            character_embeddings = self.char_embedding(chars).transpose(0, 1)
-
-            packed = torch.nn.utils.rnn.pack_padded_sequence(character_embeddings, chars2_length)
-
-            lstm_out, self.hidden = self.char_rnn(packed)
-
-            outputs, output_lengths = torch.nn.utils.rnn.pad_packed_sequence(lstm_out)
-            outputs = outputs.transpose(0, 1)
-            chars_embeds_temp = torch.zeros((outputs.size(0), outputs.size(2)),
-                                            dtype=torch.float, device=flair.device)
-            for i, index in enumerate(output_lengths):
-                chars_embeds_temp[i] = outputs[i, index - 1]
-            character_embeddings = chars_embeds_temp.clone()
-            for i in range(character_embeddings.size(0)):
-                character_embeddings[d[i]] = chars_embeds_temp[i]
-
-            for token_number, token in enumerate(sentence.tokens):
-                token.set_embedding(self.name, character_embeddings[token_number])
+        # sort words by length for packing, the inverse permutation restores the original order
+        lengths = torch.tensor([max(len(word), 1) for word in words], dtype=torch.long)
+        lengths_sorted, sort_order = lengths.sort(descending=True)
+        restore_order = sort_order.argsort()
+
+        longest_word = int(lengths_sorted[0])
+        chars = []
+        for index in sort_order.tolist():
+            char_indices = [self.char_dictionary.get_idx_for_item(char) for char in words[index]]
+            chars.append(char_indices + [0] * (longest_word - len(char_indices)))
+        chars = torch.tensor(chars, dtype=torch.long, device=flair.device)
+
+        character_embeddings = self.char_embedding(chars).transpose(0, 1)
+
+        packed = torch.nn.utils.rnn.pack_padded_sequence(character_embeddings, lengths_sorted)
+
+        lstm_out, _ = self.char_rnn(packed)
+
+        outputs, _ = torch.nn.utils.rnn.pad_packed_sequence(lstm_out)
+
+        # output at the last character of each word
+        word_embeddings = outputs[lengths_sorted - 1, torch.arange(len(words))]
+        word_embeddings = word_embeddings[restore_order.to(word_embeddings.device)]
+
+        token_embeddings = word_embeddings[torch.tensor(token_word_indices, device=word_embeddings.device)]
+        for token, embedding in zip(tokens, token_embeddings):
+            token.set_embedding(self.name, embedding)
+
+        return sentences
 
     def __str__(self):
         return self.name
 
 
+def _embedding_device(sentences: List[Sentence]) -> torch.device:
+    """Returns the device on which embeddings of the given sentences are kept, see Sentence.embedding_device."""
+    device = sentences[0].embedding_device if sentences else None
+    return device if device is not None else torch.device('cpu')
+
+
+def _bucket_by_length(lengths: List[int], min_ratio: float = 0.5) -> List[List[int]]:
+    """
+    Groups indices of strings by their length, longest first. A new group is started whenever a string is shorter than
+    min_ratio times the longest string of the current group, so that padding at most doubles the work.
+    """
+    buckets: List[List[int]] = []
+    bucket_longest = 0
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        if not buckets or lengths[index] < bucket_longest * min_ratio:
+            buckets.append([])
+            bucket_longest = lengths[index]
+        buckets[-1].append(index)
+    return buckets
+
+
 class FlairEmbeddings(TokenEmbeddings):
     """Contextual string embeddings of words, as proposed in Akbik et al., 2018."""
 
@@ -832,39 +1427,35 @@ class FlairEmbeddings(TokenEmbeddings):
         self.static_embeddings = True
 
         from flair.models import LanguageModel
-        self.lm = LanguageModel.load_language_model(model)
+        self.lm = LanguageModel.load_language_model(model, with_decoder=False)
 
         self.is_forward_lm: bool = self.lm.is_forward_lm
         self.chars_per_chunk: int = chars_per_chunk
 
-        # initialize cache if use_cache set
-        self.cache = None
-        if use_cache:
-            cache_path = Path(f'{self.name}-tmp-cache.sqllite') if not cache_directory else \
-                cache_directory / f'{self.name}-tmp-cache.sqllite'
-            from sqlitedict import SqliteDict
-            self.cache = SqliteDict(str(cache_path), autocommit=True)
-
         # embed a dummy sentence to determine embedding_length
         dummy_sentence: Sentence = Sentence()
         dummy_sentence.add_token(Token('hello'))
         embedded_dummy = self.embed(dummy_sentence)
         self.__embedding_length: int = len(embedded_dummy[0].get_token(1).get_embedding())
 
+        # initialize cache if use_cache set
+        if use_cache:
+            cache_path = Path(f'{self.name}-cache') if not cache_directory else \
+                Path(cache_directory) / f'{Path(self.name).name}-cache'
+            self.enable_cache(cache_path)
+
         # set to eval mode
         self.eval()
 
     def train(self, mode=True):
         pass
 
-    def __getstate__(self):
-        # Copy the object's state from self.__dict__ which contains
-        # all our instance attributes. Always use the dict.copy()
-        # method to avoid modifying the original state.
-        state = self.__dict__.copy()
-        # Remove the unpicklable entries.
-        state['cache'] = None
-        return state
+    def _get_fingerprint(self) -> str:
+        if Path(self.name).exists():
+            return file_fingerprint(self.name)
+
+        # the model file may not exist on this machine if the embeddings were loaded as part of a model
+        return _fingerprint_tensors(self.lm.state_dict().values())
 
     @property
     def embedding_length(self) -> int:
@@ -876,87 +1467,71 @@ class FlairEmbeddings(TokenEmbeddings):
         if 'chars_per_chunk' not in self.__dict__:
             self.chars_per_chunk = 512
 
-        # if cache is used, try setting embeddings from cache first
-        if 'cache' in self.__dict__ and self.cache is not None:
-
-            # try populating embeddings from cache
-            all_embeddings_retrieved_from_cache: bool = True
-            for sentence in sentences:
-                key = sentence.to_tokenized_string()
-                embeddings = self.cache.get(key)
-
-                if not embeddings:
-                    all_embeddings_retrieved_from_cache = False
-                    break
-                else:
-                    for token, embedding in zip(sentence, embeddings):
-                        token.set_embedding(self.name, torch.FloatTensor(embedding))
-
-            if all_embeddings_retrieved_from_cache:
-                return sentences
-
         with torch.no_grad():
 
-            # if this is not possible, use LM to generate embedding. First, get text sentences
             text_sentences = [sentence.to_tokenized_string() for sentence in sentences]
 
-            longest_character_sequence_in_batch: int = len(max(text_sentences, key=len))
-
-            # pad strings with whitespaces to longest sentence
-            sentences_padded: List[str] = []
-            append_padded_sentence = sentences_padded.append
+            # sentences of similar length are run through the LM together, so that few strings need padding
+            for bucket in _bucket_by_length([len(text) for text in text_sentences]):
+                bucket_sentences = [sentences[i] for i in bucket]
+                bucket_texts = [text_sentences[i] for i in bucket]
 
-            start_marker = '\n'
-
-            end_marker = ' '
-            extra_offset = len(start_marker)
-            for sentence_text in text_sentences:
-                pad_by = longest_character_sequence_in_batch - len(sentence_text)
-                if self.is_forward_lm:
-                    padded = '{}{}{}{}'.format(start_marker, sentence_text, end_marker, pad_by * ' ')
-                    append_padded_sentence(padded)
-                else:
-                    padded = '{}{}{}{}'.format(start_marker, sentence_text[::-1], end_marker, pad_by * ' ')
-                    append_padded_sentence(padded)
-
-            # get hidden states from language model
-            all_hidden_states_in_lm = self.lm.get_representation(sentences_padded, self.chars_per_chunk)
-
-            # take first or last hidden states from language model as word representation
-            for i, sentence in enumerate(sentences):
-                sentence_text = sentence.to_tokenized_string()
-
-                offset_forward: int = extra_offset
-                offset_backward: int = len(sentence_text) + extra_offset
-
-                for token in sentence.tokens:
-                    token: Token = token
+                all_hidden_states_in_lm = self._get_hidden_states(bucket_texts)
 
-                    offset_forward += len(token.text)
+                # take first or last hidden states from language model as word representation
+                offsets, columns = self._get_token_offsets(bucket_sentences, bucket_texts)
+                embeddings = all_hidden_states_in_lm[offsets.to(all_hidden_states_in_lm.device),
+                                                     columns.to(all_hidden_states_in_lm.device)]
+                embeddings = embeddings.to(_embedding_device(sentences))
 
-                    if self.is_forward_lm:
-                        offset = offset_forward
-                    else:
-                        offset = offset_backward
+                tokens = [token for sentence in bucket_sentences for token in sentence.tokens]
+                for token, embedding in zip(tokens, embeddings):
+                    token.set_embedding(self.name, embedding)
 
-                    embedding = all_hidden_states_in_lm[offset, i, :]
+        return sentences
 
-                    # if self.tokenized_lm or token.whitespace_after:
-                    offset_forward += 1
-                    offset_backward -= 1
+    def _get_hidden_states(self, texts: List[str]) -> torch.Tensor:
+        """Runs the padded texts through the LM and returns all its hidden states."""
+        longest_character_sequence_in_batch: int = max(len(text) for text in texts)
 
-                    offset_backward -= len(token.text)
+        # pad strings with whitespaces to longest sentence
+        start_marker = '\n'
+        end_marker = ' '
 
-                    token.set_embedding(self.name, embedding.clone().detach())
+        sentences_padded: List[str] = []
+        for text in texts:
+            pad_by = longest_character_sequence_in_batch - len(text)
+            text = text if self.is_forward_lm else text[::-1]
+            sentences_padded.append(f'{start_marker}{text}{end_marker}{pad_by * " "}')
 
-            all_hidden_states_in_lm = None
+        return self.lm.get_representation(sentences_padded, self.chars_per_chunk)
 
-        if 'cache' in self.__dict__ and self.cache is not None:
-            for sentence in sentences:
-                self.cache[sentence.to_tokenized_string()] = [token._embeddings[self.name].tolist() for token in
-                                                              sentence]
+    def _get_token_offsets(self, sentences: List[Sentence], texts: List[str]) -> (torch.Tensor, torch.Tensor):
+        """
+        Computes for each token the position of its hidden state in the LM output: the state after its last character
+        for forward LMs, and before its first character for backward LMs.
+        :return: character offsets and column in the batch of each token
+        """
+        sentence_lengths = torch.tensor([len(sentence) for sentence in sentences], dtype=torch.long)
+        token_lengths = torch.tensor([len(token.text) for sentence in sentences for token in sentence.tokens],
+                                     dtype=torch.long)
+        columns = torch.arange(len(sentences)).repeat_interleave(sentence_lengths)
+
+        # characters before each token in its sentence, including the whitespace after each earlier token
+        sentence_characters = torch.tensor([sum(len(token.text) + 1 for token in sentence) for sentence in sentences],
+                                           dtype=torch.long)
+        before = (token_lengths + 1).cumsum(0) - (token_lengths + 1)
+        before -= (sentence_characters.cumsum(0) - sentence_characters).repeat_interleave(sentence_lengths)
+
+        # the start marker precedes every sentence
+        extra_offset = 1
+        if self.is_forward_lm:
+            offsets = extra_offset + before + token_lengths
+        else:
+            text_lengths = torch.tensor([len(text) for text in texts], dtype=torch.long)
+            offsets = extra_offset + text_lengths.repeat_interleave(sentence_lengths) - before
 
-        return sentences
+        return offsets, columns
 
     def __str__(self):
         return self.name
@@ -968,10 +1543,27 @@ class PooledFlairEmbeddings(TokenEmbeddings):
                  contextual_embeddings: Union[str, FlairEmbeddings],
                  pooling: str = 'fade',
                  only_capitalized: bool = False,
+                 memory_size: int = 100000,
+                 eviction: str = 'lru',
                  **kwargs):
-
+        """
+        Contextual string embeddings that are pooled over all occurrences of a word, as proposed in Akbik et al., 2019.
+        :param contextual_embeddings: FlairEmbeddings or the name of a FlairEmbeddings model
+        :param pooling: how the memory of a word is updated with each occurrence, either 'fade', 'mean', 'min' or 'max'
+        :param only_capitalized: whether to add only capitalized words to memory (faster runtime and lower memory
+        consumption)
+        :param memory_size: maximum number of words in memory. The memory matrix grows up to this number of rows, after
+        which words are evicted to make room for new ones
+        :param eviction: which words are evicted from a full memory, either the least recently used ('lru') or the least
+        frequently used ('lfu')
+        """
         super().__init__()
 
+        if pooling not in ['fade', 'mean', 'min', 'max']:
+            raise ValueError(f'Pooling operation "{pooling}" is not supported.')
+        if eviction not in ['lru', 'lfu']:
+            raise ValueError(f'Eviction strategy "{eviction}" is not supported.')
+
         # use the character language model embeddings as basis
         if type(contextual_embeddings) is str:
             self.context_embeddings: FlairEmbeddings = FlairEmbeddings(contextual_embeddings, **kwargs)
@@ -982,10 +1574,6 @@ class PooledFlairEmbeddings(TokenEmbeddings):
         self.embedding_length = self.context_embeddings.embedding_length * 2
         self.name = self.context_embeddings.name + '-context'
 
-        # these fields are for the embedding memory
-        self.word_embeddings = {}
-        self.word_count = {}
-
         # whether to add only capitalized words to memory (faster runtime and lower memory consumption)
         self.only_capitalized = only_capitalized
 
@@ -994,58 +1582,240 @@ class PooledFlairEmbeddings(TokenEmbeddings):
 
         # set the memory method
         self.pooling = pooling
-        if pooling == 'mean':
-            self.aggregate_op = torch.add
-        elif pooling == 'fade':
-            self.aggregate_op = torch.add
-        elif pooling == 'max':
-            self.aggregate_op = torch.max
-        elif pooling == 'min':
-            self.aggregate_op = torch.min
+        self.memory_size: int = memory_size
+        self.eviction: str = eviction
+
+        # the embedding memory: one row per word, found through the word index
+        self.memory: Optional[torch.Tensor] = None
+        self.memory_counts: Optional[torch.Tensor] = None
+        self.memory_last_used: Optional[torch.Tensor] = None
+        self.memory_index: Dict[str, int] = {}
+        self.memory_words: List[str] = []
+        self._memory_step: int = 0
 
     def train(self, mode=True):
         super().train(mode=mode)
         if mode:
             # memory is wiped each time we do a training run
-            print('train mode resetting embeddings')
-            self.word_embeddings = {}
-            self.word_count = {}
+            log.info('train mode resetting embeddings')
+            self.reset_memory()
+
+    def reset_memory(self):
+        """Forgets all words in memory, but keeps the allocated memory matrix."""
+        self.memory_index = {}
+        self.memory_words = []
+        self._memory_step = 0
 
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
 
         self.context_embeddings.embed(sentences)
 
-        # if we keep a pooling, it needs to be updated continuously
-        for sentence in sentences:
-            for token in sentence.tokens:
-
-                # update embedding
-                local_embedding = token._embeddings[self.context_embeddings.name]
+        tokens = [token for sentence in sentences for token in sentence.tokens]
+        if len(tokens) == 0:
+            return sentences
 
-                if token.text[0].isupper() or not self.only_capitalized:
+        local_embeddings = torch.stack([token._embeddings[self.context_embeddings.name] for token in tokens]).float()
 
-                    if token.text not in self.word_embeddings:
-                        self.word_embeddings[token.text] = local_embedding
-                        self.word_count[token.text] = 1
-                    else:
-                        aggregated_embedding = self.aggregate_op(self.word_embeddings[token.text], local_embedding)
-                        if self.pooling == 'fade':
-                            aggregated_embedding /= 2
-                        self.word_embeddings[token.text] = aggregated_embedding
-                        self.word_count[token.text] += 1
+        # if we keep a pooling, it needs to be updated continuously
+        with torch.no_grad():
+            rows = self._update_memory([token.text for token in tokens], local_embeddings.detach())
 
         # add embeddings after updating
-        for sentence in sentences:
-            for token in sentence.tokens:
-                if token.text in self.word_embeddings:
-                    base = self.word_embeddings[token.text] / self.word_count[token.text] \
-                        if self.pooling == 'mean' else self.word_embeddings[token.text]
+        pooled_embeddings = local_embeddings
+        in_memory = (rows >= 0).nonzero().squeeze(1)
+        if len(in_memory) > 0:
+            memory_rows = rows[in_memory]
+            word_embeddings = self.memory[memory_rows]
+            if self.pooling == 'mean':
+                word_embeddings = word_embeddings / self.memory_counts[memory_rows].unsqueeze(1).float()
+            pooled_embeddings = local_embeddings.index_copy(0, in_memory, word_embeddings)
+
+        for token, embedding in zip(tokens, pooled_embeddings):
+            token.set_embedding(self.name, embedding)
+
+        return sentences
+
+    def _update_memory(self, texts: List[str], embeddings: torch.Tensor) -> torch.Tensor:
+        """
+        Adds the embeddings of a batch of tokens to the memory of their words.
+        :param texts: text of each token
+        :param embeddings: matrix with the contextual embedding of each token
+        :return: memory row of each token or -1 if its word is not in memory
+        """
+        self._memory_step += 1
+
+        # positions of each word in the batch, in order of occurrence
+        occurrences: Dict[str, List[int]] = {}
+        for position, text in enumerate(texts):
+            if not self.only_capitalized or text[0].isupper():
+                occurrences.setdefault(text, []).append(position)
+
+        new_words = [word for word in occurrences if word not in self.memory_index]
+        is_new = set(new_words)
+        batch_rows = [self.memory_index[word] for word in occurrences if word in self.memory_index]
+        for word, row in zip(new_words, self._allocate_rows(len(new_words), batch_rows, embeddings)):
+            self.memory_index[word] = row
+            self.memory_words[row] = word
+
+        # the first occurrence of a new word initializes its memory, all others are pooled into it level by level
+        # such that a word occurring several times in the batch is updated in the order of its occurrences
+        initial_rows, initial_positions = [], []
+        levels: List[Tuple[List[int], List[int]]] = []
+        word_rows, word_counts = [], []
+        for word, positions in occurrences.items():
+            row = self.memory_index.get(word)
+            if row is None:
+                continue
+
+            word_rows.append(row)
+            word_counts.append(len(positions))
+
+            if word in is_new:
+                initial_rows.append(row)
+                initial_positions.append(positions[0])
+                positions = positions[1:]
+
+            for level, position in enumerate(positions):
+                if level == len(levels):
+                    levels.append(([], []))
+                levels[level][0].append(row)
+                levels[level][1].append(position)
+
+        device = embeddings.device
+        if initial_rows:
+            initial_rows_tensor = torch.tensor(initial_rows, dtype=torch.long, device=device)
+            self.memory[initial_rows_tensor] = embeddings[torch.tensor(initial_positions, device=device)]
+            self.memory_counts[initial_rows_tensor] = 0
+
+        if self.pooling == 'mean' and levels:
+            rows = torch.tensor([row for level in levels for row in level[0]], dtype=torch.long, device=device)
+            positions = torch.tensor([position for level in levels for position in level[1]], device=device)
+            self.memory.index_add_(0, rows, embeddings[positions])
+        else:
+            for rows, positions in levels:
+                rows = torch.tensor(rows, dtype=torch.long, device=device)
+                memory_embeddings = self.memory[rows]
+                local_embeddings = embeddings[torch.tensor(positions, device=device)]
+                if self.pooling == 'fade':
+                    memory_embeddings = (memory_embeddings + local_embeddings) / 2
+                elif self.pooling == 'max':
+                    memory_embeddings = torch.max(memory_embeddings, local_embeddings)
                 else:
-                    base = token._embeddings[self.context_embeddings.name]
+                    memory_embeddings = torch.min(memory_embeddings, local_embeddings)
+                self.memory[rows] = memory_embeddings
 
-                token.set_embedding(self.name, base)
+        if word_rows:
+            word_rows_tensor = torch.tensor(word_rows, dtype=torch.long, device=device)
+            self.memory_counts.index_add_(0, word_rows_tensor, torch.tensor(word_counts, device=device))
+            self.memory_last_used[word_rows_tensor] = self._memory_step
 
-        return sentences
+        return torch.tensor([self.memory_index.get(text, -1) for text in texts], dtype=torch.long, device=device)
+
+    def _allocate_rows(self, number: int, protected_rows: List[int], embeddings: torch.Tensor) -> List[int]:
+        """
+        Finds memory rows for new words. Free rows are used first, then words not in the current batch are evicted.
+        Returns fewer rows than requested if the memory cannot hold all words of the batch.
+        """
+        used = len(self.memory_words)
+        rows = list(range(used, min(used + number, self.memory_size)))
+        self._reserve_memory(used + len(rows), embeddings)
+        self.memory_words.extend([''] * len(rows))
+
+        missing = number - len(rows)
+        if missing > 0:
+            score = (self.memory_last_used if self.eviction == 'lru' else self.memory_counts)[:used].clone()
+            evictable = used - len(protected_rows)
+            if protected_rows:
+                score[torch.tensor(protected_rows, dtype=torch.long, device=score.device)] = score.max() + 1
+            if evictable > 0:
+                evicted = torch.topk(score, min(missing, evictable), largest=False)[1].tolist()
+                for row in evicted:
+                    del self.memory_index[self.memory_words[row]]
+                rows.extend(evicted)
+
+        return rows
+
+    def _reserve_memory(self, rows: int, embeddings: torch.Tensor):
+        # the memory matrix grows geometrically up to the memory size, so rows are rarely re-allocated
+        allocated = 0 if self.memory is None else self.memory.size(0)
+        if self.memory is not None and rows <= allocated and self.memory.device == embeddings.device:
+            return
+
+        size = max(rows, min(self.memory_size, max(2 * allocated, 1024)))
+        memory = embeddings.new_zeros(size, embeddings.size(1))
+        counts = torch.zeros(size, dtype=torch.long, device=embeddings.device)
+        last_used = torch.zeros(size, dtype=torch.long, device=embeddings.device)
+        if allocated > 0:
+            memory[:allocated] = self.memory
+            counts[:allocated] = self.memory_counts
+            last_used[:allocated] = self.memory_last_used
+
+        self.memory, self.memory_counts, self.memory_last_used = memory, counts, last_used
+
+    def save_memory(self, path: Union[str, Path]):
+        """Saves the words in memory and their pooled embeddings, e.g. to use them for inference."""
+        used = len(self.memory_words)
+        torch.save({
+            'pooling': self.pooling,
+            'words': self.memory_words,
+            'memory': self.memory[:used].cpu() if used > 0 else None,
+            'counts': self.memory_counts[:used].cpu() if used > 0 else None,
+        }, str(path))
+
+    def load_memory(self, path: Union[str, Path]):
+        """
+        Replaces the memory with one saved by save_memory. If it holds more words than the memory size, the most
+        frequent words are kept.
+        """
+        state = torch.load(str(path), map_location=flair.device)
+        if state['pooling'] != self.pooling:
+            raise ValueError(f'Memory was pooled with "{state["pooling"]}", but these embeddings use "{self.pooling}".')
+
+        self.reset_memory()
+        if not state['words']:
+            return
+        self._set_memory(state['words'], state['memory'], state['counts'])
+
+    def _set_memory(self, words: List[str], memory: torch.Tensor, counts: torch.Tensor):
+        if len(words) > self.memory_size:
+            kept = torch.topk(counts, self.memory_size)[1].sort()[0]
+            words = [words[row] for row in kept.tolist()]
+            memory, counts = memory[kept], counts[kept]
+
+        self._reserve_memory(len(words), memory)
+        self.memory[:len(words)] = memory
+        self.memory_counts[:len(words)] = counts.to(self.memory_counts.device)
+        self.memory_last_used[:len(words)] = 0
+        self.memory_words = list(words)
+        self.memory_index = {word: row for row, word in enumerate(words)}
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # only the rows holding words are saved
+        if self.memory is not None:
+            used = len(self.memory_words)
+            state['memory'] = self.memory[:used].clone()
+            state['memory_counts'] = self.memory_counts[:used].clone()
+            state['memory_last_used'] = self.memory_last_used[:used].clone()
+        return state
+
+    def __setstate__(self, state):
+        # models saved with earlier versions hold the memory in dictionaries
+        word_embeddings = state.pop('word_embeddings', None)
+        word_count = state.pop('word_count', None)
+        state.pop('aggregate_op', None)
+        super().__setstate__(state)
+
+        if word_embeddings is not None:
+            self.memory_size = 100000
+            self.eviction = 'lru'
+            self.memory = self.memory_counts = self.memory_last_used = None
+            self.reset_memory()
+            if word_embeddings:
+                words = list(word_embeddings.keys())
+                self._set_memory(words,
+                                 torch.stack([word_embeddings[word].float() for word in words]),
+                                 torch.tensor([word_count[word] for word in words], dtype=torch.long))
 
     def embedding_length(self) -> int:
         return self.embedding_length
@@ -1053,10 +1823,16 @@ class PooledFlairEmbeddings(TokenEmbeddings):
 
 class BertEmbeddings(TokenEmbeddings):
 
+    # number of words whose word pieces are kept in memory
+    word_cache_size = 100000
+
     def __init__(self,
                  bert_model_or_path: str = 'bert-base-uncased',
                  layers: str = '-1,-2,-3,-4',
-                 pooling_operation: str = 'first'):
+                 pooling_operation: str = 'first',
+                 max_sequence_length: int = None,
+                 stride: int = None,
+                 pack_sentences: bool = False):
         """
         Bidirectional transformer embeddings of words, as proposed in Devlin et al., 2018.
         :param bert_model_or_path: name of BERT model ('') or directory path containing custom model, configuration file
@@ -1064,9 +1840,20 @@ class BertEmbeddings(TokenEmbeddings):
         :param layers: string indicating which layers to take for embedding
         :param pooling_operation: how to get from token piece embeddings to token embedding. Either pool them and take
         the average ('mean') or use first word piece embedding as token embedding ('first)
+        :param max_sequence_length: maximum number of word pieces (including [CLS] and [SEP]) in one input to the model.
+        Defaults to the maximum the model supports. Longer sentences are embedded in overlapping windows, and each word
+        piece takes its embedding from the window in which it has the most context
+        :param stride: number of word pieces between the starts of two windows, defaults to half a window
+        :param pack_sentences: if True, several short sentences are packed into one input of the model. Each sentence
+        only attends to its own word pieces, so this saves forward passes without changing the embeddings
         """
         super().__init__()
 
+        if pooling_operation not in ['first', 'mean']:
+            raise ValueError(f'Pooling operation "{pooling_operation}" is not supported.')
+
+        from pytorch_pretrained_bert import BertTokenizer, BertModel
+
         self.tokenizer = BertTokenizer.from_pretrained(bert_model_or_path)
         self.model = BertModel.from_pretrained(bert_model_or_path)
         self.layer_indexes = [int(x) for x in layers.split(",")]
@@ -1074,119 +1861,175 @@ class BertEmbeddings(TokenEmbeddings):
         self.name = str(bert_model_or_path)
         self.static_embeddings = True
 
-    class BertInputFeatures(object):
-        """Private helper class for holding BERT-formatted features"""
+        model_max_length = self.model.config.max_position_embeddings
+        self.max_sequence_length: int = max_sequence_length if max_sequence_length else model_max_length
+        if not 2 < self.max_sequence_length <= model_max_length:
+            raise ValueError(f'Maximum sequence length must be between 3 and {model_max_length}.')
 
-        def __init__(self, unique_id, tokens, input_ids, input_mask, input_type_ids, token_subtoken_count):
-            self.unique_id = unique_id
-            self.tokens = tokens
-            self.input_ids = input_ids
-            self.input_mask = input_mask
-            self.input_type_ids = input_type_ids
-            self.token_subtoken_count = token_subtoken_count
+        window = self.max_sequence_length - 2
+        self.stride: int = stride if stride else max(1, window // 2)
+        if not 0 < self.stride <= window:
+            raise ValueError(f'Stride must be between 1 and {window}.')
 
-    def _convert_sentences_to_features(self, sentences, max_sequence_length: int) -> [BertInputFeatures]:
+        self.pack_sentences: bool = pack_sentences
 
-        max_sequence_length = max_sequence_length + 2
+        self._wordpiece_cache: OrderedDict = OrderedDict()
 
-        features: List[BertEmbeddings.BertInputFeatures] = []
-        for (sentence_index, sentence) in enumerate(sentences):
+    def _get_wordpiece_ids(self, word: str) -> List[int]:
+        """Returns the ids of the word pieces of a word. Words the tokenizer drops entirely are mapped to [UNK]."""
+        cache: OrderedDict = self.__dict__.setdefault('_wordpiece_cache', OrderedDict())
 
-            bert_tokenization: List[str] = []
-            token_subtoken_count: Dict[int, int] = {}
+        ids = cache.get(word)
+        if ids is not None:
+            cache.move_to_end(word)
+            return ids
 
-            for token in sentence:
-                subtokens = self.tokenizer.tokenize(token.text)
-                bert_tokenization.extend(subtokens)
-                token_subtoken_count[token.idx] = len(subtokens)
-
-            if len(bert_tokenization) > max_sequence_length - 2:
-                bert_tokenization = bert_tokenization[0:(max_sequence_length - 2)]
-
-            tokens = []
-            input_type_ids = []
-            tokens.append("[CLS]")
-            input_type_ids.append(0)
-            for token in bert_tokenization:
-                tokens.append(token)
-                input_type_ids.append(0)
-            tokens.append("[SEP]")
-            input_type_ids.append(0)
-
-            input_ids = self.tokenizer.convert_tokens_to_ids(tokens)
-            # The mask has 1 for real tokens and 0 for padding tokens. Only real
-            # tokens are attended to.
-            input_mask = [1] * len(input_ids)
-
-            # Zero-pad up to the sequence length.
-            while len(input_ids) < max_sequence_length:
-                input_ids.append(0)
-                input_mask.append(0)
-                input_type_ids.append(0)
-
-            features.append(BertEmbeddings.BertInputFeatures(
-                unique_id=sentence_index,
-                tokens=tokens,
-                input_ids=input_ids,
-                input_mask=input_mask,
-                input_type_ids=input_type_ids,
-                token_subtoken_count=token_subtoken_count))
-
-        return features
+        ids = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(word) or ['[UNK]'])
+        cache[word] = ids
+        if len(cache) > self.word_cache_size:
+            cache.popitem(last=False)
+        return ids
 
     def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
         """Add embeddings to all words in a list of sentences. If embeddings are already added,
         updates only if embeddings are non-static."""
 
-        # first, find longest sentence in batch
-        longest_sentence_in_batch: int = len(
-            max([self.tokenizer.tokenize(sentence.to_tokenized_string()) for sentence in sentences], key=len))
-
-        # prepare id maps for BERT model
-        features = self._convert_sentences_to_features(sentences, longest_sentence_in_batch)
-        all_input_ids = torch.LongTensor([f.input_ids for f in features]).to(flair.device)
-        all_input_masks = torch.LongTensor([f.input_mask for f in features]).to(flair.device)
+        # tokenize each sentence into word pieces, remembering the number of pieces of each token
+        sentence_piece_ids: List[List[int]] = []
+        token_lengths: List[int] = []
+        for sentence in sentences:
+            piece_ids = []
+            for token in sentence:
+                token_piece_ids = self._get_wordpiece_ids(token.text)
+                piece_ids.extend(token_piece_ids)
+                token_lengths.append(len(token_piece_ids))
+            sentence_piece_ids.append(piece_ids)
+
+        # split sentences into windows that fit into the model
+        max_sequence_length = getattr(self, 'max_sequence_length', self.model.config.max_position_embeddings)
+        pack_sentences = getattr(self, 'pack_sentences', False)
+
+        windows: List[Tuple[int, int, int]] = []
+        piece_windows: List[List[int]] = []
+        for sentence_index, piece_ids in enumerate(sentence_piece_ids):
+            starts, best_windows = self._split_into_windows(len(piece_ids))
+            piece_windows.append([len(windows) + window for window in best_windows])
+            windows.extend((sentence_index, start, min(start + max_sequence_length - 2, len(piece_ids)))
+                           for start in starts)
+
+        # lay out each window as [CLS] pieces [SEP] in a row of the input, several per row if sentences are packed
+        window_rows, window_offsets, row_lengths = [], [], []
+        for _, start, end in windows:
+            length = end - start + 2
+            if not row_lengths or not pack_sentences or row_lengths[-1] + length > max_sequence_length:
+                row_lengths.append(0)
+            window_rows.append(len(row_lengths) - 1)
+            window_offsets.append(row_lengths[-1])
+            row_lengths[-1] += length
+
+        sequence_length = max(row_lengths)
+        cls_id, sep_id = self.tokenizer.convert_tokens_to_ids(['[CLS]', '[SEP]'])
+
+        input_ids = [[0] * sequence_length for _ in row_lengths]
+        position_ids = [[0] * sequence_length for _ in row_lengths]
+        window_ids = [[-1] * sequence_length for _ in row_lengths]
+        for window, (sentence_index, start, end) in enumerate(windows):
+            row, offset, length = window_rows[window], window_offsets[window], end - start + 2
+            input_ids[row][offset:offset + length] = [cls_id] + sentence_piece_ids[sentence_index][start:end] + [sep_id]
+            position_ids[row][offset:offset + length] = range(length)
+            window_ids[row][offset:offset + length] = [window] * length
+
+        # position of each word piece in the flattened output, taken from the window in which it has the most context
+        piece_positions = []
+        for sentence_index, best_windows in enumerate(piece_windows):
+            for piece, window in enumerate(best_windows):
+                _, start, _ = windows[window]
+                piece_positions.append(
+                    window_rows[window] * sequence_length + window_offsets[window] + 1 + piece - start)
 
         # put encoded batch through BERT model to get all hidden states of all encoder layers
         self.model.to(flair.device)
         self.model.eval()
-        all_encoder_layers, _ = self.model(all_input_ids, token_type_ids=None, attention_mask=all_input_masks)
 
         with torch.no_grad():
+            all_encoder_layers = self._encode(torch.tensor(input_ids, dtype=torch.long, device=flair.device),
+                                              torch.tensor(position_ids, dtype=torch.long, device=flair.device),
+                                              torch.tensor(window_ids, dtype=torch.long, device=flair.device))
+
+            # concatenate the selected layers and flatten to one row per word piece position
+            subtoken_embeddings = torch.cat([all_encoder_layers[index] for index in self.layer_indexes], dim=2)
+            subtoken_embeddings = subtoken_embeddings.view(-1, subtoken_embeddings.size(2))
+            subtoken_embeddings = subtoken_embeddings.index_select(
+                0, torch.tensor(piece_positions, dtype=torch.long, device=flair.device))
+
+            lengths = torch.tensor(token_lengths, dtype=torch.long, device=flair.device)
+            if self.pooling_operation == 'first':
+                # use first subword embedding if pooling operation is 'first'
+                token_embeddings = subtoken_embeddings.index_select(0, torch.cumsum(lengths, 0) - lengths)
+            else:
+                # otherwise, do a mean over all subwords in token
+                token_indexes = torch.arange(len(token_lengths), device=flair.device).repeat_interleave(lengths)
+                token_embeddings = subtoken_embeddings.new_zeros(len(token_lengths), subtoken_embeddings.size(1))
+                token_embeddings.index_add_(0, token_indexes, subtoken_embeddings)
+                token_embeddings /= lengths.unsqueeze(1).to(token_embeddings.dtype)
 
-            for sentence_index, sentence in enumerate(sentences):
+            token_embeddings = token_embeddings.to(_embedding_device(sentences))
 
-                feature = features[sentence_index]
+        tokens = [token for sentence in sentences for token in sentence]
+        for token, embedding in zip(tokens, token_embeddings):
+            token.set_embedding(self.name, embedding)
 
-                # get aggregated embeddings for each BERT-subtoken in sentence
-                subtoken_embeddings = []
-                for token_index, _ in enumerate(feature.tokens):
-                    all_layers = []
-                    for layer_index in self.layer_indexes:
-                        layer_output = all_encoder_layers[int(layer_index)].detach().cpu()[sentence_index]
-                        all_layers.append(layer_output[token_index])
+        return sentences
 
-                    subtoken_embeddings.append(torch.cat(all_layers))
+    def _split_into_windows(self, length: int) -> Tuple[List[int], List[int]]:
+        """
+        Splits a sentence of the given number of word pieces into overlapping windows that fit into the model.
+        :return: the start of each window and, for each word piece, the window in which it has the most context
+        """
+        window_length = getattr(self, 'max_sequence_length', self.model.config.max_position_embeddings) - 2
+        if length <= window_length:
+            return [0], [0] * length
 
-                # get the current sentence object
-                token_idx = 0
-                for token in sentence:
-                    # add concatenated embedding to sentence
-                    token_idx += 1
+        stride = getattr(self, 'stride', max(1, window_length // 2))
+        starts = list(range(0, length - window_length, stride)) + [length - window_length]
 
-                    if self.pooling_operation == 'first':
-                        # use first subword embedding if pooling operation is 'first'
-                        token.set_embedding(self.name, subtoken_embeddings[token_idx])
-                    else:
-                        # otherwise, do a mean over all subwords in token
-                        embeddings = subtoken_embeddings[token_idx:token_idx + feature.token_subtoken_count[token.idx]]
-                        embeddings = [embedding.unsqueeze(0) for embedding in embeddings]
-                        mean = torch.mean(torch.cat(embeddings, dim=0), dim=0)
-                        token.set_embedding(self.name, mean)
+        best_windows = []
+        for piece in range(length):
+            context = [min(piece - start, start + window_length - 1 - piece) for start in starts]
+            best_windows.append(context.index(max(context)))
 
-                    token_idx += feature.token_subtoken_count[token.idx] - 1
+        return starts, best_windows
 
-        return sentences
+    def _encode(self, input_ids: torch.Tensor, position_ids: torch.Tensor, window_ids: torch.Tensor) \
+            -> List[torch.Tensor]:
+        """
+        Runs the encoder of the BERT model on rows that may hold several windows. Unlike BertModel.forward, positions
+        start at 0 in each window and word pieces only attend to pieces of their own window.
+        :param input_ids: word piece ids of shape (rows, sequence length)
+        :param position_ids: position of each word piece in its window
+        :param window_ids: window of each word piece, -1 for padding
+        :return: hidden states of all encoder layers
+        """
+        embeddings = self.model.embeddings
+        embedding_output = embeddings.word_embeddings(input_ids) + embeddings.position_embeddings(position_ids) \
+            + embeddings.token_type_embeddings(torch.zeros_like(input_ids))
+        embedding_output = embeddings.dropout(embeddings.LayerNorm(embedding_output))
+
+        if getattr(self, 'pack_sentences', False):
+            attention_mask = (window_ids.unsqueeze(2) == window_ids.unsqueeze(1)) & (window_ids >= 0).unsqueeze(1)
+            attention_mask = attention_mask.unsqueeze(1)
+        else:
+            attention_mask = (window_ids >= 0).unsqueeze(1).unsqueeze(2)
+
+        # 0 for positions to attend to and -10000 for masked positions, as in BertModel.forward
+        attention_mask = (1.0 - attention_mask.to(dtype=embedding_output.dtype)) * -10000.0
+
+        return self.model.encoder(embedding_output, attention_mask, output_all_encoded_layers=True)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_wordpiece_cache'] = OrderedDict()
+        return state
 
     @property
     @abstractmethod
@@ -1345,7 +2188,7 @@ class CharLMEmbeddings(TokenEmbeddings):
         self.static_embeddings = detach
 
         from flair.models import LanguageModel
-        self.lm = LanguageModel.load_language_model(model)
+        self.lm = LanguageModel.load_language_model(model, with_decoder=False)
         self.detach = detach
 
         self.is_forward_lm: bool = self.lm.is_forward_lm
@@ -1518,29 +2361,33 @@ class DocumentMeanEmbeddings(DocumentEmbeddings):
 
 class DocumentPoolEmbeddings(DocumentEmbeddings):
 
-    def __init__(self, embeddings: List[TokenEmbeddings], mode: str = 'mean'):
+    def __init__(self, embeddings: List[TokenEmbeddings], mode: str = 'mean', cache_size: int = 10000):
         """The constructor takes a list of embeddings to be combined.
         :param embeddings: a list of token embeddings
-        :param mode: a string which can any value from ['mean', 'max', 'min']
+        :param mode: a string which can any value from ['mean', 'max', 'min', 'sum', 'first', 'last', 'mean_max'].
+        'mean_max' concatenates the mean and the maximum, so it doubles the embedding length
+        :param cache_size: number of pooled embeddings that are kept for texts seen before, if all token embeddings are
+        static. 0 disables the cache
         """
         super().__init__()
 
         self.embeddings: StackedEmbeddings = StackedEmbeddings(embeddings=embeddings)
 
+        self.mode = mode
+        if self.mode not in ['mean', 'max', 'min', 'sum', 'first', 'last', 'mean_max']:
+            raise ValueError(f'Pooling operation for {self.mode!r} is not defined')
+        self.name: str = f'document_{self.mode}'
+
         self.__embedding_length: int = self.embeddings.embedding_length
+        if self.mode == 'mean_max':
+            self.__embedding_length *= 2
 
         self.to(flair.device)
 
-        self.mode = mode
-        if self.mode == 'mean':
-            self.pool_op = torch.mean
-        elif mode == 'max':
-            self.pool_op = torch.max
-        elif mode == 'min':
-            self.pool_op = torch.min
-        else:
-            raise ValueError(f'Pooling operation for {self.mode!r} is not defined')
-        self.name: str = f'document_{self.mode}'
+        # if the token embeddings never change, neither does the pooled embedding of a text
+        self.static_embeddings: bool = all(embedding.static_embeddings for embedding in embeddings)
+        self.cache_size: int = cache_size
+        self._pooled_cache: OrderedDict = OrderedDict()
 
     @property
     def embedding_length(self) -> int:
@@ -1550,33 +2397,98 @@ class DocumentPoolEmbeddings(DocumentEmbeddings):
         """Add embeddings to every sentence in the given list of sentences. If embeddings are already added, updates
         only if embeddings are non-static."""
 
-        everything_embedded: bool = True
-
         # if only one sentence is passed, convert to list of sentence
         if isinstance(sentences, Sentence):
             sentences = [sentences]
 
-        for sentence in sentences:
-            if self.name not in sentence._embeddings.keys(): everything_embedded = False
+        use_cache = getattr(self, 'static_embeddings', False) and getattr(self, 'cache_size', 0) > 0
+        cache: OrderedDict = self.__dict__.setdefault('_pooled_cache', OrderedDict())
 
-        if not everything_embedded:
+        # pooled embeddings are forgotten once a token embedding changes, e.g. after pruning or quantization
+        token_embeddings = [module for module in self.embeddings.modules() if isinstance(module, Embeddings)]
+        versions = tuple((embedding.name, embedding.version) for embedding in token_embeddings)
+        if versions != self.__dict__.get('_pooled_cache_versions'):
+            cache.clear()
+            self._pooled_cache_versions = versions
 
-            self.embeddings.embed(sentences)
+        # embeddings of a tag field embed the values of the tag instead of the text
+        fields = sorted({embedding.__dict__['field'] for embedding in token_embeddings
+                         if embedding.__dict__.get('field') is not None})
 
-            for sentence in sentences:
-                word_embeddings = []
-                for token in sentence.tokens:
-                    token: Token = token
-                    word_embeddings.append(token.get_embedding().unsqueeze(0))
+        def cache_key(sentence: Sentence):
+            return (sentence.to_tokenized_string(),) + \
+                   tuple(tuple(token.get_tag(field).value for token in sentence) for field in fields)
 
-                word_embeddings = torch.cat(word_embeddings, dim=0).to(flair.device)
+        sentences_to_embed: List[Sentence] = []
+        for sentence in sentences:
+            if self.name in sentence._embeddings.keys() or len(sentence) == 0:
+                continue
+
+            if use_cache:
+                key = cache_key(sentence)
+                pooled_embedding = cache.get(key)
+                if pooled_embedding is not None:
+                    cache.move_to_end(key)
+                    sentence.set_embedding(self.name, pooled_embedding)
+                    continue
+
+            sentences_to_embed.append(sentence)
+
+        if not sentences_to_embed:
+            return
+
+        self.embeddings.embed(sentences_to_embed)
+
+        for sentence, pooled_embedding in zip(sentences_to_embed, self._pool(sentences_to_embed)):
+            sentence.set_embedding(self.name, pooled_embedding)
+
+            if use_cache:
+                cache[cache_key(sentence)] = pooled_embedding.detach().cpu()
+                if len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+
+    def _pool(self, sentences: List[Sentence]) -> torch.Tensor:
+        """Pools the token embeddings of all sentences at once, using a padded batch and a mask of the real tokens."""
+        lengths = [len(sentence) for sentence in sentences]
+        longest = max(lengths)
+
+        word_embeddings = torch.stack([token.get_embedding() for sentence in sentences for token in sentence])
+        word_embeddings = word_embeddings.to(flair.device)
+
+        positions = [sentence_index * longest + token_index
+                     for sentence_index, length in enumerate(lengths) for token_index in range(length)]
+        padded = word_embeddings.new_zeros(len(sentences) * longest, word_embeddings.size(1)).index_copy(
+            0, torch.tensor(positions, dtype=torch.long, device=flair.device), word_embeddings)
+        padded = padded.view(len(sentences), longest, -1)
+
+        lengths = torch.tensor(lengths, dtype=torch.long, device=flair.device)
+        mask = (torch.arange(longest, device=flair.device).unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(2)
+
+        if self.mode == 'first':
+            return padded[:, 0]
+        if self.mode == 'last':
+            return padded[torch.arange(len(sentences), device=flair.device), lengths - 1]
+        if self.mode == 'min':
+            return padded.masked_fill(~mask, float('inf')).min(dim=1)[0]
+
+        # padding is zero, so it does not change the sum
+        mean = padded.sum(dim=1)
+        if self.mode == 'sum':
+            return mean
+        mean = mean / lengths.unsqueeze(1).to(mean.dtype)
+        if self.mode == 'mean':
+            return mean
 
-                if self.mode == 'mean':
-                    pooled_embedding = self.pool_op(word_embeddings, 0)
-                else:
-                    pooled_embedding, _ = self.pool_op(word_embeddings, 0)
+        maximum = padded.masked_fill(~mask, float('-inf')).max(dim=1)[0]
+        if self.mode == 'max':
+            return maximum
+
+        return torch.cat([mean, maximum], dim=1)
 
-                sentence.set_embedding(self.name, pooled_embedding)
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_pooled_cache'] = OrderedDict()
+        return state
 
     def _add_embeddings_internal(self, sentences: List[Sentence]):
         pass
@@ -1665,45 +2577,30 @@ class DocumentRNNEmbeddings(DocumentEmbeddings):
 
         self.rnn.zero_grad()
 
-        sentences.sort(key=lambda x: len(x), reverse=True)
-
         self.embeddings.embed(sentences)
 
-        # first, sort sentences by number of tokens
-        longest_token_sequence_in_batch: int = len(sentences[0])
+        # first, sort sentences by number of tokens, without changing the order of the caller's list
+        order: List[int] = sorted(range(len(sentences)), key=lambda index: len(sentences[index]), reverse=True)
+        sorted_sentences: List[Sentence] = [sentences[index] for index in order]
 
-        all_sentence_tensors = []
-        lengths: List[int] = []
-
-        # go through each sentence in batch
-        for i, sentence in enumerate(sentences):
-
-            lengths.append(len(sentence.tokens))
-
-            word_embeddings = []
-
-            for token, token_idx in zip(sentence.tokens, range(len(sentence.tokens))):
-                token: Token = token
-                word_embeddings.append(token.get_embedding().unsqueeze(0))
-
-            # PADDING: pad shorter sentences out
-            for add in range(longest_token_sequence_in_batch - len(sentence.tokens)):
-                word_embeddings.append(
-                    torch.zeros(self.length_of_all_token_embeddings,
-                                dtype=torch.float).unsqueeze(0)
-                )
-
-            word_embeddings_tensor = torch.cat(word_embeddings, 0).to(flair.device)
-
-            sentence_states = word_embeddings_tensor
-
-            # ADD TO SENTENCE LIST: add the representation
-            all_sentence_tensors.append(sentence_states.unsqueeze(1))
+        longest_token_sequence_in_batch: int = len(sorted_sentences[0])
+        lengths: List[int] = [len(sentence.tokens) for sentence in sorted_sentences]
 
         # --------------------------------------------------------------------
         # GET REPRESENTATION FOR ENTIRE BATCH
         # --------------------------------------------------------------------
-        sentence_tensor = torch.cat(all_sentence_tensors, 1)
+        # the padded (tokens, sentences, dim) tensor is filled with all word embeddings in one step
+        word_embeddings = torch.stack([token.get_embedding() for sentence in sorted_sentences
+                                       for token in sentence.tokens]).to(flair.device)
+
+        positions = [token_index * len(sorted_sentences) + sentence_index
+                     for sentence_index, length in enumerate(lengths) for token_index in range(length)]
+
+        sentence_tensor = word_embeddings.new_zeros(longest_token_sequence_in_batch * len(sorted_sentences),
+                                                    self.length_of_all_token_embeddings)
+        sentence_tensor = sentence_tensor.index_copy(0, torch.tensor(positions, dtype=torch.long,
+                                                                     device=flair.device), word_embeddings)
+        sentence_tensor = sentence_tensor.view(longest_token_sequence_in_batch, len(sorted_sentences), -1)
 
         # --------------------------------------------------------------------
         # FF PART
@@ -1730,15 +2627,15 @@ class DocumentRNNEmbeddings(DocumentEmbeddings):
         # --------------------------------------------------------------------
         # EXTRACT EMBEDDINGS FROM RNN
         # --------------------------------------------------------------------
-        for sentence_no, length in enumerate(lengths):
-            last_rep = outputs[length - 1, sentence_no]
+        last_reps = outputs[torch.tensor(lengths, device=outputs.device) - 1,
+                            torch.arange(len(sorted_sentences), device=outputs.device)]
 
-            embedding = last_rep
-            if self.bidirectional:
-                first_rep = outputs[0, sentence_no]
-                embedding = torch.cat([first_rep, last_rep], 0)
+        embeddings = last_reps
+        if self.bidirectional:
+            first_reps = outputs[0]
+            embeddings = torch.cat([first_reps, last_reps], 1)
 
-            sentence = sentences[sentence_no]
+        for sentence, embedding in zip(sorted_sentences, embeddings):
             sentence.set_embedding(self.name, embedding)
 
     def _add_embeddings_internal(self, sentences: List[Sentence]):
@@ -1924,16 +2821,29 @@ class DocumentLMEmbeddings(DocumentEmbeddings):
         if type(sentences) is Sentence:
             sentences = [sentences]
 
+        text_sentences = [sentence.to_tokenized_string() for sentence in sentences]
+
+        # the hidden states are taken straight from the language models, without embedding each token
         for embedding in self.embeddings:
-            embedding.embed(sentences)
 
-            # iterate over sentences
-            for sentence in sentences:
+            # make compatible with serialized models
+            if 'chars_per_chunk' not in embedding.__dict__:
+                embedding.chars_per_chunk = 512
 
-                # if its a forward LM, take last state
-                if embedding.is_forward_lm:
-                    sentence.set_embedding(embedding.name, sentence[len(sentence)]._embeddings[embedding.name])
-                else:
-                    sentence.set_embedding(embedding.name, sentence[1]._embeddings[embedding.name])
+            with torch.no_grad():
+                for bucket in _bucket_by_length([len(text) for text in text_sentences]):
+                    bucket_texts = [text_sentences[i] for i in bucket]
+
+                    all_hidden_states_in_lm = embedding._get_hidden_states(bucket_texts)
+
+                    # the state of the last token of a forward LM and of the first token of a backward LM are both
+                    # taken after the whole text, which follows the start marker
+                    offsets = torch.tensor([len(text) + 1 for text in bucket_texts], dtype=torch.long,
+                                           device=all_hidden_states_in_lm.device)
+                    columns = torch.arange(len(bucket), device=all_hidden_states_in_lm.device)
+                    document_states = all_hidden_states_in_lm[offsets, columns].to(_embedding_device(sentences))
+
+                    for index, state in zip(bucket, document_states):
+                        sentences[index].set_embedding(embedding.name, state)
 
         return sentences
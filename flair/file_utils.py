@@ -2,9 +2,10 @@
 Utilities for working with the local dataset cache. Copied from AllenNLP
 """
 from pathlib import Path
-from typing import Tuple
+from typing import Tuple, Union
 import os
 import base64
+import hashlib
 import logging
 import shutil
 import tempfile
@@ -37,6 +38,23 @@ def load_big_file(f):
     return bf
 
 
+def file_fingerprint(path: Union[str, Path], sample_size: int = 1024 * 1024) -> str:
+    """
+    Computes a cheap fingerprint of a (possibly very large) file from its size and a hash over its first and last bytes.
+    :param path: the file to fingerprint
+    :param sample_size: number of bytes read from the beginning and the end of the file
+    :return: hex digest identifying the file content
+    """
+    size = os.path.getsize(str(path))
+    sha = hashlib.sha1(str(size).encode('utf-8'))
+    with open(str(path), 'rb') as f:
+        sha.update(f.read(sample_size))
+        if size > sample_size:
+            f.seek(max(sample_size, size - sample_size))
+            sha.update(f.read(sample_size))
+    return sha.hexdigest()
+
+
 def url_to_filename(url: str, etag: str = None) -> str:
     """
     Converts a url into a filename in a reversible way.
@@ -5,8 +5,6 @@ from pathlib import Path
 from typing import Tuple, Union
 import numpy as np
 
-from hyperopt import hp, fmin, tpe
-
 import flair.nn
 from flair.data import Corpus
 from flair.embeddings import DocumentPoolEmbeddings, DocumentRNNEmbeddings
@@ -34,6 +32,7 @@ class SearchSpace(object):
         self.search_space[parameter.value] = func(parameter.value, **kwargs)
 
     def get_search_space(self):
+        from hyperopt import hp
         return hp.choice('parameters', [ self.search_space ])
 
 
@@ -143,6 +142,9 @@ class ParamSelector(object):
         }
 
     def optimize(self, space: SearchSpace, max_evals=100):
+        # hyperopt is slow to import, so it is only imported when needed
+        from hyperopt import fmin, tpe
+
         search_space = space.search_space
         best = fmin(self._objective, search_space, algo=tpe.suggest, max_evals=max_evals)
 
@@ -1,3 +1,4 @@
 from .sequence_tagger_model import SequenceTagger
 from .language_model import LanguageModel
 from .text_classification_model import TextClassifier
+from .torchscript import ScriptedSequenceTagger, ScriptedTextClassifier
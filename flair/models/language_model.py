@@ -10,6 +10,7 @@ from torch.optim import Optimizer
 
 import flair
 from flair.data import Dictionary
+from flair.nn import QuantizedEmbedding
 
 
 class LanguageModel(nn.Module):
@@ -22,7 +23,12 @@ class LanguageModel(nn.Module):
                  nlayers: int,
                  embedding_size: int = 100,
                  nout=None,
-                 dropout=0.1):
+                 dropout=0.1,
+                 has_decoder: bool = True):
+        """
+        :param has_decoder: if False, the model has no decoder and can only compute representations, as needed for
+        embeddings
+        """
 
         super(LanguageModel, self).__init__()
 
@@ -48,10 +54,12 @@ class LanguageModel(nn.Module):
         if nout is not None:
             self.proj = nn.Linear(hidden_size, nout)
             self.initialize(self.proj.weight)
-            self.decoder = nn.Linear(nout, len(dictionary))
+            decoder_input_size = nout
         else:
             self.proj = None
-            self.decoder = nn.Linear(hidden_size, len(dictionary))
+            decoder_input_size = hidden_size
+
+        self.decoder = nn.Linear(decoder_input_size, len(dictionary)) if has_decoder else None
 
         self.init_weights()
 
@@ -61,13 +69,19 @@ class LanguageModel(nn.Module):
     def init_weights(self):
         initrange = 0.1
         self.encoder.weight.detach().uniform_(-initrange, initrange)
-        self.decoder.bias.detach().fill_(0)
-        self.decoder.weight.detach().uniform_(-initrange, initrange)
+        if self.decoder is not None:
+            self.decoder.bias.detach().fill_(0)
+            self.decoder.weight.detach().uniform_(-initrange, initrange)
+
+    @property
+    def has_decoder(self) -> bool:
+        return self.decoder is not None
 
     def set_hidden(self, hidden):
         self.hidden = hidden
 
-    def forward(self, input, hidden, ordered_sequence_lengths=None):
+    def encode(self, input, hidden):
+        """Runs only the encoder and the recurrent module. Returns the RNN output and the new hidden state."""
         encoded = self.encoder(input)
         emb = self.drop(encoded)
 
@@ -80,6 +94,14 @@ class LanguageModel(nn.Module):
 
         output = self.drop(output)
 
+        return output, hidden
+
+    def forward(self, input, hidden, ordered_sequence_lengths=None):
+        if self.decoder is None:
+            raise ValueError('This language model has no decoder and can only compute representations.')
+
+        output, hidden = self.encode(input, hidden)
+
         decoded = self.decoder(output.view(output.size(0) * output.size(1), output.size(2)))
 
         return decoded.view(output.size(0), output.size(1), decoded.size(1)), output, hidden
@@ -115,7 +137,8 @@ class LanguageModel(nn.Module):
             batch = torch.LongTensor(sequences_as_char_indices).transpose(0, 1)
             batch = batch.to(flair.device)
 
-            prediction, rnn_output, hidden = self.forward(batch, hidden)
+            # the decoder is not needed for representations
+            rnn_output, hidden = self.encode(batch, hidden)
             rnn_output = rnn_output.detach()
 
             output_parts.append(rnn_output)
@@ -141,24 +164,46 @@ class LanguageModel(nn.Module):
         else:
             return tuple(self.repackage_hidden(v) for v in h)
 
+    def quantize(self, dtype: str = 'int8'):
+        """
+        Stores the character table in a smaller type and converts looked up rows back to float32. The table can no
+        longer be trained afterwards. Saved models keep the storage type.
+        :param dtype: storage type of the table, one of 'float32', 'float16' or 'int8'
+        """
+        weight = self.encoder(torch.arange(len(self.dictionary), device=self.encoder.weight.device)).detach()
+        if dtype == 'float32':
+            self.encoder = nn.Embedding.from_pretrained(weight, freeze=False)
+        else:
+            self.encoder = QuantizedEmbedding(weight, dtype)
+        self.embedding_dtype: str = dtype
+
     def initialize(self, matrix):
         in_, out_ = matrix.size()
         stdv = math.sqrt(3. / (in_ + out_))
         matrix.detach().uniform_(-stdv, stdv)
 
     @classmethod
-    def load_language_model(cls, model_file: Union[Path, str]):
+    def load_language_model(cls, model_file: Union[Path, str], with_decoder: bool = True):
+        """
+        Loads a language model.
+        :param model_file: the model file
+        :param with_decoder: if False, the decoder is not loaded, which suffices for computing representations
+        """
 
         state = torch.load(str(model_file), map_location=flair.device)
 
+        has_decoder = state.get('has_decoder', True) and with_decoder
+
         model = LanguageModel(state['dictionary'],
                               state['is_forward_lm'],
                               state['hidden_size'],
                               state['nlayers'],
                               state['embedding_size'],
                               state['nout'],
-                              state['dropout'])
-        model.load_state_dict(state['state_dict'])
+                              state['dropout'],
+                              has_decoder=has_decoder)
+        model._prepare_embedding_dtype(state)
+        model.load_state_dict(cls._filter_state_dict(state['state_dict'], has_decoder))
         model.eval()
         model.to(flair.device)
 
@@ -179,7 +224,9 @@ class LanguageModel(nn.Module):
                               state['nlayers'],
                               state['embedding_size'],
                               state['nout'],
-                              state['dropout'])
+                              state['dropout'],
+                              has_decoder=state.get('has_decoder', True))
+        model._prepare_embedding_dtype(state)
         model.load_state_dict(state['state_dict'])
         model.eval()
         model.to(flair.device)
@@ -187,6 +234,11 @@ class LanguageModel(nn.Module):
         return {'model': model, 'epoch': epoch, 'split': split, 'loss': loss,
                 'optimizer_state_dict': optimizer_state_dict}
 
+    def _prepare_embedding_dtype(self, state: dict):
+        # a quantized character table is loaded into a table of the same type
+        if state.get('embedding_dtype', 'float32') != 'float32':
+            self.quantize(state['embedding_dtype'])
+
     def save_checkpoint(self, file: Path, optimizer: Optimizer, epoch: int, split: int, loss: float):
         model_state = {
             'state_dict': self.state_dict(),
@@ -197,6 +249,8 @@ class LanguageModel(nn.Module):
             'embedding_size': self.embedding_size,
             'nout': self.nout,
             'dropout': self.dropout,
+            'has_decoder': self.has_decoder,
+            'embedding_dtype': getattr(self, 'embedding_dtype', 'float32'),
             'optimizer_state_dict': optimizer.state_dict(),
             'epoch': epoch,
             'split': split,
@@ -205,20 +259,36 @@ class LanguageModel(nn.Module):
 
         torch.save(model_state, str(file), pickle_protocol=4)
 
-    def save(self, file: Path):
+    def save(self, file: Path, with_decoder: bool = True):
+        """
+        Saves the language model.
+        :param file: the model file
+        :param with_decoder: if False, the decoder weights are left out. Such a model is smaller and faster to load,
+        and can still be used for embeddings, but not for generating text or computing perplexity
+        """
+        has_decoder = with_decoder and self.has_decoder
+
         model_state = {
-            'state_dict': self.state_dict(),
+            'state_dict': self._filter_state_dict(self.state_dict(), has_decoder),
             'dictionary': self.dictionary,
             'is_forward_lm': self.is_forward_lm,
             'hidden_size': self.hidden_size,
             'nlayers': self.nlayers,
             'embedding_size': self.embedding_size,
             'nout': self.nout,
-            'dropout': self.dropout
+            'dropout': self.dropout,
+            'has_decoder': has_decoder,
+            'embedding_dtype': getattr(self, 'embedding_dtype', 'float32')
         }
 
         torch.save(model_state, str(file), pickle_protocol=4)
 
+    @staticmethod
+    def _filter_state_dict(state_dict: dict, has_decoder: bool) -> dict:
+        if has_decoder:
+            return state_dict
+        return {key: value for key, value in state_dict.items() if not key.startswith('decoder.')}
+
     def generate_text(self, prefix: str = '\n', number_of_characters: int = 1000, temperature: float = 1.0,
                       break_on_suffix=None) -> Tuple[str, float]:
 
@@ -309,6 +309,14 @@ class SequenceTagger(flair.nn.Model):
 
             return sentences
 
+    def to_torchscript(self):
+        """
+        Compiles the network after the embeddings, including Viterbi decoding, to TorchScript for inference.
+        :return: a ScriptedSequenceTagger that predicts like this tagger and can be saved as one file
+        """
+        from flair.models.torchscript import ScriptedSequenceTagger
+        return ScriptedSequenceTagger.from_tagger(self)
+
     def forward(self, sentences: List[Sentence], sort=True):
         self.zero_grad()
 
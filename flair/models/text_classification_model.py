@@ -174,6 +174,15 @@ class TextClassifier(flair.nn.Model):
 
             return sentences
 
+    def to_torchscript(self):
+        """
+        Compiles the document RNN and the decoder to TorchScript for inference. Only classifiers with
+        DocumentRNNEmbeddings can be compiled.
+        :return: a ScriptedTextClassifier that predicts like this classifier and can be saved as one file
+        """
+        from flair.models.torchscript import ScriptedTextClassifier
+        return ScriptedTextClassifier.from_classifier(self)
+
     @staticmethod
     def _filter_empty_sentences(sentences: List[Sentence]) -> List[Sentence]:
         filtered_sentences = [sentence for sentence in sentences if sentence.tokens]
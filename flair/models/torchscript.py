@@ -0,0 +1,317 @@
+import io
+import logging
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+
+import flair
+import flair.embeddings
+from flair.data import Dictionary, Sentence, Label
+from flair.training_utils import clear_embeddings
+
+from .sequence_tagger_model import SequenceTagger, START_TAG, STOP_TAG
+from .text_classification_model import TextClassifier
+
+
+log = logging.getLogger('flair')
+
+# name under which the embeddings and dictionaries are stored next to the TorchScript module
+EXTRA_FILE: str = 'flair.pt'
+
+
+class SequenceTaggerHead(torch.nn.Module):
+    """
+    The part of a SequenceTagger that runs after the embeddings, in inference mode: the reprojection of the
+    embeddings, the BiLSTM, the linear layer and Viterbi decoding (or the argmax over tags without CRF). It takes a
+    zero-padded (sentences, tokens, embedding length) tensor and the number of tokens of each sentence, sorted by
+    decreasing length, and returns the predicted tag ids and their confidences as (sentences, tokens) tensors.
+    """
+
+    def __init__(self, tagger: SequenceTagger):
+        super(SequenceTaggerHead, self).__init__()
+
+        self.use_rnn: bool = tagger.use_rnn
+        self.use_crf: bool = tagger.use_crf
+        self.relearn_embeddings: bool = tagger.relearn_embeddings
+        self.start: int = tagger.tag_dictionary.get_idx_for_item(START_TAG)
+        self.stop: int = tagger.tag_dictionary.get_idx_for_item(STOP_TAG)
+
+        self.embedding2nn = tagger.embedding2nn if tagger.relearn_embeddings else torch.nn.Identity()
+        self.rnn = tagger.rnn
+        self.linear = tagger.linear
+
+        transitions = tagger.transitions.detach() if tagger.use_crf else torch.zeros(0, 0)
+        self.register_buffer('transitions', transitions.clone())
+
+    def forward(self, embeddings: torch.Tensor, lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        # (tokens, sentences, embedding length) like SequenceTagger.forward
+        sentence_tensor = embeddings.transpose(0, 1)
+
+        if self.relearn_embeddings:
+            sentence_tensor = self.embedding2nn(sentence_tensor)
+
+        if self.use_rnn:
+            packed = torch.nn.utils.rnn.pack_padded_sequence(sentence_tensor, lengths.cpu())
+            rnn_output, _ = self.rnn(packed)
+            sentence_tensor, _ = torch.nn.utils.rnn.pad_packed_sequence(rnn_output,
+                                                                        total_length=embeddings.shape[1])
+
+        features = self.linear(sentence_tensor).transpose(0, 1)
+
+        if self.use_crf:
+            return self._viterbi_decode(features, lengths)
+
+        confidences, tags = F.softmax(features, dim=2).max(dim=2)
+        return tags, confidences
+
+    def _viterbi_decode(self, features: torch.Tensor, lengths: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Decodes all sentences of the batch at once. Sentences that are shorter than the longest one keep their
+        Viterbi variables from their last token on."""
+        batch_size, sequence_length, tagset_size = features.shape
+        lengths = lengths.to(features.device)
+
+        forward_var = torch.full([batch_size, tagset_size], -10000., device=features.device)
+        forward_var[:, self.start] = 0.
+
+        backpointers: List[torch.Tensor] = []
+        confidences: List[torch.Tensor] = []
+        for i in range(sequence_length):
+            next_tag_var = forward_var.unsqueeze(1) + self.transitions.unsqueeze(0)
+            viterbivars, bptrs = next_tag_var.max(dim=2)
+            active = (lengths > i).unsqueeze(1)
+            forward_var = torch.where(active, viterbivars + features[:, i], forward_var)
+            backpointers.append(bptrs)
+            # the confidence of a token is the highest softmax score of its Viterbi variables, as in predict()
+            confidences.append(F.softmax(forward_var, dim=1).max(dim=1)[0])
+
+        terminal_var = forward_var + self.transitions[self.stop].unsqueeze(0)
+        terminal_var[:, self.stop] = -10000.
+        terminal_var[:, self.start] = -10000.
+        best_tag = terminal_var.argmax(dim=1)
+
+        tags = torch.zeros([batch_size, sequence_length], dtype=torch.long, device=features.device)
+        for i in range(sequence_length - 1, -1, -1):
+            active = lengths > i
+            tags[:, i] = torch.where(active, best_tag, torch.zeros_like(best_tag))
+            previous = backpointers[i].gather(1, best_tag.unsqueeze(1)).squeeze(1)
+            best_tag = torch.where(active, previous, best_tag)
+
+        return tags, torch.stack(confidences, dim=1)
+
+
+class TextClassifierHead(torch.nn.Module):
+    """
+    The part of a TextClassifier with DocumentRNNEmbeddings that runs after the token embeddings, in inference mode:
+    the reprojection of the token embeddings, the RNN and the decoder. It takes a zero-padded (sentences, tokens,
+    embedding length) tensor of token embeddings and the number of tokens of each sentence, sorted by decreasing
+    length, and returns the (sentences, labels) scores of the decoder.
+    """
+
+    def __init__(self, classifier: TextClassifier):
+        super(TextClassifierHead, self).__init__()
+
+        document_embeddings = classifier.document_embeddings
+        if not isinstance(document_embeddings, flair.embeddings.DocumentRNNEmbeddings):
+            raise ValueError(f'Only text classifiers with DocumentRNNEmbeddings can be exported to TorchScript, not '
+                             f'with {type(document_embeddings).__name__}.')
+
+        self.reproject_words: bool = document_embeddings.reproject_words
+        self.bidirectional: bool = document_embeddings.bidirectional
+
+        self.word_reprojection_map = document_embeddings.word_reprojection_map
+        self.rnn = self._script_rnn(document_embeddings.rnn)
+        self.decoder = classifier.decoder
+
+    @staticmethod
+    def _script_rnn(rnn: torch.nn.RNNBase) -> torch.nn.RNNBase:
+        """DocumentRNNEmbeddings use a plain RNNBase, which cannot be scripted. It is replaced by the RNN class of its
+        mode with the same weights."""
+        if rnn.mode in ['RNN_TANH', 'RNN_RELU']:
+            scriptable = torch.nn.RNN(rnn.input_size, rnn.hidden_size, num_layers=rnn.num_layers,
+                                      nonlinearity=rnn.mode[4:].lower(), bias=rnn.bias,
+                                      bidirectional=rnn.bidirectional)
+        else:
+            scriptable = getattr(torch.nn, rnn.mode)(rnn.input_size, rnn.hidden_size, num_layers=rnn.num_layers,
+                                                     bias=rnn.bias, bidirectional=rnn.bidirectional)
+        scriptable.load_state_dict(rnn.state_dict())
+        return scriptable.to(next(rnn.parameters()).device)
+
+    def forward(self, embeddings: torch.Tensor, lengths: torch.Tensor) -> torch.Tensor:
+        # (tokens, sentences, embedding length) like DocumentRNNEmbeddings.embed
+        sentence_tensor = embeddings.transpose(0, 1)
+
+        if self.reproject_words:
+            sentence_tensor = self.word_reprojection_map(sentence_tensor)
+
+        packed = torch.nn.utils.rnn.pack_padded_sequence(sentence_tensor, lengths.cpu())
+        rnn_out, _ = self.rnn(packed)
+        outputs, _ = torch.nn.utils.rnn.pad_packed_sequence(rnn_out)
+
+        last_reps = outputs[lengths.to(outputs.device) - 1, torch.arange(outputs.shape[1], device=outputs.device)]
+
+        document_embeddings = last_reps
+        if self.bidirectional:
+            document_embeddings = torch.cat([outputs[0], last_reps], 1)
+
+        return self.decoder(document_embeddings)
+
+
+def pad_token_embeddings(sentences: List[Sentence]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Stacks the token embeddings of already embedded sentences into the input of the exported heads.
+    :param sentences: embedded sentences, sorted by decreasing number of tokens
+    :return: the zero-padded (sentences, tokens, embedding length) tensor and the number of tokens of each sentence
+    """
+    lengths = torch.tensor([len(sentence) for sentence in sentences], dtype=torch.long)
+    embeddings = torch.nn.utils.rnn.pad_sequence(
+        [torch.stack([token.get_embedding() for token in sentence]) for sentence in sentences], batch_first=True)
+    return embeddings.to(flair.device), lengths
+
+
+def _script(head: torch.nn.Module) -> torch.jit.ScriptModule:
+    head.eval()
+    return torch.jit.script(head)
+
+
+def _save(model_file: Union[str, Path], module: torch.jit.ScriptModule, state: dict):
+    buffer = io.BytesIO()
+    torch.save(state, buffer, pickle_protocol=4)
+    torch.jit.save(module, str(model_file), _extra_files={EXTRA_FILE: buffer.getvalue()})
+
+
+def _load(model_file: Union[str, Path]) -> Tuple[torch.jit.ScriptModule, dict]:
+    extra_files = {EXTRA_FILE: ''}
+    module = torch.jit.load(str(model_file), map_location=flair.device, _extra_files=extra_files)
+    state = torch.load(io.BytesIO(extra_files[EXTRA_FILE]), map_location=flair.device)
+    return module, state
+
+
+class ScriptedSequenceTagger:
+    """
+    Predicts tags like SequenceTagger.predict, with the network after the embeddings compiled to TorchScript. The
+    embeddings still run as flair embeddings.
+    """
+
+    def __init__(self,
+                 module: torch.jit.ScriptModule,
+                 embeddings: flair.embeddings.TokenEmbeddings,
+                 tag_dictionary: Dictionary,
+                 tag_type: str):
+        self.module = module
+        self.embeddings = embeddings
+        self.tag_dictionary = tag_dictionary
+        self.tag_type = tag_type
+
+    @classmethod
+    def from_tagger(cls, tagger: SequenceTagger):
+        return cls(_script(SequenceTaggerHead(tagger)), tagger.embeddings, tagger.tag_dictionary, tagger.tag_type)
+
+    def predict(self, sentences: Union[List[Sentence], Sentence], mini_batch_size=32) -> List[Sentence]:
+        with torch.no_grad():
+            if isinstance(sentences, Sentence):
+                sentences = [sentences]
+
+            filtered_sentences = SequenceTagger._filter_empty_sentences(sentences)
+            clear_embeddings(filtered_sentences, also_clear_word_embeddings=True)
+            filtered_sentences.sort(key=lambda x: len(x), reverse=True)
+
+            for i in range(0, len(filtered_sentences), mini_batch_size):
+                batch = filtered_sentences[i:i + mini_batch_size]
+                self.embeddings.embed(batch)
+
+                tags, confidences = self.module(*pad_token_embeddings(batch))
+
+                for sentence, sentence_tags, sentence_confidences in zip(batch, tags.tolist(), confidences.tolist()):
+                    for token, tag, confidence in zip(sentence.tokens, sentence_tags, sentence_confidences):
+                        token.add_tag_label(self.tag_type,
+                                            Label(self.tag_dictionary.get_item_for_index(tag), confidence))
+
+                clear_embeddings(batch, also_clear_word_embeddings=True)
+
+            return sentences
+
+    def save(self, model_file: Union[str, Path]):
+        """
+        Saves the TorchScript module, with the embeddings and the tag dictionary, to the provided file.
+        :param model_file: the model file
+        """
+        _save(model_file, self.module, {
+            'embeddings': self.embeddings,
+            'tag_dictionary': self.tag_dictionary,
+            'tag_type': self.tag_type,
+        })
+
+    @classmethod
+    def load(cls, model_file: Union[str, Path]):
+        module, state = _load(model_file)
+        return cls(module, state['embeddings'], state['tag_dictionary'], state['tag_type'])
+
+
+class ScriptedTextClassifier:
+    """
+    Predicts labels like TextClassifier.predict, with the document RNN and the decoder compiled to TorchScript. The
+    token embeddings still run as flair embeddings.
+    """
+
+    def __init__(self,
+                 module: torch.jit.ScriptModule,
+                 embeddings: flair.embeddings.TokenEmbeddings,
+                 label_dictionary: Dictionary,
+                 multi_label: bool):
+        self.module = module
+        self.embeddings = embeddings
+        self.label_dictionary = label_dictionary
+        self.multi_label = multi_label
+
+    @classmethod
+    def from_classifier(cls, classifier: TextClassifier):
+        return cls(_script(TextClassifierHead(classifier)), classifier.document_embeddings.embeddings,
+                   classifier.label_dictionary, classifier.multi_label)
+
+    def predict(self, sentences: Union[List[Sentence], Sentence], mini_batch_size: int = 32) -> List[Sentence]:
+        with torch.no_grad():
+            if isinstance(sentences, Sentence):
+                sentences = [sentences]
+
+            filtered_sentences = TextClassifier._filter_empty_sentences(sentences)
+
+            for i in range(0, len(filtered_sentences), mini_batch_size):
+                batch = filtered_sentences[i:i + mini_batch_size]
+                self.embeddings.embed(batch)
+
+                # the RNN needs the sentences sorted by length, the caller's order is kept
+                sorted_batch = sorted(batch, key=lambda x: len(x), reverse=True)
+                scores = self.module(*pad_token_embeddings(sorted_batch))
+
+                for sentence, sentence_scores in zip(sorted_batch, scores):
+                    sentence.labels = self._obtain_labels(sentence_scores)
+
+                clear_embeddings(batch)
+
+            return sentences
+
+    def _obtain_labels(self, scores: torch.Tensor) -> List[Label]:
+        if self.multi_label:
+            return [Label(self.label_dictionary.get_item_for_index(idx), confidence)
+                    for idx, confidence in enumerate(torch.sigmoid(scores).tolist()) if confidence > 0.5]
+
+        confidence, idx = torch.max(scores, 0)
+        return [Label(self.label_dictionary.get_item_for_index(idx.item()), confidence.item())]
+
+    def save(self, model_file: Union[str, Path]):
+        """
+        Saves the TorchScript module, with the token embeddings and the label dictionary, to the provided file.
+        :param model_file: the model file
+        """
+        _save(model_file, self.module, {
+            'embeddings': self.embeddings,
+            'label_dictionary': self.label_dictionary,
+            'multi_label': self.multi_label,
+        })
+
+    @classmethod
+    def load(cls, model_file: Union[str, Path]):
+        module, state = _load(model_file)
+        return cls(module, state['embeddings'], state['label_dictionary'], state['multi_label'])
@@ -2,7 +2,7 @@ import torch.nn
 
 from abc import abstractmethod
 
-from typing import Union, List
+from typing import Union, List, Tuple, Optional
 
 from flair.data import Sentence, Label
 
@@ -61,3 +61,69 @@ class WordDropout(torch.nn.Module):
         mask = torch.autograd.Variable(m, requires_grad=False)
         mask = mask.expand_as(x)
         return mask * x
+
+
+QUANTIZATION_TYPES = ['float32', 'float16', 'int8']
+
+
+def quantize_rows(weights: torch.Tensor, dtype: str) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Converts a table to a smaller storage type. For int8, each row is scaled by its largest absolute value, so that
+    rows of very different norms keep their relative precision.
+    :param weights: float matrix with one row per entry
+    :param dtype: 'float32', 'float16' or 'int8'
+    :return: the converted rows and, for int8, the scale of each row
+    """
+    if dtype not in QUANTIZATION_TYPES:
+        raise ValueError(f'Storage type "{dtype}" is not supported, use one of {QUANTIZATION_TYPES}.')
+
+    weights = weights.detach().float()
+    if dtype == 'float32':
+        return weights, None
+    if dtype == 'float16':
+        return weights.half(), None
+
+    scales = weights.abs().max(dim=1)[0] / 127.
+    scales[scales == 0] = 1.
+    rows = torch.round(weights / scales.unsqueeze(1)).to(torch.int8)
+    return rows, scales
+
+
+def dequantize_rows(rows: torch.Tensor, scales: Optional[torch.Tensor], indices: torch.Tensor = None) -> torch.Tensor:
+    """
+    Looks up rows of a table converted with quantize_rows and returns them as float32.
+    :param rows: converted rows
+    :param scales: scale of each row for int8 tables, else None
+    :param indices: rows to look up, of any shape. If None, the whole table is returned
+    :return: float tensor of shape indices.shape + (row length,)
+    """
+    if indices is None:
+        indices = torch.arange(rows.size(0), device=rows.device)
+
+    flat_indices = indices.reshape(-1)
+    looked_up = rows.index_select(0, flat_indices).float()
+    if scales is not None:
+        looked_up *= scales.index_select(0, flat_indices).unsqueeze(1)
+
+    return looked_up.view(*indices.shape, rows.size(1))
+
+
+class QuantizedEmbedding(torch.nn.Module):
+    """
+    Static lookup table stored in float16 or int8 with one scale per row, used in place of torch.nn.Embedding.
+    Rows are converted back to float32 when they are looked up.
+    """
+    def __init__(self, weight: torch.Tensor, dtype: str = 'int8'):
+        super(QuantizedEmbedding, self).__init__()
+        self.num_embeddings, self.embedding_dim = weight.shape
+        self.storage_type: str = dtype
+
+        rows, scales = quantize_rows(weight, dtype)
+        self.register_buffer('weight', rows)
+        self.register_buffer('scale', scales)
+
+    def forward(self, input):
+        return dequantize_rows(self.weight, self.scale, input)
+
+    def extra_repr(self):
+        return f'{self.num_embeddings}, {self.embedding_dim}, storage_type={self.storage_type}'
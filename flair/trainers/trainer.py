@@ -10,8 +10,8 @@ import flair
 import flair.nn
 from flair.data import Sentence, Token, MultiCorpus, Corpus
 from flair.models import TextClassifier, SequenceTagger
-from flair.training_utils import Metric, init_output_file, WeightExtractor, clear_embeddings, EvaluationMetric, \
-    log_line, add_file_handler
+from flair.training_utils import Metric, init_output_file, WeightExtractor, EvaluationMetric, \
+    log_line, add_file_handler, EmbeddingStorage
 from flair.optim import *
 
 
@@ -61,6 +61,8 @@ class ModelTrainer:
               train_with_dev: bool = False,
               monitor_train: bool = False,
               embeddings_in_memory: bool = True,
+              embeddings_storage_mode: str = None,
+              embeddings_storage_budget: int = 0,
               checkpoint: bool = False,
               save_final_model: bool = True,
               anneal_with_restarts: bool = False,
@@ -68,6 +70,15 @@ class ModelTrainer:
               param_selection_mode: bool = False,
               **kwargs
               ) -> dict:
+        """
+        Trains the model.
+        :param embeddings_in_memory: keep static embeddings in memory. Ignored if embeddings_storage_mode is given
+        :param embeddings_storage_mode: how static embeddings are kept between epochs, one of 'none', 'memory',
+        'fp16', 'disk' and 'device'. In 'disk' mode, embeddings are stored in base_path / 'embeddings'. In 'device'
+        mode, no embeddings are kept, but those of each mini-batch stay on the device of the model
+        :param embeddings_storage_budget: RAM budget in bytes for stored embeddings in 'memory' and 'fp16' mode.
+        Least recently used sentences lose their embeddings if it is exceeded. 0 means unbounded
+        """
 
         if eval_mini_batch_size is None:
             eval_mini_batch_size = mini_batch_size
@@ -81,192 +92,206 @@ class ModelTrainer:
         log_line(log)
         log.info(f'Evaluation method: {evaluation_metric.name}')
 
-        if not param_selection_mode:
-            loss_txt = init_output_file(base_path, 'loss.tsv')
-            with open(loss_txt, 'a') as f:
-                f.write(
-                    f'EPOCH\tTIMESTAMP\tBAD_EPOCHS\tLEARNING_RATE\tTRAIN_LOSS\t{Metric.tsv_header("TRAIN")}\tDEV_LOSS\t{Metric.tsv_header("DEV")}'
-                    f'\tTEST_LOSS\t{Metric.tsv_header("TEST")}\n')
-
-            weight_extractor = WeightExtractor(base_path)
-
-        optimizer = self.optimizer(self.model.parameters(), lr=learning_rate, **kwargs)
-        if self.optimizer_state is not None:
-            optimizer.load_state_dict(self.optimizer_state)
-
-        # annealing scheduler
-        anneal_mode = 'min' if anneal_against_train_loss else 'max'
-        if isinstance(optimizer, (AdamW, SGDW)):
-            scheduler = ReduceLRWDOnPlateau(optimizer, factor=anneal_factor,
-                                            patience=patience, mode=anneal_mode,
-                                            verbose=True)
-        else:
-            scheduler = ReduceLROnPlateau(optimizer, factor=anneal_factor,
-                                          patience=patience, mode=anneal_mode,
-                                          verbose=True)
-        if self.scheduler_state is not None:
-            scheduler.load_state_dict(self.scheduler_state)
+        if embeddings_storage_mode is None:
+            embeddings_storage_mode = 'memory' if embeddings_in_memory else 'none'
+        embeddings_storage = EmbeddingStorage(self.model, embeddings_storage_mode, directory=base_path / 'embeddings',
+                                              max_memory=embeddings_storage_budget)
 
-        train_data = self.corpus.train
+        # the storage is closed in any case, so that no disk cache stays open and attached to the corpus
+        try:
+            if not param_selection_mode:
+                loss_txt = init_output_file(base_path, 'loss.tsv')
+                with open(loss_txt, 'a') as f:
+                    f.write(
+                        f'EPOCH\tTIMESTAMP\tBAD_EPOCHS\tLEARNING_RATE\tTRAIN_LOSS\t{Metric.tsv_header("TRAIN")}\tDEV_LOSS\t{Metric.tsv_header("DEV")}'
+                        f'\tTEST_LOSS\t{Metric.tsv_header("TEST")}\n')
+
+                weight_extractor = WeightExtractor(base_path)
+
+            optimizer = self.optimizer(self.model.parameters(), lr=learning_rate, **kwargs)
+            if self.optimizer_state is not None:
+                optimizer.load_state_dict(self.optimizer_state)
+
+            # annealing scheduler
+            anneal_mode = 'min' if anneal_against_train_loss else 'max'
+            if isinstance(optimizer, (AdamW, SGDW)):
+                scheduler = ReduceLRWDOnPlateau(optimizer, factor=anneal_factor,
+                                                patience=patience, mode=anneal_mode,
+                                                verbose=True)
+            else:
+                scheduler = ReduceLROnPlateau(optimizer, factor=anneal_factor,
+                                              patience=patience, mode=anneal_mode,
+                                              verbose=True)
+            if self.scheduler_state is not None:
+                scheduler.load_state_dict(self.scheduler_state)
 
-        # if training also uses dev data, include in training set
-        if train_with_dev:
-            train_data = lambda: itertools.chain(self.corpus.train(), self.corpus.dev())
+            train_data = self.corpus.train
 
-        dev_score_history = []
-        dev_loss_history = []
-        train_loss_history = []
+            # if training also uses dev data, include in training set
+            if train_with_dev:
+                train_data = lambda: itertools.chain(self.corpus.train(), self.corpus.dev())
 
-        # At any point you can hit Ctrl + C to break out of training early.
-        try:
-            previous_learning_rate = learning_rate
-            batches_count = 0
-            train_data_count = 0
-            for epoch in range(0 + self.epoch, max_epochs + self.epoch):
-                log_line(log)
+            dev_score_history = []
+            dev_loss_history = []
+            train_loss_history = []
+
+            # At any point you can hit Ctrl + C to break out of training early.
+            try:
+                previous_learning_rate = learning_rate
+                batches_count = 0
+                train_data_count = 0
+                for epoch in range(0 + self.epoch, max_epochs + self.epoch):
+                    log_line(log)
 
-                try:
-                    bad_epochs = scheduler.num_bad_epochs
-                except:
-                    bad_epochs = 0
-                for group in optimizer.param_groups:
-                    learning_rate = group['lr']
+                    try:
+                        bad_epochs = scheduler.num_bad_epochs
+                    except:
+                        bad_epochs = 0
+                    for group in optimizer.param_groups:
+                        learning_rate = group['lr']
 
-                # reload last best model if annealing with restarts is enabled
-                if learning_rate != previous_learning_rate and anneal_with_restarts and \
-                        (base_path / 'best-model.pt').exists():
-                    log.info('resetting to best model')
-                    self.model.load_from_file(base_path / 'best-model.pt')
+                    # reload last best model if annealing with restarts is enabled
+                    if learning_rate != previous_learning_rate and anneal_with_restarts and \
+                            (base_path / 'best-model.pt').exists():
+                        log.info('resetting to best model')
+                        self.model.load_from_file(base_path / 'best-model.pt')
 
-                previous_learning_rate = learning_rate
+                    previous_learning_rate = learning_rate
 
-                # stop training if learning rate becomes too small
-                if learning_rate < 0.0001:
-                    log_line(log)
-                    log.info('learning rate too small - quitting training!')
-                    log_line(log)
-                    break
+                    # stop training if learning rate becomes too small
+                    if learning_rate < 0.0001:
+                        log_line(log)
+                        log.info('learning rate too small - quitting training!')
+                        log_line(log)
+                        break
 
-                #if not test_mode:
-                #    random.shuffle(train_data)
+                    #if not test_mode:
+                    #    random.shuffle(train_data)
 
-                #batches = [train_data[x:x + mini_batch_size] for x in range(0, len(train_data), mini_batch_size)]
-                batches = iter_batch(train_data(), mini_batch_size)
+                    #batches = [train_data[x:x + mini_batch_size] for x in range(0, len(train_data), mini_batch_size)]
+                    batches = iter_batch(train_data(), mini_batch_size)
 
-                self.model.train()
+                    self.model.train()
 
-                train_loss: float = 0
-                seen_sentences = 0
-                modulo = max(1, int(batches_count / 10))
+                    train_loss: float = 0
+                    seen_sentences = 0
+                    modulo = max(1, int(batches_count / 10))
 
-                for batch_no, batch in enumerate(batches):
-                    if epoch == self.epoch: 
-                        train_data_count += len(batch)
-                        batches_count += 1
-                    loss = self.model.forward_loss(batch)
+                    for batch_no, batch in enumerate(batches):
+                        if epoch == self.epoch: 
+                            train_data_count += len(batch)
+                            batches_count += 1
+                        embeddings_storage.prepare(batch)
+                        loss = self.model.forward_loss(batch)
 
-                    optimizer.zero_grad()
-                    loss.backward()
-                    torch.nn.utils.clip_grad_norm_(self.model.parameters(), 5.0)
-                    optimizer.step()
+                        optimizer.zero_grad()
+                        loss.backward()
+                        torch.nn.utils.clip_grad_norm_(self.model.parameters(), 5.0)
+                        optimizer.step()
 
-                    seen_sentences += len(batch)
-                    train_loss += loss.item()
+                        seen_sentences += len(batch)
+                        train_loss += loss.item()
 
-                    clear_embeddings(batch, also_clear_word_embeddings=not embeddings_in_memory)
+                        embeddings_storage.store(batch)
 
-                    if batch_no % modulo == 0 and epoch > self.epoch:
-                        log.info(f'epoch {epoch + 1} - iter {batch_no}/{batches_count} - loss '
-                                 f'{train_loss / seen_sentences:.8f}')
-                        iteration = epoch * batches_count + batch_no
-                        if not param_selection_mode:
-                            weight_extractor.extract_weights(self.model.state_dict(), iteration)
+                        if batch_no % modulo == 0 and epoch > self.epoch:
+                            log.info(f'epoch {epoch + 1} - iter {batch_no}/{batches_count} - loss '
+                                     f'{train_loss / seen_sentences:.8f}')
+                            iteration = epoch * batches_count + batch_no
+                            if not param_selection_mode:
+                                weight_extractor.extract_weights(self.model.state_dict(), iteration)
 
-                train_loss /= train_data_count
+                    train_loss /= train_data_count
 
-                self.model.eval()
+                    self.model.eval()
 
-                log_line(log)
-                log.info(f'EPOCH {epoch + 1} done: loss {train_loss:.4f} - lr {learning_rate:.4f} - bad epochs {bad_epochs}')
+                    log_line(log)
+                    log.info(f'EPOCH {epoch + 1} done: loss {train_loss:.4f} - lr {learning_rate:.4f} - bad epochs {bad_epochs}')
+
+                    dev_metric = None
+                    dev_loss = '_'
+
+                    train_metric = None
+                    test_metric = None
+                    if monitor_train:
+                        train_metric, train_loss = self._calculate_evaluation_results_for(
+                            'TRAIN', self.corpus.train(), evaluation_metric, embeddings_storage, eval_mini_batch_size)
+
+                    if not train_with_dev:
+                        dev_metric, dev_loss = self._calculate_evaluation_results_for(
+                            'DEV', self.corpus.dev(), evaluation_metric, embeddings_storage, eval_mini_batch_size)
+
+                    if not param_selection_mode and self.corpus.test:
+                        test_metric, test_loss = self._calculate_evaluation_results_for(
+                            'TEST', self.corpus.test(), evaluation_metric, embeddings_storage, eval_mini_batch_size,
+                            base_path / 'test.tsv')
+
+                    log.info(f'EMBEDDINGS: {embeddings_storage.summary()}')
+                    embeddings_storage.reset_statistics()
+
+                    if not param_selection_mode:
+                        with open(loss_txt, 'a') as f:
+                            train_metric_str = train_metric.to_tsv() if train_metric is not None else Metric.to_empty_tsv()
+                            dev_metric_str = dev_metric.to_tsv() if dev_metric is not None else Metric.to_empty_tsv()
+                            test_metric_str = test_metric.to_tsv() if test_metric is not None else Metric.to_empty_tsv()
+                            f.write(
+                                f'{epoch}\t{datetime.datetime.now():%H:%M:%S}\t{bad_epochs}\t{learning_rate:.4f}\t'
+                                f'{train_loss}\t{train_metric_str}\t{dev_loss}\t{dev_metric_str}\t_\t{test_metric_str}\n')
+
+                    # calculate scores using dev data if available
+                    dev_score = 0.
+                    if not train_with_dev:
+                        if evaluation_metric == EvaluationMetric.MACRO_ACCURACY:
+                            dev_score = dev_metric.macro_avg_accuracy()
+                        elif evaluation_metric == EvaluationMetric.MICRO_ACCURACY:
+                            dev_score = dev_metric.micro_avg_accuracy()
+                        elif evaluation_metric == EvaluationMetric.MACRO_F1_SCORE:
+                            dev_score = dev_metric.macro_avg_f_score()
+                        else:
+                            dev_score = dev_metric.micro_avg_f_score()
 
-                dev_metric = None
-                dev_loss = '_'
+                        # append dev score to score history
+                        dev_score_history.append(dev_score)
+                        dev_loss_history.append(dev_loss)
 
-                train_metric = None
-                test_metric = None
-                if monitor_train:
-                    train_metric, train_loss = self._calculate_evaluation_results_for(
-                        'TRAIN', self.corpus.train(), evaluation_metric, embeddings_in_memory, eval_mini_batch_size)
+                    # anneal against train loss if training with dev, otherwise anneal against dev score
+                    current_score = train_loss if anneal_against_train_loss else dev_score
 
-                if not train_with_dev:
-                    dev_metric, dev_loss = self._calculate_evaluation_results_for(
-                        'DEV', self.corpus.dev(), evaluation_metric, embeddings_in_memory, eval_mini_batch_size)
+                    scheduler.step(current_score)
 
-                if not param_selection_mode and self.corpus.test:
-                    test_metric, test_loss = self._calculate_evaluation_results_for(
-                        'TEST', self.corpus.test(), evaluation_metric, embeddings_in_memory, eval_mini_batch_size,
-                        base_path / 'test.tsv')
+                    train_loss_history.append(train_loss)
 
-                if not param_selection_mode:
-                    with open(loss_txt, 'a') as f:
-                        train_metric_str = train_metric.to_tsv() if train_metric is not None else Metric.to_empty_tsv()
-                        dev_metric_str = dev_metric.to_tsv() if dev_metric is not None else Metric.to_empty_tsv()
-                        test_metric_str = test_metric.to_tsv() if test_metric is not None else Metric.to_empty_tsv()
-                        f.write(
-                            f'{epoch}\t{datetime.datetime.now():%H:%M:%S}\t{bad_epochs}\t{learning_rate:.4f}\t'
-                            f'{train_loss}\t{train_metric_str}\t{dev_loss}\t{dev_metric_str}\t_\t{test_metric_str}\n')
-
-                # calculate scores using dev data if available
-                dev_score = 0.
-                if not train_with_dev:
-                    if evaluation_metric == EvaluationMetric.MACRO_ACCURACY:
-                        dev_score = dev_metric.macro_avg_accuracy()
-                    elif evaluation_metric == EvaluationMetric.MICRO_ACCURACY:
-                        dev_score = dev_metric.micro_avg_accuracy()
-                    elif evaluation_metric == EvaluationMetric.MACRO_F1_SCORE:
-                        dev_score = dev_metric.macro_avg_f_score()
-                    else:
-                        dev_score = dev_metric.micro_avg_f_score()
-
-                    # append dev score to score history
-                    dev_score_history.append(dev_score)
-                    dev_loss_history.append(dev_loss)
-
-                # anneal against train loss if training with dev, otherwise anneal against dev score
-                current_score = train_loss if anneal_against_train_loss else dev_score
-
-                scheduler.step(current_score)
-
-                train_loss_history.append(train_loss)
-
-                # if checkpoint is enable, save model at each epoch
-                if checkpoint and not param_selection_mode:
-                    self.model.save_checkpoint(base_path / 'checkpoint.pt',
-                                               optimizer.state_dict(), scheduler.state_dict(),
-                                               epoch + 1, train_loss)
-
-                # if we use dev data, remember best model based on dev evaluation score
-                if not train_with_dev and not param_selection_mode and current_score == scheduler.best:
-                    self.model.save(base_path / 'best-model.pt')
-
-            # if we do not use dev data for model selection, save final model
-            if save_final_model and not param_selection_mode :
-                self.model.save(base_path / 'final-model.pt')
-
-        except KeyboardInterrupt:
-            log_line(log)
-            log.info('Exiting from training early.')
-            if not param_selection_mode:
-                log.info('Saving model ...')
-                self.model.save(base_path / 'final-model.pt')
-                log.info('Done.')
+                    # if checkpoint is enable, save model at each epoch
+                    if checkpoint and not param_selection_mode:
+                        self.model.save_checkpoint(base_path / 'checkpoint.pt',
+                                                   optimizer.state_dict(), scheduler.state_dict(),
+                                                   epoch + 1, train_loss)
 
-        # test best model if test data is present
-        if self.corpus.test:
-            final_score = self.final_test(base_path, embeddings_in_memory, evaluation_metric, eval_mini_batch_size)
-        else:
-            final_score = 0
-            log.info('Test data not provided setting final score to 0')
+                    # if we use dev data, remember best model based on dev evaluation score
+                    if not train_with_dev and not param_selection_mode and current_score == scheduler.best:
+                        self.model.save(base_path / 'best-model.pt')
+
+                # if we do not use dev data for model selection, save final model
+                if save_final_model and not param_selection_mode :
+                    self.model.save(base_path / 'final-model.pt')
+
+            except KeyboardInterrupt:
+                log_line(log)
+                log.info('Exiting from training early.')
+                if not param_selection_mode:
+                    log.info('Saving model ...')
+                    self.model.save(base_path / 'final-model.pt')
+                    log.info('Done.')
+
+            # test best model if test data is present
+            if self.corpus.test:
+                final_score = self.final_test(base_path, embeddings_in_memory, evaluation_metric, eval_mini_batch_size,
+                                              embeddings_storage=embeddings_storage)
+            else:
+                final_score = 0
+                log.info('Test data not provided setting final score to 0')
+        finally:
+            embeddings_storage.close()
 
         return {'test_score': final_score,
                 'dev_score_history': dev_score_history,
@@ -277,7 +302,8 @@ class ModelTrainer:
                    base_path: Path,
                    embeddings_in_memory: bool,
                    evaluation_metric: EvaluationMetric,
-                   eval_mini_batch_size: int):
+                   eval_mini_batch_size: int,
+                   embeddings_storage: EmbeddingStorage = None):
 
         log_line(log)
         log.info('Testing using best model ...')
@@ -290,8 +316,13 @@ class ModelTrainer:
             if isinstance(self.model, SequenceTagger):
                 self.model = SequenceTagger.load_from_file(base_path / 'best-model.pt')
 
+        if embeddings_storage is None:
+            embeddings_storage = EmbeddingStorage(self.model, 'memory' if embeddings_in_memory else 'none')
+        else:
+            embeddings_storage.attach(self.model)
+
         test_metric, test_loss = self.evaluate(self.model, self.corpus.test(), eval_mini_batch_size=eval_mini_batch_size,
-                                               embeddings_in_memory=embeddings_in_memory)
+                                               embeddings_storage=embeddings_storage)
 
         log.info(f'MICRO_AVG: acc {test_metric.micro_avg_accuracy()} - f1-score {test_metric.micro_avg_f_score()}')
         log.info(f'MACRO_AVG: acc {test_metric.macro_avg_accuracy()} - f1-score {test_metric.macro_avg_f_score()}')
@@ -310,7 +341,7 @@ class ModelTrainer:
                 self._calculate_evaluation_results_for(subcorpus.name,
                                                        subcorpus.test(),
                                                        evaluation_metric,
-                                                       embeddings_in_memory,
+                                                       embeddings_storage,
                                                        eval_mini_batch_size,
                                                        base_path / 'test.tsv')
 
@@ -330,12 +361,12 @@ class ModelTrainer:
                                           dataset_name: str,
                                           dataset: Iterable[Sentence],
                                           evaluation_metric: EvaluationMetric,
-                                          embeddings_in_memory: bool,
+                                          embeddings_storage: EmbeddingStorage,
                                           eval_mini_batch_size: int,
                                           out_path: Path = None):
 
         metric, loss = ModelTrainer.evaluate(self.model, dataset, eval_mini_batch_size=eval_mini_batch_size,
-                                             embeddings_in_memory=embeddings_in_memory, out_path=out_path)
+                                             out_path=out_path, embeddings_storage=embeddings_storage)
 
         if evaluation_metric == EvaluationMetric.MACRO_ACCURACY or evaluation_metric == EvaluationMetric.MACRO_F1_SCORE:
             f_score = metric.macro_avg_f_score()
@@ -352,22 +383,29 @@ class ModelTrainer:
     def evaluate(model: flair.nn.Model, data_set: Iterable[Sentence],
                  eval_mini_batch_size: int = 32,
                  embeddings_in_memory: bool = True,
-                 out_path: Path = None) -> (
+                 out_path: Path = None,
+                 embeddings_storage: EmbeddingStorage = None) -> (
             dict, float):
+        if embeddings_storage is None:
+            embeddings_storage = EmbeddingStorage(model, 'memory' if embeddings_in_memory else 'none')
+
         if isinstance(model, TextClassifier):
-            return ModelTrainer._evaluate_text_classifier(model, data_set, eval_mini_batch_size, embeddings_in_memory,
+            return ModelTrainer._evaluate_text_classifier(model, data_set, eval_mini_batch_size, embeddings_storage,
                                                           out_path)
         elif isinstance(model, SequenceTagger):
-            return ModelTrainer._evaluate_sequence_tagger(model, data_set, eval_mini_batch_size, embeddings_in_memory,
+            return ModelTrainer._evaluate_sequence_tagger(model, data_set, eval_mini_batch_size, embeddings_storage,
                                                           out_path)
 
     @staticmethod
     def _evaluate_sequence_tagger(model,
                                   sentences: Iterable[Sentence],
                                   eval_mini_batch_size: int = 32,
-                                  embeddings_in_memory: bool = True,
+                                  embeddings_storage: EmbeddingStorage = None,
                                   out_path: Path = None) -> (dict, float):
 
+        if embeddings_storage is None:
+            embeddings_storage = EmbeddingStorage(model, 'none')
+
         with torch.no_grad():
             eval_loss = 0
 
@@ -383,6 +421,7 @@ class ModelTrainer:
                 sentences_len += len(batch)
                 batch_no += 1
 
+                embeddings_storage.prepare(batch)
                 tags, loss = model.forward_labels_and_loss(batch)
 
                 eval_loss += loss
@@ -416,7 +455,7 @@ class ModelTrainer:
                         else:
                             metric.add_tn(tag)
 
-                clear_embeddings(batch, also_clear_word_embeddings=not embeddings_in_memory)
+                embeddings_storage.store(batch)
 
             eval_loss /= sentences_len
 
@@ -430,9 +469,12 @@ class ModelTrainer:
     def _evaluate_text_classifier(model: flair.nn.Model,
                                   sentences: Iterable[Sentence],
                                   eval_mini_batch_size: int = 32,
-                                  embeddings_in_memory: bool = False,
+                                  embeddings_storage: EmbeddingStorage = None,
                                   out_path: Path = None) -> (dict, float):
 
+        if embeddings_storage is None:
+            embeddings_storage = EmbeddingStorage(model, 'none')
+
         with torch.no_grad():
             eval_loss = 0
 
@@ -445,9 +487,10 @@ class ModelTrainer:
             lines: List[str] = []
             for batch in batches:
                 sentences_len += len(batch)
+                embeddings_storage.prepare(batch)
                 labels, loss = model.forward_labels_and_loss(batch)
 
-                clear_embeddings(batch, also_clear_word_embeddings=not embeddings_in_memory)
+                embeddings_storage.store(batch)
 
                 eval_loss += loss
 
@@ -1,10 +1,16 @@
 import itertools
 import random
 import logging
-from collections import defaultdict
+import hashlib
+import weakref
+from collections import defaultdict, OrderedDict
 from enum import Enum
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Tuple
+
+import torch
+
+import flair
 from flair.data import Dictionary, Sentence
 from functools import reduce
 
@@ -197,6 +203,160 @@ def clear_embeddings(sentences: List[Sentence], also_clear_word_embeddings=False
         sentence.clear_embeddings(also_clear_word_embeddings=also_clear_word_embeddings)
 
 
+class EmbeddingStorage(object):
+    """
+    Decides which embeddings stay attached to sentences between mini-batches. Sentence-level and non-static
+    embeddings are always recomputed. Static token embeddings are handled according to the storage mode:
+    'none' keeps nothing, 'memory' keeps them as computed, 'fp16' keeps them in half precision and 'disk' writes
+    them to memory-mapped embedding caches from which they are read back the next time they are needed. 'device'
+    keeps nothing either, but leaves the embeddings of the current mini-batch on flair.device instead of moving them
+    to the CPU and back, and frees them once the mini-batch was processed.
+    In 'memory' and 'fp16' mode, a RAM budget can be set. If it is exceeded, the embeddings of the least recently
+    used sentences are dropped.
+    """
+
+    MODES = ['none', 'memory', 'fp16', 'disk', 'device']
+
+    def __init__(self, model: torch.nn.Module, mode: str = 'memory', directory: Path = None, max_memory: int = 0):
+        """
+        :param model: the model whose embeddings are stored
+        :param mode: one of 'none', 'memory', 'fp16', 'disk' and 'device'
+        :param directory: directory of the embedding caches, required in 'disk' mode
+        :param max_memory: RAM budget in bytes for 'memory' and 'fp16' mode, 0 means unbounded
+        """
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown embedding storage mode "{mode}". Use one of {self.MODES}.')
+        if mode == 'disk' and directory is None:
+            raise ValueError('Embedding storage mode "disk" requires a directory.')
+
+        self.mode: str = mode
+        self.directory: Path = Path(directory) if directory is not None else None
+        self.max_memory: int = max_memory
+
+        # sentences whose embeddings are kept, in least recently used order, with their size in bytes
+        self._stored: Dict[int, Tuple[weakref.ref, int]] = OrderedDict()
+        self.memory_used: int = 0
+
+        self.static_names: List[str] = []
+        self._cached_embeddings = []
+
+        self.reset_statistics()
+        self.attach(model)
+
+    def attach(self, model: torch.nn.Module):
+        """Switches to the embeddings of the given model, for instance after the best model was reloaded."""
+        from flair.embeddings import TokenEmbeddings, StackedEmbeddings
+
+        self._detach_caches()
+
+        static_embeddings = [module for module in model.modules() if isinstance(module, TokenEmbeddings)
+                             and not isinstance(module, StackedEmbeddings) and module.static_embeddings]
+        self.static_names = [embedding.name for embedding in static_embeddings]
+
+        if self.mode == 'disk':
+            for embedding in static_embeddings:
+                # embeddings that already use their own cache are left alone
+                if getattr(embedding, 'embedding_cache', None) is not None:
+                    continue
+                name_hash = hashlib.sha1(embedding.name.encode('utf-8')).hexdigest()[:16]
+                embedding.enable_cache(self.directory / name_hash)
+                self._cached_embeddings.append(embedding)
+
+    def reset_statistics(self):
+        self.requested: int = 0
+        self.reused: int = 0
+
+    def _is_available(self, sentence: Sentence, name: str) -> bool:
+        if sentence.is_embedded(name):
+            return True
+        for embedding in self._cached_embeddings:
+            if embedding.name == name:
+                return embedding.embedding_cache.make_key(sentence.to_tokenized_string(),
+                                                          embedding.cache_fingerprint) in embedding.embedding_cache
+        return False
+
+    def prepare(self, sentences: List[Sentence]):
+        """Call before embedding a mini-batch. Counts the static embeddings that need not be recomputed."""
+        for sentence in sentences:
+            if self.mode == 'device':
+                sentence.embedding_device = flair.device
+
+            if len(sentence) == 0:
+                continue
+
+            for name in self.static_names:
+                self.requested += 1
+                if self._is_available(sentence, name):
+                    self.reused += 1
+
+            # mark as recently used
+            if id(sentence) in self._stored:
+                self._stored.move_to_end(id(sentence))
+
+    def store(self, sentences: List[Sentence]):
+        """Call after a mini-batch was processed. Drops all embeddings that are not kept."""
+        keep = self.mode in ['memory', 'fp16']
+
+        for sentence in sentences:
+            sentence.clear_embeddings(also_clear_word_embeddings=not keep)
+            sentence.embedding_device = None
+            if not keep:
+                continue
+
+            sentence.clear_non_static_embeddings()
+
+            size = 0
+            for token in sentence:
+                for name, vector in token._embeddings.items():
+                    if self.mode == 'fp16' and vector.dtype == torch.float32:
+                        vector = vector.half()
+                        token._embeddings[name] = vector
+                    size += vector.numel() * vector.element_size()
+
+            previous = self._stored.pop(id(sentence), None)
+            if previous is not None:
+                self.memory_used -= previous[1]
+            self._stored[id(sentence)] = (weakref.ref(sentence), size)
+            self.memory_used += size
+
+        if self.max_memory > 0:
+            self._evict()
+
+    def _evict(self):
+        while self.memory_used > self.max_memory and self._stored:
+            _, (sentence_ref, size) = self._stored.popitem(last=False)
+            self.memory_used -= size
+            sentence = sentence_ref()
+            if sentence is not None:
+                sentence.clear_embeddings()
+
+    def _forget_collected_sentences(self):
+        for key in [key for key, (sentence_ref, _) in self._stored.items() if sentence_ref() is None]:
+            self.memory_used -= self._stored.pop(key)[1]
+
+    @property
+    def disk_used(self) -> int:
+        return sum(embedding.embedding_cache.size for embedding in self._cached_embeddings)
+
+    def summary(self) -> str:
+        self._forget_collected_sentences()
+        reused = self.reused / self.requested if self.requested > 0 else 0.
+        disk = f' - {self.disk_used / 2 ** 20:.1f} MB on disk' if self.mode == 'disk' else ''
+        return f'storage {self.mode} - {self.memory_used / 2 ** 20:.1f} MB in RAM{disk} - ' \
+               f'reused {self.reused}/{self.requested} static embeddings ({reused:.2%})'
+
+    def _detach_caches(self):
+        for embedding in self._cached_embeddings:
+            embedding.disable_cache()
+        self._cached_embeddings = []
+
+    def close(self):
+        """Detaches the caches this storage attached to embeddings and forgets stored sentences."""
+        self._detach_caches()
+        self._stored = OrderedDict()
+        self.memory_used = 0
+
+
 def init_output_file(base_path: Path, file_name: str) -> Path:
     """
     Creates a local file.
@@ -1,4 +1,3 @@
-from sklearn.manifold import TSNE
 import tqdm
 import numpy
 
@@ -15,6 +14,9 @@ class tSNE(_Transform):
     def __init__(self):
         super().__init__()
 
+        # sklearn is slow to import, so it is only imported when needed
+        from sklearn.manifold import TSNE
+
         self.transform = \
             TSNE(n_components=2, verbose=1, perplexity=40, n_iter=300)
 
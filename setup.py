@@ -9,7 +9,7 @@ setup(
     author='Alan Akbik',
     author_email='alan.akbik@zalando.de',
     url='https://github.com/zalandoresearch/flair',
-    packages=find_packages(exclude='test'),  # same as name
+    packages=find_packages(exclude=['tests', 'tests.*', 'benchmarks', 'benchmarks.*']),  # same as name
     license='MIT',
     install_requires=[
         'torch>=1.0.0',
@@ -41,3 +41,158 @@ def pytest_collection_modifyitems(config, items):
         for item in items:
             if "integration" in item.keywords:
                 item.add_marker(skip_integration)
+
+
+@pytest.fixture(scope="session")
+def word_vectors_path(tmp_path_factory):
+    """Creates tiny gensim word vectors so that WordEmbeddings can be tested without downloads."""
+    import numpy
+    import gensim
+
+    words = ['I', 'love', 'berlin', 'Berlin', '.', 'is', 'a', 'great', 'place', 'to', 'live', 'the', 'year', '####',
+             'in', 'of', 'and', 'city']
+    vectors = numpy.random.RandomState(42).uniform(-1., 1., (len(words), 10)).astype('float32')
+
+    word_vectors = gensim.models.KeyedVectors(10)
+    if hasattr(word_vectors, 'add_vectors'):
+        word_vectors.add_vectors(words, vectors)
+    else:
+        word_vectors.add(words, vectors)
+
+    path = tmp_path_factory.mktemp('word_vectors') / 'tiny.gensim'
+    # store the matrix in a separate .npy file like the published embeddings
+    word_vectors.save(str(path), separately=['vectors'])
+    return path
+
+
+@pytest.fixture(scope="session")
+def char_dictionary_path(tmp_path_factory):
+    """Creates a small character dictionary so that CharacterEmbeddings can be tested without downloads."""
+    from flair.data import Dictionary
+
+    dictionary: Dictionary = Dictionary()
+    for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,!?#':
+        dictionary.add_item(char)
+
+    path = tmp_path_factory.mktemp('chars') / 'chars.pkl'
+    dictionary.save(str(path))
+    return path
+
+
+@pytest.fixture(scope="session")
+def bpemb_cache_path(tmp_path_factory):
+    """Creates a tiny English BPEmb model (1000 subwords, 8 dimensions) in the layout BPEmb downloads to."""
+    import numpy
+    import gensim
+    import sentencepiece
+
+    path = tmp_path_factory.mktemp('bpemb')
+    (path / 'en').mkdir()
+
+    text = path / 'text.txt'
+    with open(text, 'w', encoding='utf-8') as f:
+        for i in range(200):
+            f.write(f'i love berlin and the year {i} is a great year to live in the city of berlin\n')
+
+    model_prefix = path / 'en' / 'en.wiki.bpe.vs1000'
+    sentencepiece.SentencePieceTrainer.Train(f'--input={text} --model_prefix={model_prefix} --vocab_size=1000 '
+                                             f'--model_type=bpe --hard_vocab_limit=false')
+
+    processor = sentencepiece.SentencePieceProcessor()
+    processor.Load(f'{model_prefix}.model')
+    pieces = [processor.IdToPiece(i) for i in range(processor.GetPieceSize())]
+
+    vectors = gensim.models.KeyedVectors(8)
+    rows = numpy.random.RandomState(42).uniform(-1., 1., (len(pieces), 8)).astype('float32')
+    if hasattr(vectors, 'add_vectors'):
+        vectors.add_vectors(pieces, rows)
+    else:
+        vectors.add(pieces, rows)
+    vectors.save_word2vec_format(str(path / 'en' / 'en.wiki.bpe.vs1000.d8.w2v.bin'), binary=True)
+
+    return path
+
+
+def _make_language_model_file(directory, is_forward_lm: bool):
+    import torch
+    from flair.data import Dictionary
+    from flair.models import LanguageModel
+
+    dictionary: Dictionary = Dictionary()
+    for char in '\n abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,!?\'"-':
+        dictionary.add_item(char)
+
+    torch.manual_seed(1)
+    language_model = LanguageModel(dictionary, is_forward_lm, hidden_size=32, nlayers=1, embedding_size=16)
+
+    path = directory / f'lm-{"forward" if is_forward_lm else "backward"}.pt'
+    language_model.save(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def forward_lm_path(tmp_path_factory):
+    """Creates a tiny, untrained forward character language model."""
+    return _make_language_model_file(tmp_path_factory.mktemp('lm'), True)
+
+
+@pytest.fixture(scope="session")
+def backward_lm_path(tmp_path_factory):
+    """Creates a tiny, untrained backward character language model."""
+    return _make_language_model_file(tmp_path_factory.mktemp('lm'), False)
+
+
+@pytest.fixture(scope="session")
+def bert_model_path(tmp_path_factory):
+    """Creates a tiny, untrained BERT model with a word piece vocabulary, stored like the published models."""
+    import torch
+    from pytorch_pretrained_bert import BertConfig, BertModel
+
+    path = tmp_path_factory.mktemp('bert')
+
+    vocabulary = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'i', 'love', 'berlin', 'is', 'a', 'great', 'city',
+                  'to', 'live', 'in', 'and', 'the', 'year', ',', '.', '!', 'ber', '##lin', '##s', 'gre', '##at', 'un',
+                  '##believ', '##able'] + list('abcdefghijklmnopqrstuvwxyz') + [f'##{c}' for c in 'abcdefghijklmnopqrstuvwxyz']
+    with open(path / 'vocab.txt', 'w') as f:
+        f.write('\n'.join(vocabulary) + '\n')
+
+    config = BertConfig(len(vocabulary), hidden_size=16, num_hidden_layers=4, num_attention_heads=2,
+                        intermediate_size=32, max_position_embeddings=64)
+    with open(path / 'bert_config.json', 'w') as f:
+        f.write(config.to_json_string())
+
+    torch.manual_seed(1)
+    torch.save(BertModel(config).state_dict(), str(path / 'pytorch_model.bin'))
+
+    return path
+
+
+@pytest.fixture(scope="session")
+def transformer_xl_model_path(tmp_path_factory):
+    """Creates a tiny, untrained Transformer-XL model and vocabulary, stored like the published models."""
+    import torch
+    from pytorch_pretrained_bert import TransfoXLConfig, TransfoXLModel
+
+    path = tmp_path_factory.mktemp('transformer-xl')
+
+    vocabulary = ['<unk>', '<eos>', 'the', ',', '.', 'I', 'love', 'Berlin', 'is', 'a', 'great', 'city', 'to', 'live',
+                  'in', 'and', 'year', 'hello', '!']
+    torch.save({'idx2sym': vocabulary, 'sym2idx': {word: index for index, word in enumerate(vocabulary)},
+                'unk_idx': 0}, str(path / 'vocab.bin'))
+
+    config = TransfoXLConfig(len(vocabulary), cutoffs=[10], d_model=16, d_embed=16, n_head=2, d_head=8, d_inner=32,
+                             div_val=1, n_layer=2, tgt_len=8, mem_len=8, clamp_len=32)
+    with open(path / 'config.json', 'w') as f:
+        f.write(config.to_json_string())
+
+    torch.manual_seed(1)
+    model = TransfoXLModel(config)
+    torch.save(model.state_dict(), str(path / 'pytorch_model.bin'))
+
+    # the Transformer-XL implementation builds masks that newer versions of torch reject
+    try:
+        model(torch.tensor([[1, 2]]))
+    except RuntimeError as error:
+        pytest.skip(f'Transformer-XL does not run with this version of torch: {error}')
+
+    return path
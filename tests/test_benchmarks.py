@@ -0,0 +1,34 @@
+import pytest
+
+from benchmarks.embeddings import run
+from benchmarks.synthetic import make_corpus, make_vocabulary
+
+
+@pytest.mark.parametrize('length_distribution', ['fixed', 'uniform', 'lognormal'])
+def test_synthetic_corpus(length_distribution):
+    vocabulary = make_vocabulary(100)
+    corpus = make_corpus(200, mean_length=10, length_distribution=length_distribution, vocabulary=vocabulary)
+
+    assert len(corpus) == 200
+    assert all(len(sentence) > 0 for sentence in corpus)
+    assert 8 <= sum(len(sentence) for sentence in corpus) / len(corpus) <= 12
+    assert {token.text for sentence in corpus for token in sentence} <= set(vocabulary)
+
+    # the same seed gives the same corpus
+    again = make_corpus(200, mean_length=10, length_distribution=length_distribution, vocabulary=vocabulary)
+    assert [sentence.to_tokenized_string() for sentence in corpus] == \
+           [sentence.to_tokenized_string() for sentence in again]
+
+
+def test_embeddings_benchmark():
+    config = {'sentences': 20, 'mean_length': 5, 'length_distribution': 'uniform', 'vocabulary': 50,
+              'batch_size': 8, 'hidden_size': 16, 'threads': None, 'seed': 1}
+    report = run(['word', 'document-pool'], config, isolate=False)
+
+    assert report['config'] == config
+    assert {'word', 'document-pool'} <= set(report['results'])
+    for result in report['results'].values():
+        assert 'error' not in result, result['error']
+        assert result['sentences'] == 20
+        assert result['tokens_per_second'] > 0
+        assert result['latency_ms']['p50'] <= result['latency_ms']['p99'] <= result['latency_ms']['max']
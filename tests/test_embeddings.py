@@ -1,9 +1,16 @@
+import shutil
+
+import numpy as np
 import pytest
+import torch
 
 from flair.embeddings import WordEmbeddings, TokenEmbeddings, StackedEmbeddings, \
-    DocumentPoolEmbeddings, FlairEmbeddings, DocumentRNNEmbeddings
+    DocumentPoolEmbeddings, FlairEmbeddings, DocumentRNNEmbeddings, BytePairEmbeddings, CharacterEmbeddings, \
+    PooledFlairEmbeddings, DocumentLMEmbeddings, BertEmbeddings, TransformerXLEmbeddings, prune_word_embeddings, convert_word_vectors, \
+    quantize_embeddings, ELMoEmbeddings, ELMoTransformerEmbeddings
+from flair.embedding_cache import EmbeddingCache
 
-from flair.data import Sentence
+from flair.data import Sentence, Token
 
 
 def test_loading_not_existing_embedding():
@@ -85,6 +92,786 @@ def test_document_pool_embeddings():
         assert (len(sentence.get_embedding()) == 0)
 
 
+@pytest.mark.parametrize('mode', ['mean', 'max', 'min', 'sum', 'first', 'last', 'mean_max'])
+def test_document_pool_embeddings_modes(word_vectors_path, mode):
+    embeddings: DocumentPoolEmbeddings = DocumentPoolEmbeddings([WordEmbeddings(str(word_vectors_path))], mode=mode)
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin'), Sentence('the year is great , too !')]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        word_embeddings = torch.stack([token.get_embedding() for token in sentence])
+        expected = {
+            'mean': word_embeddings.mean(dim=0),
+            'max': word_embeddings.max(dim=0)[0],
+            'min': word_embeddings.min(dim=0)[0],
+            'sum': word_embeddings.sum(dim=0),
+            'first': word_embeddings[0],
+            'last': word_embeddings[-1],
+            'mean_max': torch.cat([word_embeddings.mean(dim=0), word_embeddings.max(dim=0)[0]]),
+        }[mode]
+        assert len(sentence.get_embedding()) == embeddings.embedding_length
+        assert torch.allclose(sentence.get_embedding(), expected, atol=1e-6)
+
+    # word embeddings are static, so pooled embeddings of known texts are reused without embedding the tokens
+    sentence = Sentence('I love Berlin .')
+    embeddings.embed(sentence)
+    assert torch.equal(sentence.get_embedding(), sentences[0].get_embedding())
+    assert all(len(token._embeddings) == 0 for token in sentence)
+
+
+def test_document_pool_embeddings_cache_follows_token_embeddings(word_vectors_path):
+    word_embeddings: WordEmbeddings = WordEmbeddings(str(word_vectors_path))
+    embeddings: DocumentPoolEmbeddings = DocumentPoolEmbeddings([word_embeddings])
+
+    before = Sentence('I love Berlin .')
+    embeddings.embed(before)
+
+    # after quantization the pooled embedding is computed from the quantized token embeddings
+    word_embeddings.quantize('int8')
+    after = Sentence('I love Berlin .')
+    embeddings.embed(after)
+
+    expected = Sentence('I love Berlin .')
+    word_embeddings.embed(expected)
+    assert torch.allclose(after.get_embedding(), torch.stack([token.get_embedding() for token in expected]).mean(0))
+    assert not torch.equal(after.get_embedding(), before.get_embedding())
+
+
+def test_document_pool_embeddings_cache_with_field(word_vectors_path):
+    embeddings: DocumentPoolEmbeddings = DocumentPoolEmbeddings([WordEmbeddings(str(word_vectors_path),
+                                                                                field='lemma')])
+
+    sentences = []
+    for lemmas in [['I', 'love', 'Berlin'], ['I', 'live', 'Berlin']]:
+        sentence = Sentence('I love Berlin')
+        for token, lemma in zip(sentence, lemmas):
+            token.add_tag('lemma', lemma)
+        embeddings.embed(sentence)
+        sentences.append(sentence)
+
+    # the same text with other tag values is not taken from the cache
+    assert not torch.equal(sentences[0].get_embedding(), sentences[1].get_embedding())
+
+
+@pytest.mark.skipif('forward' not in vars(torch.nn.RNNBase),
+                    reason='torch.nn.RNNBase cannot be run directly with this version of torch')
+@pytest.mark.parametrize('bidirectional', [False, True])
+def test_document_rnn_embeddings_batch(word_vectors_path, bidirectional):
+    embeddings: DocumentRNNEmbeddings = DocumentRNNEmbeddings([WordEmbeddings(str(word_vectors_path))],
+                                                              hidden_size=8, bidirectional=bidirectional)
+    embeddings.eval()
+
+    texts = ['Berlin', 'I love Berlin .', 'the year is great , too !', 'I love']
+    sentences = [Sentence(text) for text in texts]
+    embeddings.embed(sentences)
+
+    # the order of the caller's list is kept
+    assert [sentence.to_plain_string() for sentence in sentences] == texts
+
+    for sentence in sentences:
+        assert len(sentence.get_embedding()) == embeddings.embedding_length
+
+        alone = Sentence(sentence.to_plain_string())
+        embeddings.embed(alone)
+        assert torch.allclose(sentence.get_embedding(), alone.get_embedding(), atol=1e-6)
+
+
+def test_document_lm_embeddings(forward_lm_path, backward_lm_path):
+    flair_embeddings = [FlairEmbeddings(str(forward_lm_path)), FlairEmbeddings(str(backward_lm_path))]
+    embeddings: DocumentLMEmbeddings = DocumentLMEmbeddings(flair_embeddings)
+
+    texts = ['I love Berlin .', 'Berlin', 'Berlin is a great place to live , and the year is great , too .']
+    sentences = [Sentence(text) for text in texts]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        assert len(sentence.get_embedding()) == embeddings.embedding_length
+
+        # no token embeddings are created
+        assert all(len(token._embeddings) == 0 for token in sentence)
+
+        # the state of the last token of the forward LM and of the first token of the backward LM
+        expected = Sentence(sentence.to_plain_string())
+        for flair_embedding in flair_embeddings:
+            flair_embedding.embed(expected)
+        assert torch.allclose(sentence.get_embedding(),
+                              torch.cat([expected[-1]._embeddings[flair_embeddings[0].name],
+                                         expected[0]._embeddings[flair_embeddings[1].name]]), atol=1e-6)
+
+
+def test_word_embeddings_lookup(word_vectors_path):
+    import gensim
+
+    keyed_vectors = gensim.models.KeyedVectors.load(str(word_vectors_path))
+    embeddings: WordEmbeddings = WordEmbeddings(str(word_vectors_path))
+
+    sentence: Sentence = Sentence('I LOVE Berlin , the year 2019 .')
+    embeddings.embed(sentence)
+
+    expected = [keyed_vectors['I'], keyed_vectors['love'], keyed_vectors['Berlin'], np.zeros(10),
+                keyed_vectors['the'], keyed_vectors['year'], keyed_vectors['####'], keyed_vectors['.']]
+    for token, vector in zip(sentence, expected):
+        assert np.allclose(token.get_embedding().numpy(), vector)
+
+    # normalized spellings are remembered
+    assert 'LOVE' in embeddings._fallback_cache
+    assert 'Berlin' not in embeddings._fallback_cache
+
+
+def test_memory_mapped_word_embeddings(word_vectors_path):
+    import pickle
+
+    embeddings: WordEmbeddings = WordEmbeddings(str(word_vectors_path), mmap=True)
+
+    assert embeddings.__getstate__()['weights'] is None
+    pickled = pickle.dumps(embeddings)
+
+    # the matrix is re-attached from the file when unpickling
+    loaded: WordEmbeddings = pickle.loads(pickled)
+    sentence: Sentence = Sentence('I love Berlin .')
+    loaded.embed(sentence)
+    assert torch.equal(sentence[0].get_embedding(), embeddings.weights[embeddings.vocab['I']])
+
+    # files that changed since the model was saved are rejected
+    loaded.vectors_fingerprint = 'other'
+    with pytest.raises(ValueError):
+        pickle.loads(pickle.dumps(loaded))
+
+
+def test_pruned_word_embeddings(word_vectors_path):
+    full: WordEmbeddings = WordEmbeddings(str(word_vectors_path))
+    pruned: WordEmbeddings = WordEmbeddings(str(word_vectors_path), mmap=True)
+
+    prune_word_embeddings(StackedEmbeddings([pruned]), ['Berlin', 'LOVE', 'year', '2019'], top_n=1)
+    assert sorted(pruned.vocab.keys()) == ['####', 'Berlin', 'I', 'berlin', 'love', 'year']
+    assert pruned.__getstate__()['weights'] is not None
+
+    # known words and their other spellings get the same vectors as from the full table, others are unknown
+    text = 'I love Berlin BERLIN berlin LOVE year 1984 . city'
+    full_sentence, pruned_sentence = Sentence(text), Sentence(text)
+    full.embed(full_sentence)
+    pruned.embed(pruned_sentence)
+
+    for full_token, pruned_token in zip(full_sentence[:-2], pruned_sentence[:-2]):
+        assert torch.equal(full_token.get_embedding(), pruned_token.get_embedding())
+    for token in pruned_sentence[-2:]:
+        assert not token.get_embedding().any()
+
+    assert pruned._get_fingerprint() != full._get_fingerprint()
+
+
+def test_embedded_bookkeeping(word_vectors_path, char_dictionary_path):
+    word_embeddings: WordEmbeddings = WordEmbeddings(str(word_vectors_path))
+    char_embeddings: CharacterEmbeddings = CharacterEmbeddings(str(char_dictionary_path))
+    stacked: StackedEmbeddings = StackedEmbeddings([word_embeddings, char_embeddings])
+
+    embedded_sentences = []
+    add_embeddings = word_embeddings._add_embeddings_internal
+    word_embeddings._add_embeddings_internal = lambda sentences: embedded_sentences.extend(sentences) or \
+        add_embeddings(sentences)
+
+    first, second = Sentence('I love Berlin .'), Sentence('Berlin is great')
+    stacked.embed(first)
+    assert first.is_embedded(word_embeddings.name, word_embeddings.version)
+    assert first.is_embedded(char_embeddings.name)
+
+    # static embeddings are only added to the sentence that does not have them yet
+    stacked.embed([first, second])
+    assert embedded_sentences == [first, second]
+
+    # only non-static embeddings are cleared
+    first.clear_non_static_embeddings()
+    assert first.is_embedded(word_embeddings.name)
+    assert not first.is_embedded(char_embeddings.name)
+    assert all(list(token._embeddings.keys()) == [word_embeddings.name] for token in first)
+
+    # removing an embedding from one token means that the sentence no longer has it
+    first[1].clear_embeddings([word_embeddings.name])
+    assert not first.is_embedded(word_embeddings.name)
+
+    stacked.embed([first, second])
+    assert embedded_sentences == [first, second, first]
+    assert len(first[1].get_embedding()) == stacked.embedding_length
+
+    # after the vectors changed, stored embeddings are computed again
+    word_embeddings.quantize('int8')
+    stacked.embed([first, second])
+    assert embedded_sentences == [first, second, first, first, second]
+    assert second.is_embedded(word_embeddings.name, word_embeddings.version)
+
+    # so does adding a token
+    second.add_token(Token('today'))
+    assert not second.is_embedded(word_embeddings.name)
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_quantized_word_embeddings(word_vectors_path, dtype):
+    import pickle
+
+    full: WordEmbeddings = WordEmbeddings(str(word_vectors_path))
+    quantized: WordEmbeddings = WordEmbeddings(str(word_vectors_path), mmap=True)
+
+    quantize_embeddings(StackedEmbeddings([quantized]), dtype)
+    assert quantized.weights.dtype == getattr(torch, dtype)
+    assert quantized._get_fingerprint() != full._get_fingerprint()
+
+    # the converted table is pickled with the embeddings
+    quantized = pickle.loads(pickle.dumps(quantized))
+
+    text = 'I love Berlin , the year 2019 .'
+    full_sentence, quantized_sentence = Sentence(text), Sentence(text)
+    full.embed(full_sentence)
+    quantized.embed(quantized_sentence)
+
+    # int8 rows are off by at most half a step of their scale
+    tolerance = 1e-3 if dtype == 'float16' else full.weights.abs().max().item() / 254 + 1e-6
+    for full_token, quantized_token in zip(full_sentence, quantized_sentence):
+        assert quantized_token.get_embedding().dtype == torch.float32
+        assert torch.allclose(full_token.get_embedding(), quantized_token.get_embedding(), atol=tolerance)
+    assert not quantized_sentence[3].get_embedding().any()
+
+    with pytest.raises(ValueError):
+        quantized.quantize('int4')
+
+
+@pytest.mark.parametrize('header', [True, False])
+def test_convert_word_vectors(tmp_path, header):
+    vectors = {'I': [0.5, 1.0, -1.0], 'love': [0.25, 0.0, 2.0], 'berlin': [1.0, 1.0, 1.0]}
+
+    vectors_file = tmp_path / 'vectors.vec'
+    with open(vectors_file, 'w', encoding='utf-8') as f:
+        if header:
+            f.write('3 3\n')
+        for word, vector in vectors.items():
+            f.write(f'{word} {" ".join(str(value) for value in vector)} \n')
+
+    directory = convert_word_vectors(vectors_file, tmp_path / 'converted', dtype='float16', chunk_size=2)
+
+    for mmap in [False, True]:
+        embeddings: WordEmbeddings = WordEmbeddings(str(directory), mmap=mmap)
+        assert embeddings.embedding_length == 3
+        assert embeddings.weights.dtype == torch.float16
+
+        sentence: Sentence = Sentence('I love Berlin today')
+        embeddings.embed(sentence)
+        assert sentence[0].get_embedding().tolist() == vectors['I']
+        assert sentence[1].get_embedding().tolist() == vectors['love']
+        assert sentence[2].get_embedding().tolist() == vectors['berlin']
+        assert sentence[3].get_embedding().tolist() == [0., 0., 0.]
+
+
+@pytest.mark.parametrize('header', [True, False])
+def test_convert_word_vectors_with_line_breaks_in_words(tmp_path, header):
+    # words may contain characters that Python treats as line breaks, only '\n' ends a line
+    vectors = {'a\rb': [1.0, 2.0], 'x\u2028y': [3.0, 4.0], 'I': [5.0, 6.0], 'c\x85d': [7.0, 8.0]}
+
+    vectors_file = tmp_path / 'vectors.vec'
+    with open(vectors_file, 'w', encoding='utf-8', newline='') as f:
+        if header:
+            f.write('4 2\n')
+        for word, vector in vectors.items():
+            f.write(f'{word} {" ".join(str(value) for value in vector)}\n')
+
+    embeddings: WordEmbeddings = WordEmbeddings(str(convert_word_vectors(vectors_file, tmp_path / 'converted')))
+
+    sentence: Sentence = Sentence()
+    for word in vectors:
+        sentence.add_token(Token(word))
+    embeddings.embed(sentence)
+
+    for token, vector in zip(sentence, vectors.values()):
+        assert token.get_embedding().tolist() == vector
+
+
+def test_byte_pair_embeddings(bpemb_cache_path):
+    embeddings: BytePairEmbeddings = BytePairEmbeddings('en', dim=8, syllables=1000, cache_dir=bpemb_cache_path)
+
+    sentences = [Sentence('I love Berlin'), Sentence('Berlin is great in 2019')]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        for token in sentence:
+            subwords = embeddings.embedder.embed(token.text.lower())
+            expected = np.concatenate((subwords[0], subwords[-1]))
+            assert np.allclose(token.get_embedding().numpy(), expected)
+
+    # repeated words are encoded once
+    assert len(embeddings._word_cache) == 7
+
+
+def test_quantized_byte_pair_embeddings(bpemb_cache_path):
+    full: BytePairEmbeddings = BytePairEmbeddings('en', dim=8, syllables=1000, cache_dir=bpemb_cache_path)
+    quantized: BytePairEmbeddings = BytePairEmbeddings('en', dim=8, syllables=1000, cache_dir=bpemb_cache_path)
+    quantized.quantize('int8')
+    assert quantized.vectors.dtype == torch.int8
+
+    text = 'I love Berlin and the year 2019'
+    full_sentence, quantized_sentence = Sentence(text), Sentence(text)
+    full.embed(full_sentence)
+    quantized.embed(quantized_sentence)
+
+    for full_token, quantized_token in zip(full_sentence, quantized_sentence):
+        assert torch.allclose(full_token.get_embedding(), quantized_token.get_embedding(), atol=1e-2)
+
+    # the gensim vectors are dropped, the embedder still encodes subwords
+    assert quantized.embedder.emb is None
+    assert quantized.embedder.encode_ids('berlin') == full.embedder.encode_ids('berlin')
+    assert quantized.embedding_length == full.embedding_length
+
+
+class ElmoEmbedderStub:
+    """Returns (layers, tokens, dim) arrays like allennlp's ElmoEmbedder, each value encoding its position."""
+
+    def embed_batch(self, batch):
+        return [np.array([[[layer * 100 + token * 10 + dim for dim in range(4)] for token in range(len(words))]
+                          for layer in range(3)], dtype=np.float32) for words in batch]
+
+
+def test_elmo_embeddings_concatenate_layers_per_token():
+    embeddings: ELMoEmbeddings = ELMoEmbeddings.__new__(ELMoEmbeddings)
+    TokenEmbeddings.__init__(embeddings)
+    embeddings.name, embeddings.static_embeddings, embeddings.ee = 'elmo-stub', True, ElmoEmbedderStub()
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin')]
+    embeddings._add_embeddings_internal(sentences)
+
+    for sentence in sentences:
+        for index, token in enumerate(sentence):
+            expected = [layer * 100 + index * 10 + dim for layer in range(3) for dim in range(4)]
+            assert token.get_embedding().tolist() == expected
+
+
+def _stub_allennlp(monkeypatch):
+    """Stubs the allennlp modules that ELMoTransformerEmbeddings imports while embedding."""
+    import sys
+    import types
+
+    token_module = types.ModuleType('allennlp.data.tokenizers.token')
+    token_module.Token = lambda text: types.SimpleNamespace(text=text)
+    indexer_module = types.ModuleType('allennlp.data.token_indexers.elmo_indexer')
+    indexer_module.ELMoCharacterMapper = types.SimpleNamespace(max_word_length=50)
+
+    modules = {'allennlp': types.ModuleType('allennlp'), 'allennlp.data': types.ModuleType('allennlp.data'),
+               'allennlp.data.tokenizers': types.ModuleType('allennlp.data.tokenizers'),
+               'allennlp.data.tokenizers.token': token_module,
+               'allennlp.data.token_indexers': types.ModuleType('allennlp.data.token_indexers'),
+               'allennlp.data.token_indexers.elmo_indexer': indexer_module}
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+        if '.' in name:
+            parent, child = name.rsplit('.', 1)
+            setattr(modules[parent], child, module)
+
+
+class ElmoIndexerStub:
+    """Encodes each word as 50 character ids, which are never zero for real characters."""
+
+    def tokens_to_indices(self, tokens, vocabulary, index_name):
+        return {index_name: [[ord(char) for char in token.text[:50]] + [1] * (50 - len(token.text[:50]))
+                             for token in tokens]}
+
+
+def elmo_transformer_stub(character_ids: torch.Tensor) -> torch.Tensor:
+    """Returns the first two character ids of each word and the number of words that are not all-zero padding, like
+    the transformer, which masks out padding."""
+    words = (character_ids > 0).any(dim=2)
+    count = words.sum(dim=1, keepdim=True).expand(-1, character_ids.size(1)).unsqueeze(2)
+    return torch.cat([character_ids[:, :, :2], count], dim=2).float()
+
+
+def test_elmo_transformer_embeddings_batches_padded_sentences(monkeypatch):
+    _stub_allennlp(monkeypatch)
+
+    embeddings: ELMoTransformerEmbeddings = ELMoTransformerEmbeddings.__new__(ELMoTransformerEmbeddings)
+    TokenEmbeddings.__init__(embeddings)
+    embeddings.name, embeddings.static_embeddings = 'elmo-transformer', True
+    embeddings.indexer, embeddings.vocab, embeddings.lm_embedder = ElmoIndexerStub(), None, elmo_transformer_stub
+
+    # lengths 5, 4, 2 and 1 give two buckets, both with padding
+    texts = ['Berlin', 'I love Berlin and Paris', 'I love', 'the year is great']
+    sentences = [Sentence(text) for text in texts] + [Sentence()]
+    embeddings._add_embeddings_internal(sentences)
+
+    for sentence in sentences[:-1]:
+        for token in sentence:
+            # each token gets its own row, and padded words are not counted as words of the sentence
+            assert token.get_embedding().tolist() == [ord(token.text[0]), ord(token.text[1]) if len(token.text) > 1
+                                                      else 1, len(sentence)]
+
+
+def test_character_embeddings(char_dictionary_path):
+    embeddings: CharacterEmbeddings = CharacterEmbeddings(str(char_dictionary_path))
+
+    sentences = [Sentence('I love Berlin , Berlin !'), Sentence('Berlin is a great city')]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        for token in sentence:
+            # run the character LSTM on the word alone
+            chars = torch.tensor([[embeddings.char_dictionary.get_idx_for_item(char)] for char in token.text])
+            outputs, _ = embeddings.char_rnn(embeddings.char_embedding(chars))
+            assert torch.allclose(token.get_embedding(), outputs[-1, 0], atol=1e-6)
+
+    # repeated words get the same embedding
+    assert torch.equal(sentences[0][2].get_embedding(), sentences[1][0].get_embedding())
+
+    # gradients flow into the character LSTM
+    sentences[0][0].get_embedding().sum().backward()
+    assert embeddings.char_embedding.weight.grad is not None
+
+
+@pytest.mark.parametrize('is_forward', [True, False])
+def test_flair_embeddings_offsets(forward_lm_path, backward_lm_path, is_forward):
+    embeddings: FlairEmbeddings = FlairEmbeddings(str(forward_lm_path if is_forward else backward_lm_path))
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin'),
+                 Sentence('Berlin is a great place to live , and the year is great , too .')]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        # hidden states of the sentence alone, looked up token by token
+        text = sentence.to_tokenized_string()
+        states = embeddings.lm.get_representation(['\n' + (text if is_forward else text[::-1]) + ' '])
+
+        offset_forward, offset_backward = 1, len(text) + 1
+        for token in sentence:
+            offset_forward += len(token.text)
+            offset = offset_forward if is_forward else offset_backward
+            assert torch.allclose(token.get_embedding(), states[offset, 0], atol=1e-6)
+            offset_forward += 1
+            offset_backward -= len(token.text) + 1
+
+
+def test_flair_embeddings_load_without_decoder(forward_lm_path):
+    from flair.models import LanguageModel
+
+    embeddings: FlairEmbeddings = FlairEmbeddings(str(forward_lm_path))
+    assert not embeddings.lm.has_decoder
+
+    with_decoder: FlairEmbeddings = FlairEmbeddings(str(forward_lm_path))
+    with_decoder.lm = LanguageModel.load_language_model(forward_lm_path)
+    assert with_decoder.lm.has_decoder
+
+    sentence, expected = Sentence('I love Berlin .'), Sentence('I love Berlin .')
+    embeddings.embed(sentence)
+    with_decoder.embed(expected)
+
+    for token, expected_token in zip(sentence, expected):
+        assert torch.equal(token.get_embedding(), expected_token.get_embedding())
+
+
+def test_concurrent_stacked_embeddings(word_vectors_path, forward_lm_path, backward_lm_path):
+    def make_stack(concurrent: bool) -> StackedEmbeddings:
+        return StackedEmbeddings([WordEmbeddings(str(word_vectors_path)),
+                                  FlairEmbeddings(str(forward_lm_path)),
+                                  FlairEmbeddings(str(backward_lm_path))], concurrent=concurrent)
+
+    texts = ['I love Berlin .', 'Berlin is a great place to live .']
+    sequential, concurrent = make_stack(False), make_stack(True)
+
+    expected = [Sentence(text) for text in texts]
+    sequential.embed(expected)
+
+    num_threads = torch.get_num_threads()
+    with torch.no_grad():
+        sentences = [Sentence(text) for text in texts]
+        concurrent.embed(sentences)
+    assert torch.get_num_threads() == num_threads
+
+    for sentence, expected_sentence in zip(sentences, expected):
+        for token, expected_token in zip(sentence, expected_sentence):
+            assert torch.equal(token.get_embedding(), expected_token.get_embedding())
+            # grad mode of the caller is used by the worker threads
+            assert not token.get_embedding().requires_grad
+
+    assert len(concurrent.embedding_times) == 3
+    assert all(seconds > 0 for seconds in concurrent.embedding_times.values())
+
+    # the thread pool is stopped and started again when needed
+    concurrent.close()
+    assert concurrent._executor is None
+    concurrent.embed([Sentence('I love Berlin')])
+    assert concurrent._executor is not None
+    concurrent.close()
+
+
+@pytest.mark.parametrize('pooling', ['fade', 'mean', 'min', 'max'])
+def test_pooled_flair_embeddings_memory(forward_lm_path, results_base_path, pooling):
+    embeddings: PooledFlairEmbeddings = PooledFlairEmbeddings(str(forward_lm_path), pooling=pooling)
+    embeddings.eval()
+
+    batches = [[Sentence('Berlin is in Germany , Berlin !'), Sentence('I love Berlin')],
+               [Sentence('Germany and Berlin')]]
+
+    # pool the contextual embeddings word by word, in order of occurrence
+    expected, counts = {}, {}
+    for batch in batches:
+        embeddings.embed(batch)
+        for sentence in batch:
+            for token in sentence:
+                local = token._embeddings[embeddings.context_embeddings.name]
+                if token.text not in expected:
+                    expected[token.text], counts[token.text] = local, 1
+                elif pooling in ['fade', 'mean']:
+                    expected[token.text] = expected[token.text] + local
+                    expected[token.text] = expected[token.text] / 2 if pooling == 'fade' else expected[token.text]
+                    counts[token.text] += 1
+                else:
+                    expected[token.text] = torch.max(expected[token.text], local) if pooling == 'max' \
+                        else torch.min(expected[token.text], local)
+
+        for sentence in batch:
+            for token in sentence:
+                pooled = expected[token.text] / counts[token.text] if pooling == 'mean' else expected[token.text]
+                assert torch.allclose(token._embeddings[embeddings.name], pooled, atol=1e-6)
+
+    # the memory can be saved and loaded into other embeddings for inference
+    memory_file = results_base_path / 'memory.pt'
+    results_base_path.mkdir(parents=True, exist_ok=True)
+    embeddings.save_memory(memory_file)
+
+    loaded: PooledFlairEmbeddings = PooledFlairEmbeddings(str(forward_lm_path), pooling=pooling)
+    loaded.eval()
+    loaded.load_memory(memory_file)
+    assert loaded.memory_words == embeddings.memory_words
+    assert torch.equal(loaded.memory[:len(loaded.memory_words)], embeddings.memory[:len(embeddings.memory_words)])
+
+    shutil.rmtree(results_base_path)
+
+
+@pytest.mark.parametrize('eviction', ['lru', 'lfu'])
+def test_pooled_flair_embeddings_eviction(forward_lm_path, eviction):
+    embeddings: PooledFlairEmbeddings = PooledFlairEmbeddings(str(forward_lm_path), memory_size=3, eviction=eviction)
+    embeddings.eval()
+
+    embeddings.embed(Sentence('Berlin Berlin Berlin'))
+    embeddings.embed(Sentence('Paris Rome'))
+    embeddings.embed(Sentence('Paris London'))
+
+    # Berlin is the least recently used word, Rome the least frequently used one
+    assert sorted(embeddings.memory_index) == (['London', 'Paris', 'Rome'] if eviction == 'lru'
+                                                else ['Berlin', 'London', 'Paris'])
+
+    embeddings.embed(Sentence('Madrid'))
+    assert sorted(embeddings.memory_index) == (['London', 'Madrid', 'Paris'] if eviction == 'lru'
+                                                else ['Berlin', 'Madrid', 'Paris'])
+    assert len(embeddings.memory_words) == 3
+
+    # words that do not fit into memory get their contextual embedding
+    sentence = Sentence('A B C D')
+    embeddings.embed(sentence)
+    assert len(embeddings.memory_index) == 3
+    for token in sentence:
+        assert token.get_embedding().shape[0] == embeddings.embedding_length
+
+
+@pytest.mark.parametrize('pooling_operation', ['first', 'mean'])
+def test_bert_embeddings(bert_model_path, pooling_operation):
+    embeddings: BertEmbeddings = BertEmbeddings(str(bert_model_path), layers='-1,-3',
+                                                pooling_operation=pooling_operation)
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlins are unbelievable !'), Sentence('Berlin')]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        # run BERT on the sentence alone
+        pieces = [embeddings.tokenizer.tokenize(token.text) for token in sentence]
+        input_ids = embeddings.tokenizer.convert_tokens_to_ids(
+            ['[CLS]'] + [piece for token_pieces in pieces for piece in token_pieces] + ['[SEP]'])
+        with torch.no_grad():
+            layers, _ = embeddings.model(torch.tensor([input_ids]))
+        subtoken_embeddings = torch.cat([layers[-1][0], layers[-3][0]], dim=1)
+
+        position = 1
+        for token, token_pieces in zip(sentence, pieces):
+            token_embeddings = subtoken_embeddings[position:position + len(token_pieces)]
+            expected = token_embeddings[0] if pooling_operation == 'first' else token_embeddings.mean(dim=0)
+            assert torch.allclose(token.get_embedding(), expected, atol=1e-5)
+            assert not token.get_embedding().requires_grad
+            position += len(token_pieces)
+
+    # word pieces are looked up once per word
+    assert len(embeddings._wordpiece_cache) == 8
+
+
+def test_bert_embeddings_sliding_window(bert_model_path):
+    # windows of 8 word pieces starting at 0, 4, 8 and 12
+    embeddings: BertEmbeddings = BertEmbeddings(str(bert_model_path), layers='-1', max_sequence_length=10, stride=4)
+
+    words = 'i love berlin and the year is great in berlin , i love to live in a great city !'.split()
+    sentence = Sentence(' '.join(words))
+    embeddings.embed(sentence)
+
+    def embed_window(start: int) -> torch.Tensor:
+        input_ids = embeddings.tokenizer.convert_tokens_to_ids(['[CLS]'] + words[start:start + 8] + ['[SEP]'])
+        with torch.no_grad():
+            layers, _ = embeddings.model(torch.tensor([input_ids]))
+        return layers[-1][0, 1:-1]
+
+    # each token takes its embedding from the window in which it is furthest from the borders
+    for index, start in [(0, 0), (5, 0), (6, 4), (9, 4), (10, 8), (14, 12), (19, 12)]:
+        assert torch.allclose(sentence[index].get_embedding(), embed_window(start)[index - start], atol=1e-5)
+
+
+@pytest.mark.parametrize('pooling_operation', ['first', 'mean'])
+def test_bert_embeddings_packed_sentences(bert_model_path, pooling_operation):
+    texts = ['I love Berlin .', 'Berlins are unbelievable !', 'Berlin', 'the year is great in Berlin , I love to live']
+
+    embeddings = BertEmbeddings(str(bert_model_path), pooling_operation=pooling_operation, max_sequence_length=16)
+    expected = [Sentence(text) for text in texts]
+    embeddings.embed(expected)
+
+    packed_embeddings = BertEmbeddings(str(bert_model_path), pooling_operation=pooling_operation,
+                                       max_sequence_length=16, pack_sentences=True)
+    sentences = [Sentence(text) for text in texts]
+    packed_embeddings.embed(sentences)
+
+    for sentence, expected_sentence in zip(sentences, expected):
+        for token, expected_token in zip(sentence, expected_sentence):
+            assert torch.allclose(token.get_embedding(), expected_token.get_embedding(), atol=1e-5)
+
+
+def test_transformer_xl_embeddings(transformer_xl_model_path):
+    embeddings: TransformerXLEmbeddings = TransformerXLEmbeddings(str(transformer_xl_model_path))
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin is a great city to live in !'), Sentence('hello')]
+    embeddings.embed(sentences)
+
+    for sentence in sentences:
+        # run the model on the sentence alone
+        input_ids = embeddings.tokenizer.convert_tokens_to_ids([token.text for token in sentence])
+        with torch.no_grad():
+            hidden_states, _ = embeddings.model(torch.tensor([input_ids]))
+
+        for token, expected in zip(sentence, hidden_states[0]):
+            assert torch.allclose(token.get_embedding(), expected, atol=1e-5)
+
+
+def test_transformer_xl_embeddings_carry_memory(transformer_xl_model_path):
+    embeddings: TransformerXLEmbeddings = TransformerXLEmbeddings(str(transformer_xl_model_path), carry_memory=True,
+                                                                  memory_length=6, segment_length=4)
+
+    batches = [[Sentence('I love Berlin .'), Sentence('Berlin is a great city')], [Sentence('to live in !')]]
+    for batch in batches:
+        embeddings.embed(batch)
+
+    # the recurrence memory is bounded
+    assert all(mems.size(0) == 6 for mems in embeddings._mems)
+
+    # run the model over the whole document, segment by segment
+    tokens = [token for batch in batches for sentence in batch for token in sentence]
+    input_ids = embeddings.tokenizer.convert_tokens_to_ids([token.text for token in tokens])
+    mems = None
+    for start in range(0, len(tokens), 4):
+        with torch.no_grad():
+            hidden_states, mems = embeddings.model(torch.tensor([input_ids[start:start + 4]]), mems=mems)
+        for token, expected in zip(tokens[start:start + 4], hidden_states[0]):
+            assert torch.allclose(token.get_embedding(), expected, atol=1e-5)
+
+    # after a reset, the context of earlier sentences is gone
+    embeddings.reset_memory()
+    sentence = Sentence('I love Berlin .')
+    embeddings.embed(sentence)
+    for token, expected_token in zip(sentence, batches[0][0]):
+        assert torch.allclose(token.get_embedding(), expected_token.get_embedding(), atol=1e-5)
+
+
+def test_embedding_cache_put_and_get(results_base_path):
+    cache = EmbeddingCache(results_base_path / 'cache', embedding_length=4, dtype='float16')
+
+    keys = [EmbeddingCache.make_key('I love Berlin'), EmbeddingCache.make_key('Berlin')]
+    rows = [np.arange(12, dtype=np.float32).reshape(3, 4), np.ones((1, 4), dtype=np.float32)]
+    cache.put_batch(keys, rows)
+
+    retrieved = cache.get_batch(keys + [EmbeddingCache.make_key('unknown')])
+    assert np.array_equal(retrieved[0], rows[0])
+    assert np.array_equal(retrieved[1], rows[1])
+    assert retrieved[2] is None
+    assert cache.hits == 2
+    assert cache.misses == 1
+
+    # entries survive re-opening the cache
+    cache.close()
+    cache = EmbeddingCache(results_base_path / 'cache', embedding_length=4, dtype='float16')
+    assert len(cache) == 2
+    assert np.array_equal(cache.get(keys[0]), rows[0])
+    cache.close()
+
+    # opening with a different configuration is an error
+    with pytest.raises(ValueError):
+        EmbeddingCache(results_base_path / 'cache', embedding_length=8)
+
+    shutil.rmtree(results_base_path)
+
+
+def test_embedding_cache_evicts_oldest_shards(results_base_path):
+    cache = EmbeddingCache(results_base_path / 'cache', embedding_length=4, max_size=16 * 3, shard_size=16 * 4)
+
+    keys = [EmbeddingCache.make_key(str(i)) for i in range(10)]
+    cache.put_batch(keys, [np.full((1, 4), i, dtype=np.float32) for i in range(10)])
+
+    assert cache.size <= cache.max_size
+    assert cache.evictions > 0
+    assert cache.get(keys[0]) is None
+    assert np.array_equal(cache.get(keys[9]), np.full((1, 4), 9, dtype=np.float32))
+    cache.close()
+
+    shutil.rmtree(results_base_path)
+
+
+def test_embedding_cache_with_max_size_below_shard_size(results_base_path):
+    cache = EmbeddingCache(results_base_path / 'cache', embedding_length=4, max_size=16 * 3)
+    assert cache.shard_size == cache.max_size
+
+    keys = [EmbeddingCache.make_key(str(i)) for i in range(10)]
+    for key, i in zip(keys, range(10)):
+        cache.put_batch([key], [np.full((1, 4), i, dtype=np.float32)])
+        assert cache.size <= cache.max_size + cache.shard_size
+
+    assert cache.evictions > 0
+    cache.close()
+
+    shutil.rmtree(results_base_path)
+
+
+def test_cached_word_embeddings(results_base_path, word_vectors_path):
+    embeddings: WordEmbeddings = WordEmbeddings(str(word_vectors_path))
+    embeddings.enable_cache(results_base_path / 'cache')
+
+    sentence: Sentence = Sentence('I love Berlin .')
+    embeddings.embed(sentence)
+    expected = [token.get_embedding() for token in sentence]
+    assert embeddings.embedding_cache.misses == 1
+
+    sentence = Sentence('I love Berlin .')
+    embeddings.embed(sentence)
+    assert embeddings.embedding_cache.hits == 1
+    for token, embedding in zip(sentence, expected):
+        assert torch.equal(token.get_embedding(), embedding)
+
+    embeddings.disable_cache()
+    shutil.rmtree(results_base_path)
+
+
+def test_cached_flair_embeddings(results_base_path, forward_lm_path):
+    embeddings: FlairEmbeddings = FlairEmbeddings(str(forward_lm_path), use_cache=True,
+                                                  cache_directory=results_base_path)
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin is a great place to live .')]
+    embeddings.embed(sentences)
+    expected = [token.get_embedding() for sentence in sentences for token in sentence]
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin is a great place to live .')]
+    embeddings.embed(sentences)
+    assert embeddings.embedding_cache.hits == 2
+    for token, embedding in zip([token for sentence in sentences for token in sentence], expected):
+        assert torch.allclose(token.get_embedding(), embedding)
+
+    embeddings.disable_cache()
+    shutil.rmtree(results_base_path)
+
+
 def init_document_embeddings():
     text = 'I love Berlin. Berlin is a great place to live.'
     sentence: Sentence = Sentence(text)
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+
+from benchmarks.imports import loaded_heavy_modules
+
+
+def test_import_does_not_load_heavy_modules():
+    # gensim, bpemb, pytorch_pretrained_bert, sklearn, matplotlib, mpld3 and hyperopt are imported when first used
+    statement = 'import flair, flair.embeddings, flair.models, flair.trainers, flair.hyperparameter'
+    assert loaded_heavy_modules(statement) == []
+
+
+def test_byte_pair_embeddings_class_is_defined_on_access():
+    code = 'import sys, flair.embeddings; assert "bpemb" not in sys.modules; ' \
+           'cls = flair.embeddings.BPEmbSerializable; assert "bpemb" in sys.modules; ' \
+           'assert cls is flair.embeddings.BPEmbSerializable and cls.__qualname__ == "BPEmbSerializable"'
+    subprocess.run([sys.executable, '-c', code], check=True)
@@ -60,3 +60,42 @@ def test_compute_perplexity():
     print(f'"{ungrammatical}" - perplexity is {perplexity_ungramamtical_sentence}')
 
     assert (perplexity_gramamtical_sentence < perplexity_ungramamtical_sentence)
+
+
+def test_save_load_language_model_without_decoder(forward_lm_path, tmp_path):
+    import pytest
+    import torch
+    from flair.models import LanguageModel
+
+    language_model: LanguageModel = LanguageModel.load_language_model(forward_lm_path)
+    language_model.save(tmp_path / 'encoder-only.pt', with_decoder=False)
+
+    encoder_only: LanguageModel = LanguageModel.load_language_model(tmp_path / 'encoder-only.pt')
+    assert encoder_only.decoder is None
+    assert (tmp_path / 'encoder-only.pt').stat().st_size < forward_lm_path.stat().st_size
+
+    strings = ['\nI love Berlin ', '\nBerlin is nice']
+    assert torch.equal(language_model.get_representation(strings), encoder_only.get_representation(strings))
+
+    with pytest.raises(ValueError):
+        encoder_only.generate_text(number_of_characters=10)
+
+
+def test_save_load_quantized_language_model(forward_lm_path, tmp_path):
+    import torch
+    from flair.models import LanguageModel
+    from flair.nn import QuantizedEmbedding
+
+    language_model: LanguageModel = LanguageModel.load_language_model(forward_lm_path)
+    strings = ['\nI love Berlin ', '\nBerlin is nice']
+    expected = language_model.get_representation(strings)
+
+    language_model.quantize('int8')
+    assert isinstance(language_model.encoder, QuantizedEmbedding)
+    language_model.save(tmp_path / 'int8.pt')
+
+    # the character table keeps its storage type when the model is loaded again
+    loaded: LanguageModel = LanguageModel.load_language_model(tmp_path / 'int8.pt')
+    assert loaded.encoder.weight.dtype == torch.int8
+    assert torch.equal(loaded.get_representation(strings), language_model.get_representation(strings))
+    assert torch.allclose(loaded.get_representation(strings), expected, atol=1e-2)
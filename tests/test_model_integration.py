@@ -8,7 +8,8 @@ from torch.optim.adam import Adam
 
 from flair.data import Dictionary, Sentence
 from flair.data_fetcher import NLPTaskDataFetcher, NLPTask
-from flair.embeddings import WordEmbeddings, TokenEmbeddings, FlairEmbeddings, DocumentRNNEmbeddings
+from flair.embeddings import WordEmbeddings, TokenEmbeddings, FlairEmbeddings, DocumentRNNEmbeddings, \
+    convert_word_vectors, quantize_embeddings
 from flair.models import SequenceTagger, TextClassifier, LanguageModel
 from flair.trainers import ModelTrainer
 from flair.trainers.language_model_trainer import LanguageModelTrainer, TextCorpus
@@ -48,6 +49,106 @@ def test_train_load_use_tagger(results_base_path, tasks_base_path):
     shutil.rmtree(results_base_path)
 
 
+@pytest.mark.integration
+def test_train_tagger_with_embedding_storage(results_base_path, tasks_base_path, word_vectors_path):
+    corpus = NLPTaskDataFetcher.load_corpus(NLPTask.FASHION, base_path=tasks_base_path)
+    tag_dictionary = corpus.make_tag_dictionary('ner')
+
+    embeddings = WordEmbeddings(str(word_vectors_path))
+
+    for storage_mode in ['fp16', 'disk', 'device']:
+        tagger: SequenceTagger = SequenceTagger(hidden_size=64,
+                                                embeddings=embeddings,
+                                                tag_dictionary=tag_dictionary,
+                                                tag_type='ner',
+                                                use_crf=False)
+
+        trainer: ModelTrainer = ModelTrainer(tagger, corpus)
+
+        trainer.train(results_base_path, EvaluationMetric.MICRO_F1_SCORE, learning_rate=0.1, mini_batch_size=2,
+                      max_epochs=2, test_mode=True, embeddings_storage_mode=storage_mode)
+
+        loaded_model: SequenceTagger = SequenceTagger.load_from_file(results_base_path / 'final-model.pt')
+        loaded_model.predict(Sentence('I love Berlin'))
+
+        # clean up results directory
+        shutil.rmtree(results_base_path)
+
+
+@pytest.mark.integration
+def test_train_closes_embedding_storage_on_error(results_base_path, tasks_base_path, word_vectors_path, monkeypatch):
+    corpus = NLPTaskDataFetcher.load_corpus(NLPTask.FASHION, base_path=tasks_base_path)
+    tag_dictionary = corpus.make_tag_dictionary('ner')
+
+    embeddings = WordEmbeddings(str(word_vectors_path))
+    tagger: SequenceTagger = SequenceTagger(hidden_size=64, embeddings=embeddings, tag_dictionary=tag_dictionary,
+                                            tag_type='ner', use_crf=False)
+
+    def fail(sentences):
+        assert embeddings.embedding_cache is not None
+        raise RuntimeError('training failed')
+
+    monkeypatch.setattr(tagger, 'forward_loss', fail)
+
+    trainer: ModelTrainer = ModelTrainer(tagger, corpus)
+    with pytest.raises(RuntimeError):
+        trainer.train(results_base_path, EvaluationMetric.MICRO_F1_SCORE, learning_rate=0.1, mini_batch_size=2,
+                      max_epochs=2, test_mode=True, embeddings_storage_mode='disk')
+
+    # the disk cache of the embedding storage is closed and detached
+    assert embeddings.embedding_cache is None
+
+    shutil.rmtree(results_base_path)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('dtype', ['float16', 'int8'])
+def test_quantized_tagger_accuracy(results_base_path, tasks_base_path, dtype):
+    import numpy as np
+
+    corpus = NLPTaskDataFetcher.load_corpus(NLPTask.FASHION, base_path=tasks_base_path)
+    tag_dictionary = corpus.make_tag_dictionary('ner')
+
+    # random vectors for all words of the corpus
+    words = sorted({token.text for sentence in corpus.get_all_sentences() for token in sentence})
+    vectors = np.random.RandomState(1).normal(0., 1., (len(words), 50))
+    vectors_file = results_base_path / 'vectors.vec'
+    results_base_path.mkdir(parents=True, exist_ok=True)
+    with open(vectors_file, 'w', encoding='utf-8') as f:
+        for word, vector in zip(words, vectors):
+            f.write(f'{word} {" ".join(str(value) for value in vector)}\n')
+
+    embeddings = WordEmbeddings(str(convert_word_vectors(vectors_file, results_base_path / 'vectors')))
+
+    tagger: SequenceTagger = SequenceTagger(hidden_size=64,
+                                            embeddings=embeddings,
+                                            tag_dictionary=tag_dictionary,
+                                            tag_type='ner',
+                                            use_crf=False)
+
+    trainer: ModelTrainer = ModelTrainer(tagger, corpus)
+    trainer.train(results_base_path, EvaluationMetric.MICRO_F1_SCORE, learning_rate=0.5, mini_batch_size=1,
+                  max_epochs=40)
+
+    sentences = list(corpus.train())
+    full_metric, _ = ModelTrainer.evaluate(tagger, sentences, embeddings_in_memory=False)
+    full_tags = [[token.get_tag('predicted').value for token in sentence] for sentence in sentences]
+
+    quantize_embeddings(tagger, dtype)
+    quantized_metric, _ = ModelTrainer.evaluate(tagger, sentences, embeddings_in_memory=False)
+    quantized_tags = [[token.get_tag('predicted').value for token in sentence] for sentence in sentences]
+
+    # the quantized tables change almost no prediction of the trained tagger
+    assert full_metric.micro_avg_f_score() > 0.3
+    agreement = np.mean([full == quantized for sentence_tags in zip(full_tags, quantized_tags)
+                         for full, quantized in zip(*sentence_tags)])
+    assert agreement >= 0.98
+    assert abs(full_metric.micro_avg_f_score() - quantized_metric.micro_avg_f_score()) <= 0.02
+
+    # clean up results directory
+    shutil.rmtree(results_base_path)
+
+
 @pytest.mark.integration
 def test_train_load_use_tagger_large(results_base_path, tasks_base_path):
     corpus = NLPTaskDataFetcher.load_corpus(NLPTask.UD_ENGLISH).downsample(0.05)
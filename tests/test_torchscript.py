@@ -0,0 +1,67 @@
+import pytest
+import torch
+
+from flair.data import Dictionary, Sentence
+from flair.embeddings import WordEmbeddings, DocumentRNNEmbeddings
+from flair.models import SequenceTagger, TextClassifier, ScriptedSequenceTagger, ScriptedTextClassifier
+
+TEXTS = ['I love Berlin .', 'Berlin is a great place to live .', 'the city', 'I', 'live in Berlin and love the year']
+
+
+def make_tag_dictionary() -> Dictionary:
+    tag_dictionary = Dictionary()
+    for tag in ['O', 'S-LOC', 'B-LOC', 'E-LOC', 'S-PER', '<START>', '<STOP>']:
+        tag_dictionary.add_item(tag)
+    return tag_dictionary
+
+
+def get_tags(sentences, tag_type: str):
+    return [[(token.get_tag(tag_type).value, token.get_tag(tag_type).score) for token in sentence]
+            for sentence in sentences]
+
+
+@pytest.mark.parametrize('use_crf', [True, False])
+def test_scripted_sequence_tagger_predicts_like_tagger(word_vectors_path, tmp_path, use_crf):
+    torch.manual_seed(1)
+    tagger = SequenceTagger(8, WordEmbeddings(str(word_vectors_path)), make_tag_dictionary(), 'ner',
+                            use_crf=use_crf, rnn_layers=2).eval()
+
+    expected = tagger.predict([Sentence(text) for text in TEXTS], mini_batch_size=2)
+
+    scripted = tagger.to_torchscript()
+    scripted.save(tmp_path / 'tagger.pt')
+    scripted = ScriptedSequenceTagger.load(tmp_path / 'tagger.pt')
+
+    actual = scripted.predict([Sentence(text) for text in TEXTS], mini_batch_size=2)
+
+    for expected_sentence, actual_sentence in zip(get_tags(expected, 'ner'), get_tags(actual, 'ner')):
+        assert [tag for tag, _ in expected_sentence] == [tag for tag, _ in actual_sentence]
+        assert [score for _, score in expected_sentence] == pytest.approx([score for _, score in actual_sentence],
+                                                                          abs=1e-5)
+
+
+@pytest.mark.skipif('forward' not in vars(torch.nn.RNNBase),
+                    reason='torch.nn.RNNBase cannot be run directly with this version of torch')
+@pytest.mark.parametrize('multi_label', [False, True])
+def test_scripted_text_classifier_predicts_like_classifier(word_vectors_path, tmp_path, multi_label):
+    label_dictionary = Dictionary(add_unk=False)
+    for label in ['city', 'love', 'time']:
+        label_dictionary.add_item(label)
+
+    torch.manual_seed(1)
+    document_embeddings = DocumentRNNEmbeddings([WordEmbeddings(str(word_vectors_path))], hidden_size=8,
+                                                bidirectional=True)
+    classifier = TextClassifier(document_embeddings, label_dictionary, multi_label).eval()
+
+    expected = classifier.predict([Sentence(text) for text in TEXTS], mini_batch_size=2)
+
+    scripted = classifier.to_torchscript()
+    scripted.save(tmp_path / 'classifier.pt')
+    scripted = ScriptedTextClassifier.load(tmp_path / 'classifier.pt')
+
+    actual = scripted.predict([Sentence(text) for text in TEXTS], mini_batch_size=2)
+
+    for expected_sentence, actual_sentence in zip(expected, actual):
+        assert expected_sentence.get_label_names() == actual_sentence.get_label_names()
+        assert [label.score for label in expected_sentence.labels] == \
+               pytest.approx([label.score for label in actual_sentence.labels], abs=1e-5)
@@ -1,6 +1,12 @@
-from flair.data import Dictionary
+import shutil
+
+import torch
+
+import flair
+from flair.data import Dictionary, Sentence
+from flair.embeddings import WordEmbeddings, CharacterEmbeddings, StackedEmbeddings
 from flair.trainers import ModelTrainer
-from flair.training_utils import convert_labels_to_one_hot, Metric
+from flair.training_utils import convert_labels_to_one_hot, Metric, EmbeddingStorage
 
 
 def test_metric_get_classes():
@@ -100,3 +106,86 @@ def test_convert_labels_to_one_hot():
     assert(one_hot[0][0] == 0)
     assert(one_hot[0][1] == 1)
     assert(one_hot[0][2] == 0)
+
+
+def test_embedding_storage_keeps_static_embeddings_in_half_precision(word_vectors_path, char_dictionary_path):
+    word_embeddings = WordEmbeddings(str(word_vectors_path))
+    embeddings = StackedEmbeddings([word_embeddings, CharacterEmbeddings(str(char_dictionary_path))])
+    storage = EmbeddingStorage(embeddings, 'fp16')
+
+    sentence = Sentence('I love Berlin .')
+    storage.prepare([sentence])
+    embeddings.embed(sentence)
+    expected = sentence[0]._embeddings[word_embeddings.name]
+    storage.store([sentence])
+
+    # only the static word embeddings are kept
+    assert list(sentence[0]._embeddings.keys()) == [word_embeddings.name]
+    assert sentence[0]._embeddings[word_embeddings.name].dtype == torch.float16
+    assert sentence[0].get_embedding().dtype == torch.float32
+    assert torch.allclose(sentence[0].get_embedding(), expected, atol=1e-3)
+    assert storage.memory_used == 4 * word_embeddings.embedding_length * 2
+
+    storage.prepare([sentence])
+    assert storage.reused == 1
+    assert storage.requested == 2
+
+
+def test_embedding_storage_evicts_least_recently_used_sentences(word_vectors_path):
+    embeddings = WordEmbeddings(str(word_vectors_path))
+    storage = EmbeddingStorage(embeddings, 'memory', max_memory=2 * 4 * embeddings.embedding_length * 4)
+
+    sentences = [Sentence('I love Berlin .'), Sentence('Berlin is a city'), Sentence('the city of Berlin')]
+    for sentence in sentences:
+        storage.prepare([sentence])
+        embeddings.embed(sentence)
+        storage.store([sentence])
+
+    assert storage.memory_used <= storage.max_memory
+    assert len(sentences[0][0]._embeddings) == 0
+    assert len(sentences[2][0]._embeddings) == 1
+
+
+def test_embedding_storage_on_disk(results_base_path, word_vectors_path):
+    embeddings = WordEmbeddings(str(word_vectors_path))
+    storage = EmbeddingStorage(embeddings, 'disk', directory=results_base_path / 'embeddings')
+
+    sentence = Sentence('I love Berlin .')
+    storage.prepare([sentence])
+    embeddings.embed(sentence)
+    expected = sentence[0].get_embedding()
+    storage.store([sentence])
+    assert len(sentence[0]._embeddings) == 0
+
+    storage.prepare([sentence])
+    embeddings.embed(sentence)
+    assert storage.reused == 1
+    assert embeddings.embedding_cache.hits == 1
+    assert torch.equal(sentence[0].get_embedding(), expected)
+
+    storage.close()
+    assert embeddings.embedding_cache is None
+
+    shutil.rmtree(results_base_path)
+
+
+def test_embedding_storage_on_device(word_vectors_path, monkeypatch):
+    word_embeddings = WordEmbeddings(str(word_vectors_path))
+    storage = EmbeddingStorage(word_embeddings, 'device')
+
+    # the meta device stands in for an accelerator, so that no embedding can silently end up on the CPU
+    monkeypatch.setattr(flair, 'device', torch.device('meta'))
+
+    sentence = Sentence('I love Berlin .')
+    storage.prepare([sentence])
+    word_embeddings.embed(sentence)
+    assert all(token._embeddings[word_embeddings.name].device.type == 'meta' for token in sentence)
+    assert sentence[0].get_embedding().device.type == 'meta'
+
+    # the embeddings of the mini-batch are freed and later embeddings go to the CPU again
+    storage.store([sentence])
+    assert all(len(token._embeddings) == 0 for token in sentence)
+    assert not sentence.is_embedded(word_embeddings.name)
+
+    word_embeddings.embed(sentence)
+    assert sentence[0]._embeddings[word_embeddings.name].device.type == 'cpu'